@@ -4,9 +4,9 @@ import time
 from typing import List, Dict, Any, Optional
 from threading import Lock
 
-import torch
-from transformers import AutoTokenizer
-from vllm import LLM, SamplingParams
+from metrics import MetricsRecorder
+from prompt_cache import PromptCache
+from tracing import Tracer
 
 
 class ArcticManager:
@@ -60,6 +60,8 @@ class ArcticManager:
               max_output_len: int = 8192,
               gpu_memory_utilization: float = 0.92,
               swap_space: int = 42,
+              enable_prefix_caching: bool = True,
+              backend: str = "vllm",
               **kwargs):
         """
         Initializes the ArcticManager instance.
@@ -74,7 +76,9 @@ class ArcticManager:
             max_output_len (int): Maximum output length
             gpu_memory_utilization (float): GPU memory utilization ratio
             swap_space (int): Swap space in GB
-            **kwargs: Additional parameters
+            enable_prefix_caching (bool): Reuse the KV cache of prompt prefixes shared between requests
+            backend (str): "vllm", or "fake" for the benchmark backend that needs no GPU
+            **kwargs: Additional parameters, passed to the fake backend
         """
         self.pretrained_model_name_or_path = pretrained_model_name_or_path
         self.tensor_parallel_size = tensor_parallel_size
@@ -84,8 +88,24 @@ class ArcticManager:
         self.max_input_len = max_input_len
         self.max_output_len = max_output_len
         
+        self.backend = backend
+        
         # 创建推理锁（区别于单例创建锁 _lock）
         self.inference_lock = Lock()
+
+        if backend == "fake":
+            # 基准测试用：不加载模型，按预置答案返回SQL
+            from benchmark.fake_arctic import FakeLLM, FakeSamplingParams, FakeTokenizer
+            self.tokenizer = FakeTokenizer()
+            self.stop_token_ids = []
+            self.sampling_params = FakeSamplingParams(temperature=self.temperature, max_tokens=self.max_output_len, n=self.n)
+            self.llm = FakeLLM(**kwargs)
+            self._initialized = True
+            print("ArcticManager initialized with the fake backend!")
+            return
+
+        from transformers import AutoTokenizer
+        from vllm import LLM, SamplingParams
         # Load tokenizer
         print(f"Loading tokenizer from {pretrained_model_name_or_path}...")
         self.tokenizer = AutoTokenizer.from_pretrained(
@@ -121,6 +141,7 @@ class ArcticManager:
             enforce_eager=True,
             disable_custom_all_reduce=True,
             trust_remote_code=True,
+            enable_prefix_caching=enable_prefix_caching,
         )
         
         self._initialized = True
@@ -216,30 +237,13 @@ Correct SQL query here
 ```
 </answer>""".strip()
         
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a data science expert. Below, you are provided with a database schema and a natural"
-                    " language question. Your task is to understand the schema and generate a valid SQL query to"
-                    " answer the question."
-                ),
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"""
-Database Engine:
+        schema_info = f"""Database Engine:
 SQLite
 
 Database Schema:
 {db_desc}
-This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints.
-
-Question:
-{question}
-
-Instructions:
+This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints."""
+        instructions = f"""Instructions:
 - **Each column name must be enclosed in double quotation marks just like they are in the schema, table name do not need, for example: "age"(column), university.info.student(table).** This is very important as it will directly affect whether your SQL can be executed.
 - Make sure you only output the information that is asked in the question. If the question asks for a specific column, make sure to only include that column in the SELECT clause, nothing more.
 - The generated query should return all of the information asked in the question without any missing or extra information.
@@ -247,10 +251,27 @@ Instructions:
 - Before generating the final SQL query, please think through the steps of how to write the query.
 
 Output Format:
-{instruct_info}
-    """.strip()
+{instruct_info}"""
+        if PromptCache().layout == "prefix":
+            # 固定不变的指令放在最前面，所有请求都共享这段前缀；db_desc 是按问题过滤后的 schema，
+            # 和问题一起放在最后，命中 vLLM 的 prefix caching
+            user_content = f"{instructions}\n\n{schema_info}\n\nQuestion:\n{question}"
+        else:
+            user_content = f"{schema_info}\n\nQuestion:\n{question}\n\n{instructions}"
+
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a data science expert. Below, you are provided with a database schema and a natural"
+                    " language question. Your task is to understand the schema and generate a valid SQL query to"
+                    " answer the question."
                 ),
             },
+            {
+                "role": "user",
+                "content": user_content,
+            },
         ]
         
         prompt = self.tokenizer.apply_chat_template(
@@ -262,8 +283,30 @@ Output Format:
         
         return prompt
 
+    @staticmethod
+    def _record_prefix_cache(prompts: List[str], outputs: List[Any], expected_cached: Optional[List[int]]) -> Dict[str, Any]:
+        """
+        Adds the prompts' expected and actual prefix-cached tokens to the PromptCache when it is
+        tracking (expected_cached is None otherwise). vLLM reports the actual ones as
+        num_cached_tokens (versions with prefix caching stats only).
+
+        Returns:
+            Dict[str, Any]: The batch totals for the "arctic" metric.
+        """
+        cached_total = None
+        for i, (prompt, output) in enumerate(zip(prompts, outputs)):
+            cached = getattr(output, "num_cached_tokens", None)
+            if expected_cached is not None:
+                prompt_tokens = len(getattr(output, "prompt_token_ids", None) or []) or len(prompt) // 4
+                PromptCache().observe("arctic", prompt_tokens, expected_cached[i], cached)
+            if cached is not None:
+                cached_total = (cached_total or 0) + cached
+        if expected_cached is None:
+            return {"cached_tokens": cached_total}
+        return {"expected_cached_tokens": sum(expected_cached), "cached_tokens": cached_total}
+
     def generate(self, prompts: List[str], 
-                 sampling_params: Optional[SamplingParams] = None,
+                 sampling_params: Optional["SamplingParams"] = None,
                  use_tqdm: bool = False) -> List[Dict[str, Any]]:
         """
         Generate responses for a list of prompts.
@@ -285,25 +328,31 @@ Output Format:
 
         # 记录等待开始时间
         thread_name = threading.current_thread().name
+        expected_cached = [PromptCache().expect("arctic", prompt, min_tokens=0, block=16)
+                           for prompt in prompts] if PromptCache().tracking else None
         wait_start = time.time()
         print(f"[{thread_name}] 等待推理锁... (Prompts数量: {len(prompts)})")
         
         # 用锁保护 vLLM 推理
         with self.inference_lock:
             wait_time = time.time() - wait_start
+            Tracer().record_span("inference_lock_wait", "arctic", wait_start, wait_time)
             print(f"[{thread_name}] 获取推理锁成功 (等待了 {wait_time:.2f}秒)")
             
             # 记录推理开始时间
             infer_start = time.time()
             
             # Generate outputs
-            outputs = self.llm.generate(prompts, sampling_params, use_tqdm=use_tqdm)
+            with Tracer().span("vllm_generate", "arctic", prompts=len(prompts)):
+                outputs = self.llm.generate(prompts, sampling_params, use_tqdm=use_tqdm)
             
             # 计算推理耗时
             infer_time = time.time() - infer_start
             print(f"[{thread_name}] vLLM推理完成 (耗时 {infer_time:.2f}秒)")
         
         print(f"[{thread_name}] 释放推理锁")
+        MetricsRecorder().record("arctic", lock_wait=wait_time, inference_time=infer_time, prompts=len(prompts),
+                                 **self._record_prefix_cache(prompts, outputs, expected_cached))
 
         # Parse results
         results = []
@@ -345,6 +394,7 @@ Output Format:
         # outputs = self.llm.generate([prompt], self.sampling_params, use_tqdm=False)
 
         thread_name = threading.current_thread().name
+        expected_cached = [PromptCache().expect("arctic", prompt, min_tokens=0, block=16)] if PromptCache().tracking else None
         # 记录等待开始时间
         wait_start = time.time()
         print(f"[{thread_name}] 等待推理锁... (单个推理)")
@@ -352,19 +402,23 @@ Output Format:
         # 用锁保护 vLLM 推理
         with self.inference_lock:
             wait_time = time.time() - wait_start
+            Tracer().record_span("inference_lock_wait", "arctic", wait_start, wait_time)
             print(f"[{thread_name}] 获取推理锁成功 (等待了 {wait_time:.2f}秒)")
             
             # 记录推理开始时间
             infer_start = time.time()
             
             # Generate
-            outputs = self.llm.generate([prompt], self.sampling_params, use_tqdm=False)
+            with Tracer().span("vllm_generate", "arctic", prompts=1):
+                outputs = self.llm.generate([prompt], self.sampling_params, use_tqdm=False)
             
             # 计算推理耗时
             infer_time = time.time() - infer_start
             print(f"[{thread_name}] vLLM推理完成 (耗时 {infer_time:.2f}秒)")
         
         print(f"[{thread_name}] 释放推理锁")
+        MetricsRecorder().record("arctic", lock_wait=wait_time, inference_time=infer_time, prompts=1,
+                                 **self._record_prefix_cache([prompt], outputs, expected_cached))
         
         # Parse responses
         responses = [o.text for o in outputs[0].outputs]
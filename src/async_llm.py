@@ -0,0 +1,259 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from cassette import Cassette
+from http_pool import HttpPool
+from prompt_cache import content_text
+from resilience import LLMHTTPError, Resilience, parse_retry_after
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket refilled continuously at `per_minute` tokens per minute, holding at
+    most one minute of tokens. Used for both requests-per-minute and tokens-per-minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float) -> None:
+        """Waits until `amount` tokens are available and takes them; larger than capacity waits for a full bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Takes (or with a negative amount, returns) tokens after the fact, e.g. estimated vs. actual usage."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AimdLimiter:
+    """
+    Limits concurrent requests of one model, adapting the limit AIMD-style: every success adds
+    1/limit (about +1 per round trip of the whole window), every 429 halves it and pauses new
+    requests until the Retry-After has passed.
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    # wait() 在暂停期间释放锁，release() 不会被挡住；超时或被唤醒后重新检查
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < max(int(self.limit), self.min_concurrency):
+                    self.in_flight += 1
+                    return
+                await self._condition.wait()
+
+    async def release(self, throttled: bool = False, retry_after: float = 0.0) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class ModelLimits:
+    """The concurrency limiter and rate buckets of one model."""
+
+    def __init__(self, max_concurrency: int = 8, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 min_concurrency: int = 1):
+        self.concurrency = AimdLimiter(max_concurrency, min_concurrency)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], n: int = 1, completion_tokens: int = 512) -> int:
+    """A rough request size for the tokens-per-minute bucket: 4 characters per prompt token plus n completions."""
+    prompt_chars = sum(len(content_text(m.get("content"))) for m in messages)
+    return prompt_chars // 4 + n * completion_tokens
+
+
+class AsyncLLMClient:
+    """
+    An asyncio chat-completions client for sending many requests at once without a thread per
+    request. It runs its own event loop in a background thread, so synchronous node code can hand
+    it a batch with complete_many() and wait for all the results.
+
+    Each model has a concurrency limit adapted with AIMD on 429 responses, and optional
+    requests-per-minute and tokens-per-minute buckets, set with configure(), e.g.
+
+        {"gpt-5": {"max_concurrency": 16, "rpm": 500, "tpm": 400000}, "default": {"max_concurrency": 8}}
+
+    Requests go through the Cassette like gpt_req's, and use HttpPool's timeouts and pool size.
+    """
+    _instance = None
+    _lock = Lock()
+    # configure() 设置，事件循环在第一次使用时才启动
+    limits_setup: Dict[str, Dict[str, Any]] = {}
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(AsyncLLMClient, cls).__new__(cls)
+                instance._init()
+                cls._instance = instance
+            return cls._instance
+
+    def _init(self) -> None:
+        self.limits: Dict[str, ModelLimits] = {}
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+        self.loop = asyncio.new_event_loop()
+        self._client = None
+        self._thread = threading.Thread(target=self.loop.run_forever, name="AsyncLLMClient-loop", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def configure(cls, limits_setup: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Sets the per-model limits; models without an entry use the "default" entry.
+
+        Args:
+            limits_setup (Dict[str, Dict[str, Any]]): {model: {"max_concurrency", "min_concurrency", "rpm", "tpm"}}
+        """
+        cls.limits_setup = dict(limits_setup or {})
+
+    def _model_limits(self, model: str) -> ModelLimits:
+        # 只在事件循环线程中调用，asyncio 原语需要在循环里创建
+        if model not in self.limits:
+            setup = self.limits_setup.get(model, self.limits_setup.get("default", {}))
+            self.limits[model] = ModelLimits(**setup)
+        return self.limits[model]
+
+    def _http_client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(HttpPool.read_timeout, connect=HttpPool.connect_timeout),
+                limits=httpx.Limits(max_connections=HttpPool.pool_size,
+                                    max_keepalive_connections=HttpPool.pool_size if HttpPool.keep_alive else 0),
+            )
+        return self._client
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Request counters and the current AIMD concurrency limit of every model."""
+        return {**self.stats, **{f"limit {model}": round(limits.concurrency.limit, 2) for model, limits in list(self.limits.items())}}
+
+    async def acomplete(self, url: str, key: str, scope: str, model: str, messages: List[Dict[str, Any]],
+                        **params: Any) -> Dict[str, Any]:
+        """
+        Sends one chat-completions request within the model's limits, retrying 429s and failures
+        under the run's Resilience policy.
+
+        Returns:
+            Dict[str, Any]: The response JSON, with "_elapsed" (seconds) and "_retries" added.
+
+        Raises:
+            LLMRequestError: If the request failed for good (see Resilience.after_failure).
+        """
+        cassette = Cassette()
+        start_time = time.perf_counter()
+        if cassette.mode == "replay":
+            response, delay = cassette.lookup(scope, model, messages, **params)
+            await asyncio.sleep(delay)
+            return {**response, "_elapsed": time.perf_counter() - start_time, "_retries": 0}
+
+        limits = self._model_limits(model)
+        resilience = Resilience()
+        estimate = estimate_tokens(messages, params.get("n") or 1)
+        payload = {"model": model, "messages": messages, **params}
+        attempt = 0
+        while True:
+            resilience.before_attempt(url, attempt)
+            if limits.requests is not None:
+                await limits.requests.acquire(1)
+            if limits.tokens is not None:
+                await limits.tokens.acquire(estimate)
+            await limits.concurrency.acquire()
+            throttled, retry_after = False, 0.0
+            request_start = time.perf_counter()
+            try:
+                response = await self._http_client().post(url, json=payload, headers={"Authorization": key})
+                self.stats["requests"] += 1
+                if response.status_code >= 400:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After")) or 0.0
+                    throttled = response.status_code == 429
+                    raise LLMHTTPError(response.status_code, response.text[:200], retry_after)
+                result = response.json()
+                if "choices" not in result:
+                    raise LLMHTTPError(response.status_code, json.dumps(result, ensure_ascii=False)[:200])
+            except Exception as e:
+                if throttled:
+                    self.stats["throttled"] += 1
+                else:
+                    self.stats["errors"] += 1
+                error = e
+            else:
+                error = None
+            finally:
+                await limits.concurrency.release(throttled, retry_after)
+
+            if error is None:
+                resilience.after_success(url)
+                usage = result.get("usage") or {}
+                if limits.tokens is not None and usage:
+                    limits.tokens.adjust(usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0) - estimate)
+                if cassette.mode == "record":
+                    cassette.store(scope, model, messages, result, time.perf_counter() - request_start, **params)
+                return {**result, "_elapsed": time.perf_counter() - start_time, "_retries": attempt}
+            # 退避时间、重试预算和熔断与同步请求共用 Resilience 的策略
+            delay = resilience.after_failure(url, error, attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def submit(self, url: str, key: str, scope: str, model: str, messages: List[Dict[str, Any]], **params: Any) -> Future:
+        """Schedules one request on the client's loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(self.acomplete(url, key, scope, model, messages, **params), self.loop)
+
+    def complete_many(self, url: str, key: str, scope: str, model: str, requests: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Sends a batch of requests concurrently and waits for all of them.
+
+        Args:
+            requests (List[Dict[str, Any]]): One dict per request with "messages" and sampling parameters.
+
+        Returns:
+            List[Any]: The response JSON of each request, or the exception it raised, in input order.
+        """
+        futures = [self.submit(url, key, scope, model, **request) for request in requests]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
@@ -0,0 +1,52 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from benchmark.mock_llm_server import CannedAnswers
+
+
+@dataclass
+class FakeSamplingParams:
+    """Stands in for vllm.SamplingParams."""
+    temperature: float = 1.0
+    max_tokens: int = 8192
+    n: int = 1
+    stop_token_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class FakeCompletion:
+    text: str
+
+
+@dataclass
+class FakeRequestOutput:
+    outputs: List[FakeCompletion]
+
+
+class FakeTokenizer:
+    """Stands in for the HF tokenizer: renders chat messages as plain text."""
+
+    def apply_chat_template(self, messages: List[Dict[str, Any]], add_generation_prompt: bool = True, tokenize: bool = False) -> str:
+        return "\n".join(f"<|{m['role']}|>\n{m['content']}" for m in messages) + ("\n<|assistant|>\n" if add_generation_prompt else "")
+
+
+class FakeLLM:
+    """
+    Stands in for vllm.LLM in ArcticManager(backend="fake"): each generate() call sleeps for
+    `latency` seconds and answers every prompt with n canned SQLs.
+    """
+
+    def __init__(self, answers_file: str = None, latency: float = 0.0, accuracy: float = 0.8, seed: int = 0, **kwargs):
+        self.answers = CannedAnswers(answers_file, accuracy, seed)
+        self.latency = latency
+
+    def generate(self, prompts: List[str], sampling_params: FakeSamplingParams, use_tqdm: bool = False) -> List[FakeRequestOutput]:
+        time.sleep(self.latency)
+        return [
+            FakeRequestOutput([
+                FakeCompletion(f"<think>canned</think>\n<answer>\n```sql\n{self.answers.sql_for(prompt)}\n```\n</answer>")
+                for _ in range(sampling_params.n or 1)
+            ])
+            for prompt in prompts
+        ]
@@ -0,0 +1,331 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class LatencyDistribution:
+    """
+    Parses a latency spec and samples seconds from it:
+
+        "fixed:0.5"            always 0.5s
+        "uniform:0.2:1.5"      uniform between 0.2s and 1.5s
+        "lognormal:0.8:0.5"    lognormal with median 0.8s and sigma 0.5
+        "exponential:0.6"      exponential with mean 0.6s
+    """
+
+    def __init__(self, spec: str):
+        kind, *params = spec.split(":")
+        values = [float(p) for p in params]
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2, "exponential": 1}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.values = values
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.values)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(self.values[0]), self.values[1])
+        return rng.expovariate(1 / self.values[0])
+
+
+class CannedAnswers:
+    """
+    The answers of a synthetic dataset (see synthetic_dataset.py), looked up by the question text
+    found in a prompt. The gold SQL is returned with probability `accuracy`, otherwise a wrong one,
+    so samples of the same question disagree now and then like real LLM samples do.
+    """
+
+    def __init__(self, answers_file: Optional[str], accuracy: float = 0.8, seed: int = 0):
+        self.answers: Dict[str, Dict[str, Any]] = {}
+        if answers_file:
+            with open(answers_file, "r", encoding="utf-8") as f:
+                self.answers = json.load(f)
+        # 长的问题优先匹配，避免一个问题是另一个问题的前缀
+        self.questions = sorted(self.answers, key=len, reverse=True)
+        self.accuracy = accuracy
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sql_for(self, text: str) -> str:
+        """Returns a SQL for the question contained in text, or a trivial query for unknown prompts."""
+        for question in self.questions:
+            if question in text:
+                answer = self.answers[question]
+                with self._lock:
+                    if not answer["wrong"] or self._rng.random() < self.accuracy:
+                        return answer["gold"]
+                    return self._rng.choice(answer["wrong"])
+        return "SELECT 1"
+
+
+def completion_text(sql: str, explanation_words: int = 0) -> str:
+    """
+    A response every node can parse: a ReAct final answer with a ```sql block and a ```text rule
+    block, followed by explanation_words words of explanation like chatty models add.
+    """
+    text = (
+        "Think: The question maps directly onto the schema.\n"
+        "Final Answer:\n"
+        f"```sql\n{sql}\n```\n"
+        "```text\nNo additional rule.\n```"
+    )
+    if explanation_words:
+        words = "the query filters the rows first and then aggregates them".split()
+        text += "\nExplanation: " + " ".join(words[i % len(words)] for i in range(explanation_words))
+    return text
+
+
+def stream_chunks(text: str) -> List[str]:
+    """Splits a completion into word-sized stream deltas, roughly one token each."""
+    chunks, start = [], 0
+    for i, char in enumerate(text):
+        if char in " \n" and i + 1 > start:
+            chunks.append(text[start:i + 1])
+            start = i + 1
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+def message_text(content: Any) -> str:
+    """The text of a message content: a string, or a list of content parts."""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return "" if content is None else str(content)
+
+
+class MockLLMServer:
+    """
+    A local stand-in for an OpenAI-compatible chat-completions endpoint, for benchmarking the
+    pipeline without network access or API cost.
+
+    Every request sleeps for a latency drawn from the configured distribution, fails with
+    probability error_rate, and otherwise answers with a canned SQL for the question in the prompt.
+    With max_n set, at most max_n choices are returned whatever n asks for, like providers
+    without multi-sample support.
+
+    The latency is the time to the first token; every generated token (about one word) adds
+    token_latency seconds. Requests with "stream": true get server-sent events, one delta per
+    token, and the usage in a final chunk when stream_options.include_usage is set.
+
+    With prefix_cache, the usage reports prompt_tokens_details.cached_tokens like OpenAI's automatic
+    prompt caching: the longest prefix shared with an earlier prompt, if at least 1024 tokens, in
+    steps of 128 tokens.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0.0", error_rate: float = 0.0,
+                 error_status: int = 500, answers_file: Optional[str] = None, accuracy: float = 0.8, seed: int = 0,
+                 max_n: Optional[int] = None, token_latency: float = 0.0, explanation_words: int = 0,
+                 prefix_cache: bool = False):
+        self.latency = LatencyDistribution(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.answers = CannedAnswers(answers_file, accuracy, seed)
+        self.max_n = max_n
+        self.token_latency = token_latency
+        self.explanation_words = explanation_words
+        self.prefix_cache = prefix_cache
+        self._prompts: List[str] = []
+        self._rng = random.Random(seed + 1)
+        self._rng_lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "choices": 0, "streamed_tokens": 0, "cancelled_streams": 0, "cached_tokens": 0}
+        self._stats_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="MockLLMServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, **increments: int) -> None:
+        with self._stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def respond(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        """Builds the status code, JSON body and extra headers of one request."""
+        failed, choices, prompt_tokens, cached_tokens = self._generate(body)
+        if failed:
+            return failed
+        completion_tokens = sum(len(stream_chunks(c["message"]["content"])) for c in choices)
+        time.sleep(completion_tokens * self.token_latency)
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": choices,
+            "usage": self._usage(prompt_tokens, completion_tokens, cached_tokens),
+        }, {}
+
+    def _usage(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> Dict[str, Any]:
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if self.prefix_cache:
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+        return usage
+
+    def _cached_tokens(self, prompt: str) -> int:
+        with self._stats_lock:
+            shared = 0
+            for previous in self._prompts:
+                low, high = 0, min(len(prompt), len(previous))
+                while low < high:  # 二分查找最长公共前缀
+                    mid = (low + high + 1) // 2
+                    low, high = (mid, high) if prompt[:mid] == previous[:mid] else (low, mid - 1)
+                shared = max(shared, low)
+            self._prompts = (self._prompts + [prompt])[-64:]
+        tokens = shared // 4 // 128 * 128
+        return tokens if tokens >= 1024 else 0
+
+    def _generate(self, body: Dict[str, Any]):
+        """Sleeps until the first token and returns (error response or None, choices, prompt tokens, cached tokens)."""
+        with self._rng_lock:
+            latency = self.latency.sample(self._rng)
+            failed = self._rng.random() < self.error_rate
+        time.sleep(latency)
+        if failed:
+            self._count(requests=1, errors=1)
+            headers = {"Retry-After": "1"} if self.error_status == 429 else {}
+            return (self.error_status, {"error": {"message": "injected failure", "type": "mock_error"}}, headers), [], 0, 0
+
+        messages: List[Dict[str, Any]] = body.get("messages", [])
+        prompt = "\n".join(message_text(m.get("content")) for m in messages)
+        n = int(body.get("n") or 1)
+        if self.max_n:
+            n = min(n, self.max_n)
+        choices = [
+            {"index": i, "message": {"role": "assistant", "content": completion_text(self.answers.sql_for(prompt), self.explanation_words)},
+             "finish_reason": "stop"}
+            for i in range(n)
+        ]
+        cached_tokens = self._cached_tokens(prompt) if self.prefix_cache else 0
+        self._count(requests=1, choices=n, cached_tokens=cached_tokens)
+        return None, choices, max(1, len(prompt) // 4), cached_tokens
+
+    def stream(self, body: Dict[str, Any], write) -> Optional[Tuple[int, Dict[str, Any], Dict[str, str]]]:
+        """
+        Streams the completion of one request as server-sent events through write(bytes).
+
+        Returns:
+            The error response if the request failed before streaming started, else None.
+        """
+        failed, choices, prompt_tokens, cached_tokens = self._generate(body)
+        if failed:
+            return failed
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        sent = 0
+
+        def event(payload):
+            write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        try:
+            for choice in choices:
+                for chunk in stream_chunks(choice["message"]["content"]):
+                    event({"id": completion_id, "object": "chat.completion.chunk", "model": body.get("model", "mock"),
+                           "choices": [{"index": choice["index"], "delta": {"content": chunk}, "finish_reason": None}]})
+                    sent += 1
+                    time.sleep(self.token_latency)
+                event({"id": completion_id, "object": "chat.completion.chunk",
+                       "choices": [{"index": choice["index"], "delta": {}, "finish_reason": "stop"}]})
+            if (body.get("stream_options") or {}).get("include_usage"):
+                event({"id": completion_id, "object": "chat.completion.chunk", "choices": [],
+                       "usage": self._usage(prompt_tokens, sent, cached_tokens)})
+            write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self._count(cancelled_streams=1)  # 客户端拿到需要的内容后提前断开
+        self._count(streamed_tokens=sent)
+        return None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    body = {}
+                if body.get("stream"):
+                    failed = server.stream(body, self._start_stream)
+                    if failed is None:
+                        return
+                    status, payload, headers = failed
+                else:
+                    status, payload, headers = server.respond(body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _start_stream(self, data):
+                if not getattr(self, "_streaming", False):
+                    # 不知道总长度，用 Connection: close 结束响应
+                    self._streaming = True
+                    self.close_connection = True
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                self.wfile.write(data)
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass  # 不打印每个请求
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat-completions server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=str, default="lognormal:0.8:0.5", help="fixed:S | uniform:A:B | lognormal:MEDIAN:SIGMA | exponential:MEAN")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--error_status", type=int, default=500)
+    parser.add_argument("--answers_file", type=str, default=None, help="answers.json written by synthetic_dataset.py")
+    parser.add_argument("--accuracy", type=float, default=0.8, help="Probability of answering with the gold SQL")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max_n", type=int, default=None, help="Return at most this many choices, to mimic providers without n support")
+    parser.add_argument("--token_latency", type=float, default=0.0, help="Seconds per generated token after the first")
+    parser.add_argument("--explanation_words", type=int, default=0, help="Words of explanation after the SQL in every answer")
+    parser.add_argument("--prefix_cache", action="store_true", help="Report cached prompt tokens like OpenAI's automatic prompt caching")
+    args = parser.parse_args()
+    mock = MockLLMServer(args.host, args.port, args.latency, args.error_rate, args.error_status,
+                         args.answers_file, args.accuracy, args.seed, args.max_n, args.token_latency,
+                         args.explanation_words, args.prefix_cache).start()
+    print(f"[mock-llm] listening on {mock.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+SRC_DIRECTORY = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SRC_DIRECTORY))
+
+from benchmark.mock_llm_server import MockLLMServer  # noqa: E402
+from benchmark.synthetic_dataset import generate  # noqa: E402
+from metrics import PERCENTILES  # noqa: E402
+
+DEFAULT_PIPELINE_NODES = "schema_linking+schema_linking_info+sql_generation+sql_style_refinement+sql_output_refinement+sql_selection"
+
+
+def default_pipeline_setup(engine: str) -> Dict[str, Any]:
+    return {
+        "schema_linking": {"engine": engine, "n": 5, "temperature": [1.0, 0.4, 0.1]},
+        "schema_linking_info": {"engine": engine, "n": 4, "temperature": [1.0, 0.4, 0.1]},
+        "sql_generation": {"engine": engine},
+        "sql_style_refinement": {"engine": engine},
+        "sql_output_refinement": {"engine": engine},
+        "sql_selection": {"engine": engine},
+    }
+
+
+def run_pipeline(dataset: Dict[str, str], workers: int, run_directory: Path, mock_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs main.py once with the given worker count and returns its wall time and metrics report."""
+    run_directory.mkdir(parents=True, exist_ok=True)
+    output_file = run_directory / "final_prediction.json"
+    metrics_file = run_directory / "metrics.json"
+    command = [
+        sys.executable, "main.py",
+        "--mode", "dev",
+        "--input_file", dataset["input_file"],
+        "--output_file", str(output_file),
+        "--db_root_path", dataset["db_root_path"],
+        "--pipeline_nodes", args.pipeline_nodes,
+        "--pipeline_setup", args.pipeline_setup,
+        "--num_workers", str(workers),
+        "--scheduler", args.scheduler,
+        "--arctic_backend", "fake",
+        "--fake_arctic_answers", dataset["answers_file"],
+        "--fake_arctic_latency", str(args.arctic_latency),
+        "--n", str(args.arctic_n),
+        "--metrics_file", str(metrics_file),
+        "--result_root", str(run_directory / "results"),
+        *args.extra_args,
+    ]
+    env = {**os.environ, "LLM_API_URL": mock_url, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "mock-key")}
+    print(f"[benchmark] workers={workers}: {' '.join(command[1:])}")
+    start_time = time.perf_counter()
+    with (run_directory / "main.log").open("w", encoding="utf-8") as log:
+        process = subprocess.run(command, cwd=SRC_DIRECTORY, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wall_time = time.perf_counter() - start_time
+    if process.returncode != 0:
+        raise RuntimeError(f"main.py failed with exit code {process.returncode}, see {run_directory / 'main.log'}")
+    with metrics_file.open("r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {"workers": workers, "wall_time": wall_time, "metrics": report}
+
+
+def summarize(run: Dict[str, Any]) -> Dict[str, Any]:
+    """Questions/hour, question latency percentiles and per-node latency percentiles of one run."""
+    summary = run["metrics"]["summary"]
+    question_times = summary.get("question", {}).get("wall_time", {})
+    questions = question_times.get("count", 0)
+    llm = summary.get("llm", {})
+    return {
+        "workers": run["workers"],
+        "questions": questions,
+        "wall_time": run["wall_time"],
+        "questions_per_hour": questions / run["wall_time"] * 3600 if run["wall_time"] else 0.0,
+        "question_latency": {f"p{p}": question_times.get(f"p{p}", 0.0) for p in PERCENTILES},
+        "queue_wait": {f"p{p}": summary.get("question", {}).get("queue_wait", {}).get(f"p{p}", 0.0) for p in PERCENTILES},
+        "node_latency": {group.split(":", 1)[1]: {f"p{p}": fields["wall_time"][f"p{p}"] for p in PERCENTILES}
+                         for group, fields in summary.items() if group.startswith("node:") and "wall_time" in fields},
+        "llm_calls": llm.get("wall_time", {}).get("count", 0),
+        "llm_retries": int(llm.get("retries", {}).get("total", 0)),
+    }
+
+
+def format_report(summaries: List[Dict[str, Any]]) -> str:
+    lines = ["workers  questions  wall(s)    q/hour  speedup  efficiency  q.p50(s)  q.p90(s)  q.p99(s)  wait.p90(s)  llm_calls  retries"]
+    base = summaries[0]
+    for s in summaries:
+        speedup = s["questions_per_hour"] / base["questions_per_hour"] if base["questions_per_hour"] else 0.0
+        efficiency = speedup / (s["workers"] / base["workers"])
+        latency = s["question_latency"]
+        lines.append(f"{s['workers']:>7}  {s['questions']:>9}  {s['wall_time']:>7.1f}  {s['questions_per_hour']:>8.1f}  "
+                     f"{speedup:>7.2f}  {efficiency:>10.2f}  {latency['p50']:>8.2f}  {latency['p90']:>8.2f}  "
+                     f"{latency['p99']:>8.2f}  {s['queue_wait']['p90']:>11.2f}  {s['llm_calls']:>9}  {s['llm_retries']:>7}")
+    for s in summaries:
+        lines.append("")
+        lines.append(f"node latency (s), workers={s['workers']}")
+        width = max([len(node) for node in s["node_latency"]] + [4])
+        lines.append(f"{'node'.ljust(width)}  " + "  ".join(f"p{p:>6}" for p in PERCENTILES))
+        for node, latency in s["node_latency"].items():
+            lines.append(f"{node.ljust(width)}  " + "  ".join(f"{latency[f'p{p}']:>7.2f}" for p in PERCENTILES))
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark main.py end to end against a local mock LLM server and the fake Arctic backend."
+    )
+    parser.add_argument("--output_directory", type=str, default=None, help="Defaults to benchmark_runs/<timestamp>.")
+    parser.add_argument("--workers", type=str, default="1,2,4,8", help="Comma-separated worker counts to compare.")
+    parser.add_argument("--num_questions", type=int, default=40)
+    parser.add_argument("--num_databases", type=int, default=5)
+    parser.add_argument("--latency", type=str, default="lognormal:0.8:0.5", help="Mock LLM latency, see LatencyDistribution.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of mock LLM requests that fail.")
+    parser.add_argument("--error_status", type=int, default=500, help="HTTP status of the injected failures, e.g. 429.")
+    parser.add_argument("--accuracy", type=float, default=0.8, help="Probability that a canned answer is the gold SQL.")
+    parser.add_argument("--arctic_latency", type=float, default=1.0, help="Seconds per fake Arctic generate call.")
+    parser.add_argument("--arctic_n", type=int, default=4, help="Candidates per fake Arctic call.")
+    parser.add_argument("--engine", type=str, default="gpt-4o-mini", help="Model name used in the default pipeline setup.")
+    parser.add_argument("--pipeline_nodes", type=str, default=DEFAULT_PIPELINE_NODES)
+    parser.add_argument("--pipeline_setup", type=str, default=None, help="Defaults to run.sh's setup with --engine.")
+    parser.add_argument("--scheduler", type=str, choices=["batch", "queue"], default="queue")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("extra_args", nargs=argparse.REMAINDER, help="Passed to main.py after '--', e.g. -- --executor linear")
+    args = parser.parse_args()
+    args.extra_args = [a for a in args.extra_args if a != "--"]
+    if args.pipeline_setup is None:
+        args.pipeline_setup = json.dumps(default_pipeline_setup(args.engine))
+
+    output_directory = Path(args.output_directory or Path("benchmark_runs") / datetime.now().strftime("%Y-%m-%d-%H-%M-%S")).resolve()
+    dataset = generate(str(output_directory / "data"), args.num_databases, args.num_questions, seed=args.seed)
+
+    mock = MockLLMServer(latency=args.latency, error_rate=args.error_rate, error_status=args.error_status,
+                         answers_file=dataset["answers_file"], accuracy=args.accuracy, seed=args.seed).start()
+    print(f"[benchmark] mock LLM server at {mock.url} (latency {args.latency}, error rate {args.error_rate})")
+    summaries = []
+    try:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            run = run_pipeline(dataset, workers, output_directory / f"workers_{workers}", mock.url, args)
+            summaries.append(summarize(run))
+    finally:
+        mock.stop()
+
+    report = format_report(summaries)
+    print(report)
+    with (output_directory / "benchmark_report.json").open("w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "mock_server": mock.stats, "runs": summaries}, f, indent=2)
+    with (output_directory / "benchmark_report.txt").open("w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    print(f"[benchmark] mock server stats: {mock.stats}")
+    print(f"[benchmark] report written to {output_directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
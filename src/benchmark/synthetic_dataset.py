@@ -0,0 +1,152 @@
+import argparse
+import json
+import random
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+CITIES = ["Berlin", "Lisbon", "Osaka", "Toronto", "Nairobi", "Lima", "Oslo", "Hanoi"]
+FIRST_NAMES = ["Ada", "Bao", "Chen", "Dara", "Emil", "Farah", "Goran", "Hana", "Ivan", "Jia"]
+CATEGORIES = ["books", "games", "music", "tools", "garden"]
+
+DDL = """CREATE TABLE customers (
+    `customer_id` INTEGER PRIMARY KEY,
+    `name` TEXT,
+    `city` TEXT,
+    `age` INTEGER
+);
+CREATE TABLE orders (
+    `order_id` INTEGER PRIMARY KEY,
+    `customer_id` INTEGER,
+    `category` TEXT,
+    `amount` REAL,
+    `year` INTEGER,
+    FOREIGN KEY (`customer_id`) REFERENCES customers(`customer_id`)
+);"""
+
+# 在 db_desc 基础上加列的取值示例，对应真实数据里的 db_desc_info
+DDL_INFO_COMMENTS = """
+-- customers.city examples: {cities}
+-- orders.category examples: {categories}
+-- orders.year range: 2015 - 2024"""
+
+
+def question_templates(rng: random.Random) -> List[Tuple[str, str, List[str], str]]:
+    """Returns (question, gold SQL, wrong SQLs, difficulty) candidates for one database."""
+    city = rng.choice(CITIES)
+    category = rng.choice(CATEGORIES)
+    year = rng.randint(2015, 2024)
+    age = rng.randint(20, 60)
+    return [
+        (f"How many customers live in {city}?",
+         f"SELECT COUNT(*) FROM customers WHERE city = '{city}'",
+         [f"SELECT COUNT(*) FROM customers WHERE city LIKE '{city[:2]}%'", "SELECT COUNT(*) FROM customers"],
+         "simple"),
+        (f"What is the total amount of {category} orders in {year}?",
+         f"SELECT SUM(amount) FROM orders WHERE category = '{category}' AND year = {year}",
+         [f"SELECT SUM(amount) FROM orders WHERE category = '{category}'", f"SELECT AVG(amount) FROM orders WHERE year = {year}"],
+         "simple"),
+        (f"Which customer older than {age} spent the most on orders?",
+         "SELECT T1.name FROM customers AS T1 INNER JOIN orders AS T2 ON T1.customer_id = T2.customer_id "
+         f"WHERE T1.age > {age} GROUP BY T1.customer_id ORDER BY SUM(T2.amount) DESC LIMIT 1",
+         ["SELECT T1.name FROM customers AS T1 INNER JOIN orders AS T2 ON T1.customer_id = T2.customer_id "
+          "GROUP BY T1.customer_id ORDER BY SUM(T2.amount) DESC LIMIT 1"],
+         "moderate"),
+        (f"List the names of customers in {city} who placed a {category} order.",
+         f"SELECT DISTINCT T1.name FROM customers AS T1 INNER JOIN orders AS T2 ON T1.customer_id = T2.customer_id "
+         f"WHERE T1.city = '{city}' AND T2.category = '{category}'",
+         [f"SELECT T1.name FROM customers AS T1 INNER JOIN orders AS T2 ON T1.customer_id = T2.customer_id "
+          f"WHERE T1.city = '{city}'"],
+         "moderate"),
+        (f"What is the average order amount of customers aged {age} or younger in {year}?",
+         f"SELECT AVG(T2.amount) FROM customers AS T1 INNER JOIN orders AS T2 ON T1.customer_id = T2.customer_id "
+         f"WHERE T1.age <= {age} AND T2.year = {year}",
+         [f"SELECT AVG(amount) FROM orders WHERE year = {year}"],
+         "challenging"),
+    ]
+
+
+def create_database(path: Path, rng: random.Random, customers: int, orders: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(DDL)
+        conn.executemany(
+            "INSERT INTO customers VALUES (?, ?, ?, ?)",
+            [(i, f"{rng.choice(FIRST_NAMES)} {i}", rng.choice(CITIES), rng.randint(18, 80)) for i in range(1, customers + 1)],
+        )
+        conn.executemany(
+            "INSERT INTO orders VALUES (?, ?, ?, ?, ?)",
+            [(i, rng.randint(1, customers), rng.choice(CATEGORIES), round(rng.uniform(5, 500), 2), rng.randint(2015, 2024))
+             for i in range(1, orders + 1)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def generate(output_directory: str, num_databases: int = 5, num_questions: int = 50, customers: int = 200,
+             orders: int = 2000, mode: str = "dev", seed: int = 42) -> Dict[str, str]:
+    """
+    Writes a small BIRD-shaped benchmark: SQLite databases under {output}/bird/{mode}/{mode}_databases,
+    the question file main.py reads, and the canned answers used by the mock LLM server and the fake Arctic backend.
+
+    Returns:
+        Dict[str, str]: The paths of "db_root_path", "input_file" and "answers_file".
+    """
+    rng = random.Random(seed)
+    output_directory = Path(output_directory)
+    db_root_path = output_directory / "bird"
+    db_ids = [f"synthetic_shop_{i}" for i in range(num_databases)]
+    for db_id in db_ids:
+        create_database(db_root_path / mode / f"{mode}_databases" / db_id / f"{db_id}.sqlite", rng, customers, orders)
+
+    db_desc_info = DDL + DDL_INFO_COMMENTS.format(cities=", ".join(CITIES), categories=", ".join(CATEGORIES))
+    dataset: List[Dict[str, Any]] = []
+    answers: Dict[str, Dict[str, Any]] = {}
+    attempts = 0
+    while len(dataset) < num_questions and attempts < num_questions * 20:
+        attempts += 1
+        db_id = db_ids[len(dataset) % num_databases]
+        question, gold, wrong, difficulty = rng.choice(question_templates(rng))
+        question = f"{question} ({db_id})"  # 不同数据库的相同问题也要能区分
+        if question in answers:
+            continue
+        answers[question] = {"db_id": db_id, "gold": gold, "wrong": wrong}
+        dataset.append({
+            "question_id": len(dataset),
+            "db_id": db_id,
+            "question": question,
+            "evidence": "",
+            "SQL": gold,
+            "difficulty": difficulty,
+            "db_desc": DDL,
+            "db_desc_info": db_desc_info,
+            "fd_list": [],
+            "consistency_redundant_columns": [],
+            "inconsistency_redundant_columns": [],
+            "example": "",
+        })
+
+    input_file = output_directory / f"{mode}_synthetic.json"
+    answers_file = output_directory / "answers.json"
+    with input_file.open("w", encoding="utf-8") as f:
+        json.dump(dataset, f, indent=2, ensure_ascii=False)
+    with answers_file.open("w", encoding="utf-8") as f:
+        json.dump(answers, f, indent=2, ensure_ascii=False)
+    print(f"[synthetic] {len(dataset)} questions over {num_databases} databases in {output_directory}")
+    return {"db_root_path": str(db_root_path), "input_file": str(input_file), "answers_file": str(answers_file)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic BIRD-shaped dataset for benchmarking.")
+    parser.add_argument("--output_directory", type=str, required=True)
+    parser.add_argument("--num_databases", type=int, default=5)
+    parser.add_argument("--num_questions", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.output_directory, args.num_databases, args.num_questions, args.customers, args.orders, seed=args.seed)
@@ -0,0 +1,215 @@
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from resilience import LLMRequestError
+
+# 每百万 token 的价格(美元)
+MODEL_PRICING = {
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+    "gpt-4": {"input": 30.00, "output": 60.00},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
+    "gemini-2.5-pro": {"input": 1.25, "output": 10.00},
+    "gpt-5": {"input": 1.25, "output": 10.00},
+    "claude-sonnet-4-20250514": {"input": 3.00, "output": 15.00},
+    "gpt-5-codex": {"input": 0.73, "output": 5.84},
+    "qwen3-coder-plus": {"input": 0.6, "output": 2.4},
+}
+
+# 超出预算后默认跳过的精修节点
+DEFAULT_SKIP_NODES = ["sql_style_refinement", "sql_output_refinement"]
+
+# 超出预算后 ReAct 循环(sql_generation)的迭代上限和历史压缩设置
+DEFAULT_MAX_ITERATIONS = 2
+DEFAULT_COMPACTION = {"keep_recent": 1}
+
+
+def token_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """The dollar cost of a request, or None if the model has no price."""
+    pricing = MODEL_PRICING.get(model.lower())
+    if pricing is None:
+        return None
+    return (prompt_tokens / 1_000_000) * pricing["input"] + (completion_tokens / 1_000_000) * pricing["output"]
+
+
+class BudgetExceeded(LLMRequestError):
+    """Raised before sending an LLM request once a cap is reached and the policy is to stop."""
+
+
+class CostAccountant:
+    """
+    A singleton adding up the tokens and dollars of every LLM call of the run, per question and
+    in total, and enforcing the configured caps.
+
+    When a question or the run reaches a cap, the degradation policy applies to the rest of that
+    question (or to every question, for run caps):
+
+        "skip_nodes": nodes recorded as skipped instead of run, passing the latest candidates on
+            (default: the refinement nodes; the final node always runs)
+        "max_n": the sampling nodes' n is lowered to this
+        "max_iterations": the ReAct loop of sql_generation stops after this many tool steps
+            (default 2 instead of 6) and then asks for the final answer
+        "compaction": the ReAct history compaction used from then on (default {"keep_recent": 1},
+            see ReactTranscript) when the node has none configured
+        "hard_stop": LLM requests raise BudgetExceeded instead of being sent
+
+    Without hard_stop, a degraded question still sends requests: sql_generation runs one ReAct
+    loop per candidate, so its spend is bounded by max_n candidates times max_iterations + 1
+    requests, not by the cap itself. LLM requests are checked against the caps only when they
+    are about to be sent; responses served from the ResponseCache cost nothing and are allowed.
+    """
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(CostAccountant, cls).__new__(cls)
+                instance.configure()
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, run_tokens: Optional[int] = None, run_cost: Optional[float] = None,
+                  question_tokens: Optional[int] = None, question_cost: Optional[float] = None,
+                  policy: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Sets the caps and the degradation policy; caps left None are not enforced.
+
+        Args:
+            run_tokens (int, optional): Prompt + completion tokens of the whole run.
+            run_cost (float, optional): Dollars of the whole run.
+            question_tokens (int, optional): Prompt + completion tokens of one question.
+            question_cost (float, optional): Dollars of one question.
+            policy (Dict[str, Any], optional): "skip_nodes", "max_n", "max_iterations", "compaction" and
+                "hard_stop", see the class docstring.
+        """
+        self.caps = {"run_tokens": run_tokens, "run_cost": run_cost,
+                     "question_tokens": question_tokens, "question_cost": question_cost}
+        self.policy = {"skip_nodes": DEFAULT_SKIP_NODES, "max_n": 1, "max_iterations": DEFAULT_MAX_ITERATIONS,
+                       "compaction": DEFAULT_COMPACTION, "hard_stop": False, **(policy or {})}
+        self.run = self._empty_totals()
+        self.questions: Dict[str, Dict[str, float]] = {}
+        self.degraded: Dict[str, str] = {}  # question_id -> 触发降级的上限
+        self.unpriced_models: set = set()
+        self._totals_lock = Lock()
+
+    @staticmethod
+    def _empty_totals() -> Dict[str, float]:
+        return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "tokens": 0, "cost": 0.0}
+
+    def charge(self, question_id: str, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """
+        Adds one LLM response to the totals.
+
+        Returns:
+            float: The cost of the response, 0 for models without a price.
+        """
+        cost = token_cost(model, prompt_tokens, completion_tokens)
+        with self._totals_lock:
+            if cost is None and model not in self.unpriced_models:
+                self.unpriced_models.add(model)
+                print(f"警告: 未找到模型 {model} 的价格信息，费用按0计")
+            for totals in (self.run, self.questions.setdefault(question_id, self._empty_totals())):
+                totals["calls"] += 1
+                totals["prompt_tokens"] += prompt_tokens
+                totals["completion_tokens"] += completion_tokens
+                totals["tokens"] += prompt_tokens + completion_tokens
+                totals["cost"] += cost or 0.0
+        return cost or 0.0
+
+    def exceeded(self, question_id: str) -> Optional[str]:
+        """Returns the first cap the question or the run has reached, or None."""
+        with self._totals_lock:
+            question = self.questions.get(question_id, self._empty_totals())
+            for cap, totals, field in (("run_tokens", self.run, "tokens"), ("run_cost", self.run, "cost"),
+                                       ("question_tokens", question, "tokens"), ("question_cost", question, "cost")):
+                if self.caps[cap] is not None and totals[field] >= self.caps[cap]:
+                    if question_id not in self.degraded:
+                        self.degraded[question_id] = cap
+                        print(f"question id:{question_id} 达到预算上限 {cap}={self.caps[cap]}，开始降级")
+                    return cap
+        return None
+
+    def check(self, question_id: str) -> None:
+        """Raises BudgetExceeded if a cap is reached and the policy stops LLM requests."""
+        if self.policy.get("hard_stop"):
+            cap = self.exceeded(question_id)
+            if cap is not None:
+                raise BudgetExceeded(f"LLM budget {cap}={self.caps[cap]} reached for question {question_id}")
+
+    def skip_node(self, node_name: str, question_id: str, is_final: bool) -> Optional[str]:
+        """Returns the reached cap if the policy skips this node for the question, else None."""
+        if is_final or node_name not in self.policy.get("skip_nodes", []):
+            return None
+        return self.exceeded(question_id)
+
+    def degrade_config(self, config: Dict[str, Any], question_id: str) -> Dict[str, Any]:
+        """
+        Returns the node setup degraded once a cap is reached: n (and the adaptive sampling limits)
+        lowered to max_n, the ReAct loop limited to max_iterations and compacted.
+        """
+        if self.exceeded(question_id) is None:
+            return config
+        degraded = dict(config)  # 节点配置是所有任务共用的，不能原地修改
+        max_n = self.policy.get("max_n")
+        if self.policy.get("max_iterations"):
+            degraded["max_iterations"] = min(config.get("max_iterations", self.policy["max_iterations"]),
+                                             self.policy["max_iterations"])
+        if self.policy.get("compaction") and not config.get("compaction"):
+            degraded["compaction"] = self.policy["compaction"]
+        if not max_n:
+            return degraded
+        if "n" in degraded:
+            degraded["n"] = min(degraded["n"], max_n)
+        if degraded.get("adaptive"):
+            adaptive = dict(degraded["adaptive"])
+            adaptive["max"] = min(adaptive.get("max", max_n), max_n)
+            adaptive["min"] = min(adaptive.get("min", 1), adaptive["max"])
+            degraded["adaptive"] = adaptive
+        return degraded
+
+    def progress(self) -> str:
+        """The run totals for the progress line."""
+        with self._totals_lock:
+            run = dict(self.run)
+            degraded = len(self.degraded)
+        text = f"LLM {run['calls']} 次, {run['tokens'] / 1000:.1f}k tokens, ${run['cost']:.4f}"
+        if self.caps["run_cost"] is not None:
+            text += f" / ${self.caps['run_cost']:.2f}"
+        if self.caps["run_tokens"] is not None:
+            text += f" / {self.caps['run_tokens'] / 1000:.0f}k tokens"
+        if degraded:
+            text += f", 降级 {degraded} 个问题"
+        return text
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Run totals, caps and degraded questions, for the run metrics."""
+        with self._totals_lock:
+            return {**self.run, **{f"cap {cap}": value for cap, value in self.caps.items() if value is not None},
+                    "degraded_questions": len(self.degraded), "unpriced_models": sorted(self.unpriced_models)}
+
+    def per_question(self) -> Dict[str, Dict[str, Any]]:
+        """The totals of every question, with the cap that degraded it if any."""
+        with self._totals_lock:
+            return {question_id: {**totals, "degraded_by": self.degraded.get(question_id)}
+                    for question_id, totals in self.questions.items()}
+
+
+def budget_skip_result(execution_history: List[Dict[str, Any]], cap: str) -> Dict[str, Any]:
+    """
+    Builds the history entry of a node skipped by the budget policy. Like a short-circuited
+    node, it passes the latest candidates on so the following nodes still have input.
+    """
+    for step in reversed(execution_history):
+        if isinstance(step.get("sqls"), list) and step.get("status") in ("success", "skipped"):
+            sqls = step["sqls"]
+            break
+    else:
+        sqls = []
+    return {
+        "sqls": sqls,
+        "rules": [""] * len(sqls),
+        "status": "skipped",
+        "skip_reason": f"budget {cap}",
+    }
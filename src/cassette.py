@@ -0,0 +1,164 @@
+import hashlib
+import json
+import random
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Tuple
+
+from tracing import Tracer
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recorded response matches a request."""
+
+
+def request_key(model: str, messages: Any, **params: Any) -> str:
+    """
+    A canonical hash of a chat request: model, messages and sampling parameters, with dict keys sorted.
+    Parameters set to None are left out, so an omitted top_p and top_p=None hash the same.
+    """
+    payload = {"model": model, "messages": messages, **{k: v for k, v in params.items() if v is not None}}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    A singleton record/replay store for LLM responses.
+
+    In "record" mode every successful response is appended to "{directory}/cassette.jsonl". In
+    "replay" mode all *.jsonl files of the directory are loaded and requests are answered from
+    them without touching the network.
+
+    A request is identified by its request_key plus an occurrence number within its scope
+    (the question being processed): the k-th identical request of a question, e.g. the k-th
+    sample at the same temperature, replays the k-th recorded response.
+    """
+    FILE_NAME = "cassette.jsonl"
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(Cassette, cls).__new__(cls)
+                instance.mode = "off"
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, mode: str, directory: str = "cassettes", latency: str = "none", synthetic_latency: float = 1.0) -> None:
+        """
+        Configures the cassette.
+
+        Args:
+            mode (str): "off", "record" or "replay".
+            directory (str, optional): Where cassette files are written and read.
+            latency (str, optional): Replay latency: "none", "recorded" (sleep as long as the
+                recorded request took) or "synthetic" (uniform around synthetic_latency).
+            synthetic_latency (float, optional): The mean synthetic latency in seconds.
+        """
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if latency not in ("none", "recorded", "synthetic"):
+            raise ValueError(f"Unknown replay latency: {latency}")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.latency = latency
+        self.synthetic_latency = synthetic_latency
+        self.entries: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+        self._occurrences: Dict[Tuple[str, str], int] = {}
+        self._state_lock = Lock()
+        if mode == "record":
+            self.directory.mkdir(parents=True, exist_ok=True)
+        elif mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        if not self.directory.is_dir():
+            raise ValueError(f"Cassette directory does not exist: {self.directory}")
+        for path in sorted(self.directory.glob("*.jsonl")):
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self.entries[(entry["scope"], entry["key"], entry["occurrence"])] = entry
+        print(f"从 {self.directory} 加载了 {len(self.entries)} 条 LLM 响应")
+
+    def _next_occurrence(self, scope: str, key: str) -> int:
+        with self._state_lock:
+            occurrence = self._occurrences.get((scope, key), 0)
+            self._occurrences[(scope, key)] = occurrence + 1
+            return occurrence
+
+    def send(self, send_request: Callable[[], Dict[str, Any]], scope: str, model: str, messages: Any, **params: Any) -> Dict[str, Any]:
+        """
+        Sends one request through the cassette.
+
+        Args:
+            send_request (Callable): Performs the real request and returns the response JSON.
+            scope (str): The occurrence scope, usually the question id.
+            model (str): The model name.
+            messages (Any): The chat messages.
+            **params: The sampling parameters.
+
+        Returns:
+            Dict[str, Any]: The response JSON.
+
+        Raises:
+            CassetteMiss: In replay mode, if the request was not recorded.
+        """
+        if self.mode == "off":
+            return send_request()
+        if self.mode == "replay":
+            response, delay = self.lookup(scope, model, messages, **params)
+            if delay:
+                Tracer().sleep(delay, reason="replay")
+            return response
+
+        start_time = time.perf_counter()
+        response = send_request()
+        self.store(scope, model, messages, response, time.perf_counter() - start_time, **params)
+        return response
+
+    def lookup(self, scope: str, model: str, messages: Any, **params: Any) -> Tuple[Dict[str, Any], float]:
+        """
+        Finds the recorded response of a request in replay mode, without sleeping.
+
+        Returns:
+            Tuple[Dict[str, Any], float]: The response JSON and the replay latency in seconds.
+
+        Raises:
+            CassetteMiss: If the request was not recorded.
+        """
+        key = request_key(model, messages, **params)
+        occurrence = self._next_occurrence(scope, key)
+        entry = self.entries.get((scope, key, occurrence))
+        if entry is None:
+            raise CassetteMiss(f"No recorded response for {model} request {key[:12]} #{occurrence} of question {scope}")
+        delay = 0.0
+        if self.latency == "recorded":
+            delay = entry["latency"]
+        elif self.latency == "synthetic":
+            rng = random.Random(f"{key}:{occurrence}")  # 同一请求每次回放的延迟相同
+            delay = self.synthetic_latency * rng.uniform(0.5, 1.5)
+        return entry["response"], delay
+
+    def store(self, scope: str, model: str, messages: Any, response: Dict[str, Any], latency: float, **params: Any) -> None:
+        """Appends a response to the cassette file in record mode."""
+        if self.mode != "record" or "choices" not in response:  # 只记录成功的响应，失败的请求会被重试
+            return
+        key = request_key(model, messages, **params)
+        entry = {
+            "scope": scope,
+            "key": key,
+            "occurrence": self._next_occurrence(scope, key),
+            "model": model,
+            "params": params,
+            "latency": latency,
+            "response": response,
+        }
+        with self._state_lock:
+            with (self.directory / self.FILE_NAME).open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
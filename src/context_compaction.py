@@ -0,0 +1,168 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from prompt_cache import content_text
+
+# 每条消息的格式开销(role、分隔符)，按 OpenAI 的计数方式估计
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> Any:
+    # tiktoken 是可选依赖，没有安装或取不到编码表时按 4 个字符一个 token 估计
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """The tokens of a text, counted with tiktoken if installed, else estimated as 4 characters per token."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4o") -> int:
+    """The prompt tokens of chat messages, see count_tokens."""
+    return sum(count_tokens(content_text(m.get("content")), model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def shorten(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars] + " ..."
+
+
+def observation_digest(observation: Any, max_chars: int = 200) -> str:
+    """
+    A short form of a tool observation: the status of an execute_sql result with its row count and
+    the first rows, or the beginning of any other observation.
+    """
+    if isinstance(observation, tuple) and len(observation) == 2:
+        status, text = observation
+        text = str(text)
+        rows = re.search(r"returned (\d+) rows", text)
+        if rows:
+            preview = text.split("rows is:", 1)[1] if "rows is:" in text else ""
+            return f"{status}: {rows.group(1)} rows, first rows {shorten(preview, max_chars)}"
+        if status == "Execute Failed":
+            return f"{status}: {shorten(text, max_chars)}"
+        returned = re.search(r"returned `([^`]*)`", text)
+        return f"{status}: returned {returned.group(1)}" if returned else str(status)
+    return shorten(str(observation), max_chars)
+
+
+def action_of(response: str, max_chars: int = 200) -> str:
+    """The last Action and ActionInput of a ReAct response, or its beginning if it has none."""
+    start = response.rfind("Action:")
+    return response[start:].strip() if start >= 0 else shorten(response, max_chars)
+
+
+class ReactTranscript:
+    """
+    The conversation of a ReAct tool loop (gpt_req.get_ans_with_tool): the initial messages (system
+    prompt, schema and question) and one step per iteration: the model's response, the tool
+    observation if it called a tool, and the follow-up user prompt.
+
+    Without compaction, messages() resends every step verbatim, so each iteration costs the whole
+    history again. With compaction, the initial messages and the keep_recent latest steps stay
+    verbatim, older observations are shortened to observation_digest, and if the request is still
+    above max_prompt_tokens, older responses are cut to their Action/ActionInput and then the oldest
+    steps are dropped. The initial messages and the latest steps are never cut, so a request may
+    still exceed the ceiling when they alone do.
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]], model: str = "gpt-4o", compaction: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            messages (List[Dict[str, Any]]): The initial messages, kept verbatim.
+            model (str, optional): The model, for counting tokens.
+            compaction (Dict[str, Any], optional): {"keep_recent": 1, "max_prompt_tokens": None,
+                "digest_chars": 200}; None resends the full history.
+        """
+        self.messages_head = messages
+        self.model = model
+        self.compaction = compaction
+        self.steps: List[Dict[str, Any]] = []
+        self.stats = {"full_tokens": 0, "sent_tokens": 0, "compacted_steps": 0, "dropped_steps": 0}
+
+    def add_step(self, response: str, observation: Any, prompt: str, result: Any = None) -> None:
+        """
+        Adds an iteration; observation is None when the model called no tool. The digest of a
+        compacted observation is made from result, the raw tool result, when given.
+        """
+        self.steps.append({"response": response, "observation": observation, "prompt": prompt,
+                           "result": observation if result is None else result})
+
+    @staticmethod
+    def _step_messages(step: Dict[str, Any], level: int, digest_chars: int) -> List[Dict[str, Any]]:
+        # level 0: 原样; 1: 观察结果缩短为摘要; 2: 回答也只保留 Action/ActionInput
+        response = step["response"] if level < 2 else action_of(step["response"], digest_chars)
+        if step["observation"] is not None:
+            observation = step["observation"] if level == 0 else observation_digest(step["result"], digest_chars)
+            response += f"\nObservation: {observation}"
+        return [{"role": "assistant", "content": response}, {"role": "user", "content": step["prompt"]}]
+
+    @staticmethod
+    def _with_note(message: Dict[str, Any], note: str) -> Dict[str, Any]:
+        # content 可能是字符串，也可能是带 cache_control 的 content parts，原有部分保持不变
+        content = message.get("content")
+        if isinstance(content, list):
+            return {**message, "content": content + [{"type": "text", "text": f"\n\n{note}"}]}
+        return {**message, "content": f"{content_text(content)}\n\n{note}"}
+
+    def _build(self, older: List[Dict[str, Any]], recent: List[Dict[str, Any]], level: int, dropped: int,
+               digest_chars: int, final_prompt: Optional[str]) -> List[Dict[str, Any]]:
+        messages = list(self.messages_head)
+        if dropped:
+            # 说明附加在最后一条初始消息的末尾，不单独成为一条消息，避免出现连续两条 user 消息
+            messages[-1] = self._with_note(messages[-1], f"({dropped} earlier tool steps omitted)")
+        for step in older[dropped:]:
+            messages += self._step_messages(step, level, digest_chars)
+        for step in recent:
+            messages += self._step_messages(step, 0, digest_chars)
+        if final_prompt is not None:
+            messages.append({"role": "user", "content": final_prompt})
+        return messages
+
+    def messages(self, final_prompt: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        The messages of the next request, compacted as configured.
+
+        Args:
+            final_prompt (str, optional): A last user message asking for the final answer.
+        """
+        full = self._build([], self.steps, 0, 0, 0, final_prompt)
+        if not self.compaction:
+            return full
+        keep_recent = self.compaction.get("keep_recent", 1)
+        max_tokens = self.compaction.get("max_prompt_tokens")
+        digest_chars = self.compaction.get("digest_chars", 200)
+        split = max(len(self.steps) - keep_recent, 0)
+        older, recent = self.steps[:split], self.steps[split:]
+
+        messages = self._build(older, recent, 1, 0, digest_chars, final_prompt)
+        tokens = count_message_tokens(messages, self.model)
+        dropped = 0
+        if max_tokens is not None and tokens > max_tokens:
+            messages = self._build(older, recent, 2, 0, digest_chars, final_prompt)
+            tokens = count_message_tokens(messages, self.model)
+            while tokens > max_tokens and dropped < len(older):
+                dropped += 1
+                messages = self._build(older, recent, 2, dropped, digest_chars, final_prompt)
+                tokens = count_message_tokens(messages, self.model)
+            if tokens > max_tokens:
+                print(f"ReAct 上下文压缩后仍有 {tokens} tokens，超过上限 {max_tokens}(schema 和最新一步不压缩)")
+        self.stats["full_tokens"] += count_message_tokens(full, self.model)
+        self.stats["sent_tokens"] += tokens
+        self.stats["compacted_steps"] += len(older) - dropped
+        self.stats["dropped_steps"] += dropped
+        return messages
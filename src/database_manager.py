@@ -3,31 +3,36 @@ import pickle
 from threading import Lock
 from pathlib import Path
 
-from typing import Callable, Dict, List, Any
+from typing import Callable, Dict, List, Any, Tuple
 from execution import compare_sqls
+from task_context import TaskContext
 
 
 class DatabaseManager:
     """
-    A singleton class to manage database operations including schema generation, 
-    querying LSH and vector databases, and managing column profiles.
+    Holds the database paths of one db_id.
+
+    Instances are immutable and cached per (db_mode, db_root_path, db_id), so concurrent
+    tasks on different databases never overwrite each other's paths. Calling
+    DatabaseManager() without arguments returns the manager of the current task.
     """
-    _instance = None
+    _instances: Dict[Tuple[str, str, str], "DatabaseManager"] = {}
     _lock = Lock()
 
     def __new__(cls, db_mode=None,db_root_path=None,db_id=None):
         if (db_mode is not None) and (db_root_path is not None) and(db_id is not None):
+            key = (db_mode, str(db_root_path), db_id)
             with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super(DatabaseManager, cls).__new__(cls)
-                    cls._instance._init(db_mode, db_root_path,db_id)
-                elif cls._instance.db_id != db_id:
-                    cls._instance._init(db_mode,db_root_path,db_id)
-                return cls._instance
+                if key not in cls._instances:
+                    instance = super(DatabaseManager, cls).__new__(cls)
+                    instance._init(db_mode, db_root_path, db_id)
+                    cls._instances[key] = instance
+                return cls._instances[key]
         else:
-            if cls._instance is None:
+            try:
+                return TaskContext.current().database_manager
+            except ValueError:
                 raise ValueError("DatabaseManager instance has not been initialized yet.")
-            return cls._instance
 
     def _init(self, db_mode: str, db_root_path:str,db_id: str):
         """
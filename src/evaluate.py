@@ -35,7 +35,6 @@ warnings.simplefilter(action="ignore", category=FutureWarning)
 
 random.seed(42)
 
-execution_results = None
 evaluation_results = None
 
 DO_PRINT = True
@@ -226,30 +225,32 @@ def execute_callback_evaluate_sql(result):
     sys.stderr.flush()
 
 
-def execute_callback_execute_sqls(result):
+def execute_callback_execute_sqls(result, results):
     data_idx, db_file, sql, query_result, valid = result
     # if DO_PRINT:
     #     print("Done:", data_idx)  # Print the progress
 
-    execution_results.append(
+    results.append(
         {"data_idx": data_idx, "db_file": db_file, "sql": sql, "query_result": query_result, "valid": valid}
     )
 
 
 def execute_sqls_parallel(db_files, sqls, num_cpus=1, timeout=1):
+    # 结果收集在本次调用自己的列表里，多个任务并发投票时互不干扰
+    results = []
     pool = mp.Pool(processes=num_cpus)
     for data_idx, db_file, sql in zip(list(range(len(sqls))), db_files, sqls):
         pool.apply_async(
-            execute_sql_wrapper, args=(data_idx, db_file, sql, timeout), callback=execute_callback_execute_sqls
+            execute_sql_wrapper, args=(data_idx, db_file, sql, timeout),
+            callback=lambda result: execute_callback_execute_sqls(result, results)
         )
     pool.close()
     pool.join()
+    return results
 
 
 def mark_invalid_sqls(db_files, sqls):
-    global execution_results
-    execution_results = []
-    execute_sqls_parallel(db_files, sqls, num_cpus=20, timeout=10)
+    execution_results = execute_sqls_parallel(db_files, sqls, num_cpus=20, timeout=10)
     execution_results = sorted(execution_results, key=lambda x: x["data_idx"])
 
     for idx, res in enumerate(execution_results):
@@ -259,11 +260,9 @@ def mark_invalid_sqls(db_files, sqls):
 
 
 def major_voting(db_files, pred_sqls, sampling_num, return_random_one_when_all_errors=True):
-    global execution_results
     mj_pred_sqls = []
-    execution_results = []
     # execute all sampled SQL queries to obtain their execution results
-    execute_sqls_parallel(db_files, pred_sqls, num_cpus=20, timeout=5)
+    execution_results = execute_sqls_parallel(db_files, pred_sqls, num_cpus=20, timeout=5)
     execution_results = sorted(execution_results, key=lambda x: x["data_idx"])
     if DO_PRINT:
         print("len(execution_results):", len(execution_results))
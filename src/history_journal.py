@@ -0,0 +1,154 @@
+import argparse
+import json
+import queue
+import threading
+from collections import defaultdict
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+
+from logger import make_serial
+
+
+class HistoryJournal:
+    """
+    An append-only JSONL journal of node results for one result directory.
+
+    node_decorator hands each finished step to append(), which only enqueues it; a background
+    writer thread serialises the step and appends one line to "-history.jsonl". compact()
+    rebuilds the usual per-question {question_id}_{db_id}.json files from the journal.
+    """
+    JOURNAL_FILE_NAME = "-history.jsonl"
+    _instances: Dict[str, "HistoryJournal"] = {}
+    _lock = Lock()
+    _SENTINEL = object()
+
+    def __new__(cls, result_directory: str):
+        """
+        Returns the journal of a result directory, creating it and its writer thread on first use.
+
+        Args:
+            result_directory (str): The directory the journal belongs to.
+        """
+        key = str(Path(result_directory).resolve())
+        with cls._lock:
+            if key not in cls._instances or cls._instances[key]._closed:
+                instance = super(HistoryJournal, cls).__new__(cls)
+                instance._init(result_directory)
+                cls._instances[key] = instance
+            return cls._instances[key]
+
+    def _init(self, result_directory: str):
+        self.result_directory = Path(result_directory)
+        self.journal_path = self.result_directory / self.JOURNAL_FILE_NAME
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="HistoryJournal-writer", daemon=True)
+        self._writer.start()
+
+    def append(self, question_id: Any, db_id: str, step: Dict[str, Any]) -> None:
+        """
+        Queues one node result; the caller does not wait for serialisation or I/O.
+
+        Args:
+            question_id (Any): The question ID.
+            db_id (str): The database ID.
+            step (Dict[str, Any]): The finished node result. It must not be mutated afterwards.
+        """
+        if self._closed:
+            raise ValueError(f"HistoryJournal for {self.result_directory} is closed.")
+        self._queue.put((question_id, db_id, step))
+
+    def _write_loop(self) -> None:
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.journal_path.open("a", encoding="utf-8") as file:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is self._SENTINEL:
+                        return
+                    question_id, db_id, step = item
+                    record = {"question_id": question_id, "db_id": db_id, "step": make_serial(step)}
+                    file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    if self._queue.empty():  # 写完一批再刷盘
+                        file.flush()
+                except Exception as e:
+                    print(f"写入 history journal 失败: {e}")
+                finally:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        """Blocks until every queued step is on disk."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Flushes the journal and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._SENTINEL)
+        self._writer.join()
+
+    def compact(self) -> int:
+        """
+        Writes the per-question history files from the journal.
+
+        Returns:
+            int: The number of question files written.
+        """
+        if not self._closed:
+            self.flush()
+        return compact_journal(self.result_directory)
+
+
+def read_journal(journal_path: Path) -> Dict[Tuple[Any, str], List[Dict[str, Any]]]:
+    """
+    Groups the steps of a journal by question, in the order they were written.
+
+    A truncated last line (e.g. after a crash) is skipped.
+
+    Args:
+        journal_path (Path): The journal file.
+
+    Returns:
+        Dict[Tuple[Any, str], List[Dict[str, Any]]]: The histories keyed by (question_id, db_id).
+    """
+    histories = defaultdict(list)
+    if not Path(journal_path).exists():
+        return histories
+    with open(journal_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            histories[(record["question_id"], record["db_id"])].append(record["step"])
+    return histories
+
+
+def compact_journal(result_directory: str) -> int:
+    """
+    Writes the per-question {question_id}_{db_id}.json files of a directory from its journal.
+
+    Args:
+        result_directory (str): The directory containing "-history.jsonl".
+
+    Returns:
+        int: The number of question files written.
+    """
+    result_directory = Path(result_directory)
+    histories = read_journal(result_directory / HistoryJournal.JOURNAL_FILE_NAME)
+    for (question_id, db_id), history in histories.items():
+        file_path = result_directory / f"{question_id}_{db_id}.json"
+        with file_path.open("w") as file:
+            json.dump(history, file, indent=4, ensure_ascii=False)
+    return len(histories)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把 -history.jsonl 压缩成每个问题一个的 json 文件")
+    parser.add_argument("result_directory", type=str, help="包含 -history.jsonl 的结果目录")
+    opt = parser.parse_args()
+
+    count = compact_journal(opt.result_directory)
+    print(f"压缩完成，共写入 {count} 个问题")
@@ -0,0 +1,120 @@
+import threading
+from threading import Lock
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpPool:
+    """
+    A keep-alive connection pool per endpoint (scheme://host:port), shared by all worker threads.
+
+    All threads share one HTTPAdapter, whose urllib3 pool is thread-safe and reuses connections
+    (no new TCP/TLS handshake per call). Each thread gets its own Session mounting that adapter,
+    because Session state itself is not meant to be shared between threads. When every connection
+    is busy, callers wait for one instead of opening throwaway connections.
+    """
+    _instances: Dict[str, "HttpPool"] = {}
+    _lock = Lock()
+    # configure() 之后创建的连接池使用这些设置
+    pool_size = 32
+    connect_timeout = 10.0
+    read_timeout = 300.0
+    keep_alive = True
+
+    @classmethod
+    def configure(cls, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+                  keep_alive: bool = None) -> None:
+        """
+        Sets the defaults of the pools created afterwards.
+
+        Args:
+            pool_size (int, optional): Maximum connections kept open per endpoint.
+            connect_timeout (float, optional): Seconds to wait for a connection.
+            read_timeout (float, optional): Seconds to wait between bytes of a response.
+            keep_alive (bool, optional): Whether connections are kept open between requests.
+        """
+        if pool_size is not None:
+            cls.pool_size = pool_size
+        if connect_timeout is not None:
+            cls.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            cls.read_timeout = read_timeout
+        if keep_alive is not None:
+            cls.keep_alive = keep_alive
+
+    @classmethod
+    def for_url(cls, url: str) -> "HttpPool":
+        """Returns the pool of the url's endpoint, creating it on first use."""
+        parts = urlsplit(url)
+        endpoint = f"{parts.scheme}://{parts.netloc}"
+        with cls._lock:
+            if endpoint not in cls._instances:
+                cls._instances[endpoint] = cls(endpoint)
+            return cls._instances[endpoint]
+
+    @classmethod
+    def all_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """Returns the stats of every pool, keyed by endpoint."""
+        with cls._lock:
+            pools = list(cls._instances.values())
+        return {pool.endpoint: pool.stats() for pool in pools}
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.pool_size = self.pool_size
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.keep_alive = self.keep_alive
+        # 重试由 get_ans 负责，这里不重试
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0, pool_block=True)
+        self._local = threading.local()
+        self._stats_lock = Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount(self.endpoint, self.adapter)
+            if not self.keep_alive:
+                session.headers["Connection"] = "close"
+            self._local.session = session
+        return session
+
+    def post(self, url: str, json: Any = None, headers: Optional[Dict[str, str]] = None, **kwargs: Any) -> requests.Response:
+        """POSTs through the pool with the configured timeouts."""
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self._session().post(url, json=json, headers=headers, **kwargs)
+        except requests.RequestException:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self._requests += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Request and connection counts: "connections" is how many TCP connections were opened,
+        so "reused" = requests - connections is the number of handshakes saved by keep-alive.
+        """
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        with self._stats_lock:
+            requests_sent, errors = self._requests, self._errors
+        return {
+            "pool_size": self.pool_size,
+            "keep_alive": self.keep_alive,
+            "requests": requests_sent,
+            "errors": errors,
+            "connections": connections,
+            "reused": max(requests_sent - connections, 0),
+        }
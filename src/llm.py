@@ -1,17 +1,24 @@
 import copy
-import sqlite3
-from transformers.models.auto.modeling_auto import AutoModelForCausalLM
-from transformers.models.auto.tokenization_auto import AutoTokenizer
-from typing_extensions import Annotated
-import requests, time
-import torch
+import time
 import json
 import re
 import os
 from logger import Logger
-from util import extract_sql_from_text, extract_json_from_text, execute_sql
-import signal
-from contextlib import contextmanager
+from metrics import MetricsRecorder
+from tracing import Tracer
+from cassette import Cassette, CassetteMiss
+from task_context import TaskContext
+from http_pool import HttpPool
+from async_llm import AsyncLLMClient
+from response_cache import ResponseCache
+from resilience import LLMHTTPError, Resilience, parse_retry_after
+from budget import CostAccountant, MODEL_PRICING
+from prompt_cache import PromptCache, cached_prompt_tokens, content_text, prompt_text
+from context_compaction import ReactTranscript
+from util import extract_sql_from_text, extract_json_from_text, execute_sql, sql_block_complete
+
+# 可以用环境变量 LLM_API_URL 指向其他兼容 OpenAI 的服务，例如基准测试的 mock server
+DEFAULT_LLM_API_URL = "https://www.dmxapi.com/v1/chat/completions"
 
 def model_chose(step,model="gpt-4o"):
 
@@ -34,7 +41,8 @@ class req:
 
 
 def request(url,model,messages,temperature,top_p,n,key,**k):
-    res = requests.post(
+    # 同一个 endpoint 的请求共用 keep-alive 连接池
+    response = HttpPool.for_url(url).post(
                 url=
                 url,
                 json={
@@ -50,31 +58,85 @@ def request(url,model,messages,temperature,top_p,n,key,**k):
                 headers={
                     "Authorization":
                     key
-                }).json()
+                })
+    # 错误响应带上状态码和 Retry-After，由 Resilience 决定是否重试
+    if response.status_code >= 400:
+        raise LLMHTTPError(response.status_code, response.text[:200], parse_retry_after(response.headers.get("Retry-After")))
+    res = response.json()
+    if "choices" not in res:
+        raise LLMHTTPError(response.status_code, json.dumps(res, ensure_ascii=False)[:200])
 
     return res
 
+def stream_request(url,model,messages,temperature,top_p,n,key,stop_after_sql=False,after=None,**k):
+    """
+    Streams one completion (n=1) as server-sent events and returns it in the shape of a normal
+    response. With stop_after_sql the connection is closed as soon as a complete ```sql block has
+    arrived (after the `after` marker, if given), so the rest is neither waited for nor generated.
+    The usage of a stopped stream is estimated at 4 characters per token.
+    """
+    start_time = time.perf_counter()
+    response = HttpPool.for_url(url).post(
+        url=url,
+        json={"model": model, "messages": messages, "temperature": temperature, "top_p": top_p, "n": n,
+              "stream": True, "stream_options": {"include_usage": True}, **k},
+        headers={"Authorization": key},
+        stream=True)
+    if response.status_code >= 400:
+        raise LLMHTTPError(response.status_code, response.text[:200], parse_retry_after(response.headers.get("Retry-After")))
+
+    text, usage, finish_reason, first_token_time, stopped_early = "", None, None, None, False
+    response.encoding = "utf-8"
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter() - start_time
+                    text += delta
+                finish_reason = choice.get("finish_reason") or finish_reason
+            if stop_after_sql and sql_block_complete(text, after):
+                stopped_early = True  # 拿到SQL就断开，后面的解释不再等待
+                break
+    finally:
+        response.close()
+
+    if not text:
+        raise LLMHTTPError(response.status_code, "empty stream")
+    if usage is None:
+        prompt_chars = sum(len(content_text(m.get("content"))) for m in messages)
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(text) // 4, "estimated": True}
+    return {
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                     "finish_reason": "early_stop" if stopped_early else finish_reason}],
+        "usage": usage,
+        "stream": {"time_to_first_token": first_token_time, "stopped_early": int(stopped_early)},
+    }
+
+def cassette_scope():
+    """The cassette occurrence scope of the current request: the question being processed."""
+    try:
+        return str(TaskContext.current().task.question_id)
+    except ValueError:
+        return ""
+
 class TimeoutException(Exception):
     pass
 
 class gpt_req(req):
+    MODEL_PRICING = MODEL_PRICING  # 价格表在 budget 模块，整个运行共用
+
     def __init__(self, step,model="gpt-4o") -> None:
         super().__init__(step, model)
 
-        self.MODEL_PRICING = {
-            "gpt-4o": {"input": 2.50, "output": 10.00},
-            "gpt-4o-mini": {"input": 0.15, "output": 0.60},
-            "gpt-4-turbo": {"input": 10.00, "output": 30.00},
-            "gpt-4": {"input": 30.00, "output": 60.00},
-            "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
-            "gemini-2.5-pro": {"input": 1.25, "output": 10.00},  
-            "gpt-5": {"input": 1.25, "output": 10.00},
-            "claude-sonnet-4-20250514": {"input":3.00, "output":15.00},
-            "gpt-5-codex": {"input":0.73, "output":5.84},
-            "qwen3-coder-plus": {"input":0.6, "output":2.4}
-        }
-
-    
     
     def parse_action_from_response(self, response: str):
         """
@@ -151,63 +213,171 @@ class gpt_req(req):
         return "\n".join(results)
 
 
-    def get_ans(self, messages, temperature=0.0, n=1, top_p=None, single=True, **k):
-        count = 0  
-        while count < 5:  # 重试5次，仅仅是发送消息的时候
-            # print(messages) #保存prompt和答案
-            try: 
-                res = request(
-                url="https://www.dmxapi.com/v1/chat/completions",
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                n=n,
-                key=os.getenv('OPENAI_API_KEY'),
-                **k)
-
-                if n==1 and single:
-                    response_clean = res["choices"][0]["message"]["content"]
-                else:
-                    response_clean = res["choices"]
+    def get_ans(self, messages, temperature=0.0, n=1, top_p=None, single=True, stream=None, **k):
+        """
+        Args:
+            stream (dict | bool, optional): Stream the completion (n=1 only), e.g. {"stop_after_sql": True,
+                "after": "<answer>"} to stop once a complete ```sql block arrived, see stream_request.
+        """
+        if stream is True:
+            stream = {}
+        if n != 1 or stream is False:
+            stream = None
+        with Tracer().span(f"get_ans {self.model}", "llm", node=self.step, model=self.model, temperature=temperature, n=n):
+            return self._get_ans(messages, temperature=temperature, n=n, top_p=top_p, single=single, stream=stream, **k)
+
+    def _get_ans(self, messages, temperature=0.0, n=1, top_p=None, single=True, stream=None, **k):
+        start_time = time.perf_counter()
+        # 命中磁盘缓存时直接返回，不访问网络，也不受 hard_stop 限制
+        cached, cache_entry = ResponseCache().lookup(cassette_scope(), self.model, messages,
+                                                     temperature=temperature, top_p=top_p, n=n, stream=stream, **k)
+        if cached is not None:
+            response_clean = cached["choices"][0]["message"]["content"] if n == 1 and single else cached["choices"]
+            if self.step != "prepare_train_queries":
+                self.log_record(messages, response_clean)
+            Tracer().annotate(**self._record_usage(cached, time.perf_counter() - start_time, 0, cache_hit=True))
+            return response_clean
+
+        CostAccountant().check(cassette_scope())
+        url = os.getenv("LLM_API_URL", DEFAULT_LLM_API_URL)
+        # 只有 prefix 布局或开启报告时才比较前缀，默认不在每个请求上做这项扫描
+        expected_cached = PromptCache().expect(self.model, prompt_text(messages)) if PromptCache().tracking else 0
+        attempts = []
+
+        def attempt():
+            attempts.append(len(attempts) + 1)
+            with Tracer().span("request", "llm", attempt=len(attempts)):
+                # record/replay 模式下经过 cassette，off 时直接请求
+                return Cassette().send(
+                    lambda: (stream_request if stream is not None else request)(
+                    url=url,
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    top_p=top_p,
+                    n=n,
+                    key=os.getenv('OPENAI_API_KEY'),
+                    **(stream or {}),
+                    **k),
+                    cassette_scope(), self.model, messages,
+                    temperature=temperature, top_p=top_p, n=n, stream=stream, **k)
+
+        # 退避、重试预算和熔断都在 Resilience 里，全部失败时抛出异常而不是返回空结果
+        try:
+            res, count = Resilience().call(url, attempt)
+        except Exception as e:
+            print(f'llm 请求失败: {e}')
+            MetricsRecorder().record("llm", model=self.model, wall_time=time.perf_counter() - start_time,
+                                     retries=max(len(attempts) - 1, 0), status="failed")
+            raise
+
+        ResponseCache().store(cache_entry, self.model, res)
+        if n==1 and single:
+            response_clean = res["choices"][0]["message"]["content"]
+        else:
+            response_clean = res["choices"]
 
-                if self.step != "prepare_train_queries":  #TODO 暂时不知道这个函数是干嘛的
-                    self.log_record(messages, response_clean)  # 记录对话内容
-                break
+        if self.step != "prepare_train_queries":  #TODO 暂时不知道这个函数是干嘛的
+            self.log_record(messages, response_clean)  # 记录对话内容
 
-            except Exception as e:
-                print('llm message发送连接失败')
-                count += 1
-                time.sleep(2)
-                print(e)
-                
+        Tracer().annotate(**self._record_usage(res, time.perf_counter() - start_time, count, expected_cached=expected_cached))
+        return response_clean
+    
 
-        usage = res['usage']
-        input_tokens = usage['prompt_tokens']
-        output_tokens = usage['completion_tokens']
-        model_key = self.model.lower()
-        if model_key in self.MODEL_PRICING:
-            pricing = self.MODEL_PRICING[model_key]
-            input_cost = (input_tokens / 1_000_000) * pricing["input"]
-            output_cost = (output_tokens / 1_000_000) * pricing["output"]
-            total_cost = input_cost + output_cost
+    def _record_usage(self, res, wall_time, retries, cache_hit=False, expected_cached=0):
+        """
+        Charges a response to the CostAccountant and self.Cost and records its "llm" metric; returns
+        the recorded values. Cache hits cost nothing, the tokens are still recorded. Responses from
+        the network also add their expected and reported prefix-cached tokens to the PromptCache.
+        """
+        usage = res.get('usage') or {}
+        input_tokens = usage.get('prompt_tokens', 0)
+        output_tokens = usage.get('completion_tokens', 0)
+        total_cost = 0.0
+        if not cache_hit:
+            # 汇总到整个运行的账本，预算上限和降级都依据它
+            total_cost = CostAccountant().charge(cassette_scope(), self.model, input_tokens, output_tokens)
             self.Cost += total_cost
-        else:
-            # 如果模型不在价格表中，使用默认价格或设为0
-            print(f"警告: 未找到模型 {self.model} 的价格信息")
 
-        return response_clean
-    
+        values = {"retries": retries, "prompt_tokens": input_tokens, "completion_tokens": output_tokens, "cost": total_cost,
+                  "cache_hit": int(cache_hit), **({} if cache_hit else res.get("stream", {}))}
+        if not cache_hit:
+            # 服务端前缀缓存命中的 token，和按 prompt 布局预期的对比
+            cached_tokens = cached_prompt_tokens(usage)
+            values["cached_tokens"] = cached_tokens
+            if PromptCache().tracking:
+                PromptCache().observe(self.model, input_tokens, expected_cached, cached_tokens)
+                values["expected_cached_tokens"] = expected_cached
+        MetricsRecorder().record("llm", model=self.model, wall_time=wall_time, **values)
+        return values
+
+    def get_ans_batch(self, batch, single=True):
+        """
+        Sends several chat requests at once through the AsyncLLMClient, within the model's
+        concurrency and rate limits, instead of one thread per request.
+
+        Args:
+            batch (list): One dict per request: "messages" plus optional "temperature", "top_p", "n" and other parameters.
+            single (bool, optional): Return the message content instead of the choices when n is 1.
 
-    def get_ans_with_tool(self, messages, fd_list, sqlite_dir, execute_history, max_iterations=6, temperature=0.0, top_p=None, n=1,single=True, **k):
+        Returns:
+            list: The answer of each request in input order, or the exception of a request that failed.
+        """
+        payloads = [{"temperature": 0.0, "top_p": None, "n": 1, **request} for request in batch]
+        batch_start = time.time()
+        cache = ResponseCache()
+        lookups = [cache.lookup(cassette_scope(), self.model, **payload) for payload in payloads]
+        misses = [i for i, (cached, _) in enumerate(lookups) if cached is None]
+        if misses:
+            # 只有真正要发出请求时才检查预算，缓存命中不受 hard_stop 限制
+            CostAccountant().check(cassette_scope())
+        expected_cached = {i: PromptCache().expect(self.model, prompt_text(payloads[i]["messages"]))
+                           for i in misses} if PromptCache().tracking else {}
+        sent = AsyncLLMClient().complete_many(
+            os.getenv("LLM_API_URL", DEFAULT_LLM_API_URL), os.getenv('OPENAI_API_KEY'), cassette_scope(), self.model,
+            [payloads[i] for i in misses])
+        results = [{**cached, "_elapsed": 0.0, "_retries": 0} if cached is not None else None for cached, _ in lookups]
+        for i, res in zip(misses, sent):
+            results[i] = res
+            if not isinstance(res, Exception):
+                cache.store(lookups[i][1], self.model, {key: value for key, value in res.items() if not key.startswith("_")})
+
+        # 结果在调用线程里处理，日志、指标和 trace 才能归到当前问题和节点
+        answers = []
+        for i, ((cached, _), payload, res) in enumerate(zip(lookups, payloads, results)):
+            if isinstance(res, CassetteMiss):
+                raise res
+            if isinstance(res, Exception):
+                print(f'llm 并发请求失败: {res}')
+                answers.append(res)
+                continue
+            if payload["n"] == 1 and single:
+                response_clean = res["choices"][0]["message"]["content"]
+            else:
+                response_clean = res["choices"]
+            if self.step != "prepare_train_queries":
+                self.log_record(payload["messages"], response_clean)
+            values = self._record_usage(res, res["_elapsed"], res["_retries"], cache_hit=cached is not None,
+                                        expected_cached=expected_cached.get(i, 0))
+            Tracer().record_span(f"get_ans {self.model}", "llm", batch_start, res["_elapsed"], node=self.step,
+                                 model=self.model, temperature=payload["temperature"], n=payload["n"], batch=len(payloads), **values)
+            answers.append(response_clean)
+        return answers
+
+    def get_ans_with_tool(self, messages, fd_list, sqlite_dir, execute_history, max_iterations=6, temperature=0.0, top_p=None, n=1,single=True, compaction=None, **k):
         """
         使用ReAct格式的工具调用
+
+        Args:
+            compaction (dict, optional): Compact the history resent on every iteration, e.g.
+                {"keep_recent": 1, "max_prompt_tokens": 12000, "digest_chars": 200}, see ReactTranscript.
         """
-        current_messages = copy.deepcopy(messages)
+        transcript = ReactTranscript(copy.deepcopy(messages), self.model, compaction)
         iteration = 0
         while iteration < max_iterations:
             # 注意：这里不使用tools参数，让模型纯文本输出
-            response = self.get_ans(current_messages)
+            with Tracer().span("react_step", "llm", iteration=iteration + 1):
+                response = self.get_ans(transcript.messages())
             
             print(f"=== 迭代 {iteration + 1} ===")
             print("模型输出：")
@@ -215,6 +385,7 @@ class gpt_req(req):
             
             # 检查是否包含Final Answer
             if "Final Answer:" in response:
+                self._record_compaction(transcript)
                 return response
                 
             # 解析Action和ActionInput
@@ -223,7 +394,8 @@ class gpt_req(req):
             if action_type and action_input:
                 if action_type == "execute_sql":
                     # 执行SQL
-                    result = execute_sql(action_input.strip(), sqlite_dir, execute_history)
+                    with Tracer().span("tool execute_sql", "tool", iteration=iteration + 1):
+                        result = execute_sql(action_input.strip(), sqlite_dir, execute_history)
                     observation = result
 
                     if result[0] == 'Execute Empty':
@@ -241,7 +413,8 @@ The SQL query returns `None` result, you should consider whether there is a prob
                     print(f"观察结果: {observation}")
                 
                 elif action_type == 'get_column_cardinalities':
-                    result = self.get_column_cardinalities(action_input, fd_list)
+                    with Tracer().span("tool get_column_cardinalities", "tool", iteration=iteration + 1):
+                        result = self.get_column_cardinalities(action_input, fd_list)
                     observation = result
 
                     print(f"检查基数关系: {action_input}")
@@ -252,36 +425,37 @@ The SQL query returns `None` result, you should consider whether there is a prob
                     observation = result
 
                     print(f"未知操作类型: {action_type}")
-                # 将观察结果添加到消息中
-                updated_response = response + f"\nObservation: {observation}"
-                current_messages.append({"role": "assistant", "content": updated_response})
-                
-                # 继续对话，让模型基于观察结果继续推理
+                # 将观察结果添加到消息中，继续对话，让模型基于观察结果继续推理
                 continue_prompt = "Based on the observation above, continue your reasoning. What should you do next?"
-                current_messages.append({"role": "user", "content": continue_prompt})
+                transcript.add_step(response, observation, continue_prompt, result)
                 
             else:
-                # 将当前响应添加到消息历史中
-                current_messages.append({"role": "assistant", "content": response})
-                
-                # 提示模型使用正确的格式
+                # 将当前响应添加到消息历史中，提示模型使用正确的格式
                 format_prompt = "Please follow the ReAct format: use 'Action: <TOOL_NAME>' and 'ActionInput:' for tool calls, or provide 'Final Answer:' for the final response."
-                current_messages.append({"role": "user", "content": format_prompt})
+                transcript.add_step(response, None, format_prompt)
                         
             iteration += 1
         
         # 如果达到最大迭代次数，进行最后一次调用要求给出最终答案
         final_prompt = "Please provide your Final Answer now based on all the observations above."
-        current_messages.append({"role": "user", "content": final_prompt})
-        final_response = self.get_ans(current_messages)
+        final_response = self.get_ans(transcript.messages(final_prompt))
+        self._record_compaction(transcript)
         
         return final_response
+
+    def _record_compaction(self, transcript):
+        """Records the tokens a ReAct loop sent with compaction and would have sent without it."""
+        if transcript.compaction:
+            MetricsRecorder().record("react", model=self.model, steps=len(transcript.steps), **transcript.stats)
     
 
 class sft_req(req):
 
     def __init__(self,model) -> None:
         super().__init__(model)
+        import torch
+        from transformers.models.auto.modeling_auto import AutoModelForCausalLM
+        from transformers.models.auto.tokenization_auto import AutoTokenizer
         self.device = "cuda:0"
         self.tokenizer = AutoTokenizer.from_pretrained(
             "",
@@ -1,15 +1,16 @@
 import logging
 import json
+from contextvars import ContextVar
 from threading import Lock
 from pathlib import Path
-import threading
 from typing import Any, List, Dict, Union
 
 class Logger:
-    _local = threading.local()  # 每个线程有自己的存储空间
+    # 每个线程（以及从其复制上下文的子线程）有自己的实例
+    _current: ContextVar = ContextVar("logger_instance", default=None)
     _lock = Lock()
 
-    def __new__(cls, db_id: str = None, question_id: str = None, result_directory: str = None):
+    def __new__(cls, db_id: str = None, question_id: str = None, result_directory: str = None, journal: Any = None):
         """
         Ensures a singleton instance of Logger.
 
@@ -17,6 +18,8 @@ class Logger:
             db_id (str, optional): The database ID.
             question_id (str, optional): The question ID.
             result_directory (str, optional): The directory to store results.
+            journal (HistoryJournal, optional): If given, node results are appended to this journal
+                instead of rewriting the question's history file.
 
         Returns:
             Logger: The singleton instance of the class.
@@ -28,14 +31,15 @@ class Logger:
             if (db_id is not None) and (question_id is not None):
                 # 为当前线程创建独立实例
                 instance = super(Logger, cls).__new__(cls)
-                instance._init(db_id, question_id, result_directory)
-                cls._local.instance = instance
+                instance._init(db_id, question_id, result_directory, journal)
+                cls._current.set(instance)
             else:
-                if not hasattr(cls._local, 'instance'):
+                instance = cls._current.get()
+                if instance is None:
                     raise ValueError("Logger instance has not been initialized.")
-            return cls._local.instance
+            return instance
 
-    def _init(self, db_id: str, question_id: str, result_directory: str):
+    def _init(self, db_id: str, question_id: str, result_directory: str, journal: Any = None):
         """
         Initializes the Logger instance with the provided parameters.
 
@@ -43,10 +47,14 @@ class Logger:
             db_id (str): The database ID.
             question_id (str): The question ID.
             result_directory (str): The directory to store results.
+            journal (HistoryJournal, optional): The journal receiving node results.
         """
         self.db_id = db_id
         self.question_id = question_id
         self.result_directory = Path(result_directory)
+        self.journal = journal
+        self._file_lock = Lock()  # 同一任务的并发采样共用一个实例
+        self._history: List[Dict[str, Any]] = []  # 已写入历史文件的节点结果，并行分支各自只看到自己的 state
 
     def _set_log_level(self, log_level: str):
         """
@@ -90,7 +98,7 @@ class Logger:
         """
         log_file_path = self.result_directory / "logs" / f"{self.question_id}_{self.db_id}.log"
         log_file_path.parent.mkdir(parents=True, exist_ok=True)
-        with log_file_path.open("a") as file:
+        with self._file_lock, log_file_path.open("a") as file:
             file.write(f"############################## {_from} at step {step} ##############################\n\n")
             if isinstance(text, str):
                 file.write(text)
@@ -101,6 +109,26 @@ class Logger:
                 file.write(str(text))
             file.write("\n\n")
 
+    def record_step(self, execution_history: List[Dict[str, Any]], step: Dict[str, Any]):
+        """
+        Persists a node result.
+
+        Parallel branches each pass the history of their own state, which lacks the results of
+        the other branches, so the history file is written from the steps recorded so far by
+        every branch of the task.
+
+        Args:
+            execution_history (List[Dict[str, Any]]): The execution history the node saw.
+            step (Dict[str, Any]): The new node result.
+        """
+        if self.journal is not None:
+            self.journal.append(self.question_id, self.db_id, step)
+            return
+        with self._file_lock:
+            recorded = {id(s) for s in self._history}
+            self._history.extend(s for s in list(execution_history) + [step] if id(s) not in recorded)
+            self._write_history(self._history)
+
     def dump_history_to_file(self, execution_history: List[Dict[str, Any]]):
         """
         Dumps the execution history to a JSON file.
@@ -108,6 +136,10 @@ class Logger:
         Args:
             execution_history (List[Dict[str, Any]]): The execution history to dump.
         """
+        with self._file_lock:
+            self._write_history(list(execution_history))
+
+    def _write_history(self, execution_history: List[Dict[str, Any]]):
         execution_history_tmp=make_serial(execution_history)
 
 
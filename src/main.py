@@ -4,21 +4,33 @@ import math
 from datetime import datetime
 import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import os
 import threading
+from pathlib import Path
 
-import torch
 from run_manager import RunManager
 from arctic_manager import ArcticManager
+from task_scheduler import TaskScheduler, DbAffinityScheduler, shard_tasks
+from pipeline.workflow_builder import build_pipeline, resolve_dependencies, topological_order
+from resume_index import ResumeIndex
+from prediction_aggregator import PredictionAggregator
+from metrics import MetricsRecorder
+from tracing import Tracer
+from cassette import Cassette
+from http_pool import HttpPool
+from async_llm import AsyncLLMClient
+from response_cache import ResponseCache
+from resilience import Resilience
+from budget import CostAccountant
+from prompt_cache import PromptCache
 
 
-def process_batch(batch_data, batch_index, opt, progress_counter, total_batches):
+def process_batch(batch_data, batch_index, opt, progress_counter, total_batches, app=None, final_aggregator=None):
     """处理单个批次数据的函数"""
     thread_name = threading.current_thread().name
     print(f"[{thread_name}] 开始处理批次 {batch_index + 1}/{total_batches}，包含 {len(batch_data)} 条记录")
 
     # 为每个批次创建独立的 RunManager 实例，但模型已经在全局预加载
-    run_manager = RunManager(opt, batch_index)
+    run_manager = RunManager(opt, batch_index, app, final_aggregator)
     run_manager.initialize_tasks(batch_data)
     run_manager.run_tasks()
     # 生成最终的 SQL 文件
@@ -31,46 +43,52 @@ def process_batch(batch_data, batch_index, opt, progress_counter, total_batches)
 
     return batch_index, len(batch_data), result_directory
 
-def main(opt):
-    with open(opt.input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        data = sorted(data, key=lambda x: x['question_id'])
 
-    print(f"读取到 {len(data)} 条记录")
+def process_stream(scheduler, worker_id, opt, progress_counter, app=None, final_aggregator=None):
+    """从共享队列中逐条领取任务的 worker"""
+    thread_name = threading.current_thread().name
+    print(f"[{thread_name}] worker {worker_id} 开始从队列领取任务")
+
+    run_manager = RunManager(opt, worker_id, app, final_aggregator)
+    try:
+        run_manager.run_task_stream(scheduler.stream(worker_id), progress_counter)
+    except Exception:
+        scheduler.stop()  # 避免生产者在满队列上一直阻塞
+        raise
+    result_directory = run_manager.generate_sql_files()
+
+    print(f"[{thread_name}] worker {worker_id} 完成，共处理 {run_manager.processed_tasks} 条记录")
+    return worker_id, run_manager.processed_tasks, result_directory
 
+
+def run_batches(data, opt, app, final_aggregator):
+    """把数据切成固定的批次，每个线程处理一个批次"""
     # 计算批次
-    num_batches = 5
+    num_batches = opt.num_workers
     batch_size = math.ceil(len(data) / num_batches)
     print(f"将数据分成 {num_batches} 个批次，每批最多 {batch_size} 条记录")
 
     # 分割数据为批次
     batches = []
     for i in range(num_batches):
-        start_idx = i * batch_size
-        end_idx = min((i + 1) * batch_size, len(data))
-        batch_data = data[start_idx:end_idx]
-        batches.append((batch_data, i))
-
-    # 使用5个线程并行处理批次
-    max_workers = 5  # 用户要求5个线程并行
+        if opt.task_order == 'db_affinity':
+            # 同一数据库的问题放在同一批次，并且连续处理
+            batch_data = sorted(shard_tasks(data, i, num_batches, "db"), key=lambda x: (x['db_id'], x['question_id']))
+        else:
+            start_idx = i * batch_size
+            end_idx = min((i + 1) * batch_size, len(data))
+            batch_data = data[start_idx:end_idx]
+        if batch_data:
+            batches.append((batch_data, i))
 
     # 创建进度计数器（线程安全）
     progress_counter = {'completed': 0, 'lock': threading.Lock()}
 
-    # 预加载共享的 Manager 实例，避免在每个 worker 中重复初始化
-    print("预加载模型和管理器...")
-    arctic_manager = ArcticManager(
-        opt.pretrained_model_name_or_path,
-        opt.tensor_parallel_size,
-        opt.temperature,
-        opt.n
-    )
-
     print("开始并行处理批次...")
     result_directorys = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with ThreadPoolExecutor(max_workers=num_batches) as executor:
         # 立即提交所有任务，避免闭包问题
-        future_to_batch = []
+        future_to_batch = {}
         for batch_data, batch_idx in batches:
             print(f"提交批次 {batch_idx}，包含 {len(batch_data)} 条数据")
             print(f"  第一条数据 question_id: {batch_data[0]['question_id']}")
@@ -81,9 +99,11 @@ def main(opt):
                 batch_idx,       # 立即绑定
                 opt, 
                 progress_counter, 
-                num_batches
+                len(batches),
+                app,
+                final_aggregator
             )
-            future_to_batch.append(future)
+            future_to_batch[future] = batch_idx
 
 
         # 等待所有批次完成
@@ -92,18 +112,122 @@ def main(opt):
                 batch_idx, batch_size_processed, result_directory = future.result()
                 result_directorys.append(result_directory)
             except Exception as exc:
-                print(f'批次 {batch_idx + 1} 处理时发生异常: {exc}')
+                print(f'批次 {future_to_batch[future] + 1} 处理时发生异常: {exc}')
+                raise
+    return result_directorys
+
+
+def run_queue(data, opt, app, final_aggregator):
+    """任务逐条进入有界队列，由 num_workers 个 worker 动态领取"""
+    if opt.task_order == 'db_affinity':
+        scheduler = DbAffinityScheduler(data, opt.num_workers)
+        print(f"使用按数据库亲和的队列调度：{opt.num_workers} 个 worker")
+    else:
+        scheduler = TaskScheduler(data, opt.num_workers, opt.queue_size)
+        print(f"使用队列调度：{opt.num_workers} 个 worker，队列容量 {scheduler.queue_size}")
+
+    progress_counter = {'processed': 0, 'total': len(data), 'lock': threading.Lock()}
+    scheduler.start()
+
+    result_directorys = []
+    with ThreadPoolExecutor(max_workers=opt.num_workers) as executor:
+        future_to_worker = {
+            executor.submit(process_stream, scheduler, worker_id, opt, progress_counter, app, final_aggregator): worker_id
+            for worker_id in range(opt.num_workers)
+        }
+        for future in as_completed(future_to_worker):
+            try:
+                worker_id, processed, result_directory = future.result()
+                result_directorys.append(result_directory)
+            except Exception as exc:
+                print(f'worker {future_to_worker[future]} 处理时发生异常: {exc}')
                 raise
+    return result_directorys
 
-    print("所有批次处理完成，开始生成最终的SQL文件...")
-    value_dict = {}
-    for result_directory in result_directorys:
-         with open(os.path.join(result_directory, "-sql_selection.json"), 'r') as f:
-            pred = json.load(f)
-            value_dict.update(pred)
-    
-    with open(opt.output_file, 'w', encoding='utf-8') as f:
-        json.dump(value_dict, f, indent=2, ensure_ascii=False)
+
+def main(opt):
+    with open(opt.input_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+        data = sorted(data, key=lambda x: x['question_id'])
+
+    print(f"读取到 {len(data)} 条记录")
+
+    if opt.shard_count > 1:
+        data = shard_tasks(data, opt.shard_index, opt.shard_count, opt.shard_by)
+        print(f"分片 {opt.shard_index}/{opt.shard_count} (按 {opt.shard_by}): {len(data)} 条记录，{len({d['db_id'] for d in data})} 个数据库")
+
+    finished_histories = {}
+    if opt.resume:
+        resume_index = ResumeIndex(opt.resume, opt.pipeline_nodes, json.loads(opt.pipeline_setup))
+        data, finished_histories = resume_index.split(data)
+        partial = sum(1 for sample in data if sample.get("resumed_history"))
+        print(f"续跑 {opt.resume}: {len(finished_histories)} 条已完成，{partial} 条部分完成，{len(data) - partial} 条未开始")
+
+    MetricsRecorder().configure(opt.metrics_events_file)
+    Tracer().configure(opt.trace)
+    HttpPool.configure(opt.http_pool_size, opt.http_connect_timeout, opt.http_read_timeout, not opt.no_http_keep_alive)
+    AsyncLLMClient.configure(json.loads(opt.llm_rate_limits))
+    CostAccountant().configure(opt.max_run_tokens, opt.max_run_cost, opt.max_question_tokens, opt.max_question_cost,
+                               json.loads(opt.budget_policy) if opt.budget_policy else None)
+    Resilience().configure(opt.llm_max_attempts, opt.llm_backoff_base, opt.llm_backoff_max, opt.llm_max_retry_after,
+                           opt.llm_retry_budget, opt.llm_min_retry_budget, opt.llm_breaker_threshold, opt.llm_breaker_reset)
+    ResponseCache().configure(opt.llm_cache, opt.llm_cache_path, opt.llm_cache_max_mb, opt.llm_cache_deterministic_only)
+    Cassette().configure(opt.llm_cassette, opt.cassette_dir, opt.replay_latency, opt.synthetic_latency)
+    PromptCache().configure(opt.prompt_layout, not opt.no_prompt_cache_control, opt.report_prompt_cache)
+
+    # 预加载共享的 Manager 实例，避免在每个 worker 中重复初始化
+    print("预加载模型和管理器...")
+    arctic_manager = ArcticManager(
+        opt.pretrained_model_name_or_path,
+        opt.tensor_parallel_size,
+        opt.temperature,
+        opt.n,
+        enable_prefix_caching=not opt.no_vllm_prefix_caching,
+        backend=opt.arctic_backend,
+        **({"answers_file": opt.fake_arctic_answers, "latency": opt.fake_arctic_latency} if opt.arctic_backend == 'fake' else {})
+    )
+
+    # 工作流只编译一次，所有 worker 共享
+    app = build_pipeline(opt.pipeline_nodes, json.loads(opt.pipeline_setup), opt.executor)
+    print(f"工作流编译完成 (executor: {opt.executor})")
+
+    # 最终预测是流水线最后一个节点的预测，随任务完成追加检查点，结束时写出 output_file，不再重新读取各批次的结果
+    nodes = opt.pipeline_nodes.split('+')
+    final_node = topological_order(nodes, resolve_dependencies(nodes, json.loads(opt.pipeline_setup)))[-1]
+    final_aggregator = PredictionAggregator(final_output_file=opt.output_file, final_node_type=final_node, flush_every=opt.flush_every)
+
+    if finished_histories:
+        resumed_manager = RunManager(opt, "resumed", app, final_aggregator)
+        resumed_manager.import_histories(finished_histories)
+        resumed_manager.generate_sql_files()
+
+    if opt.scheduler == 'queue':
+        result_directorys = run_queue(data, opt, app, final_aggregator)
+    else:
+        result_directorys = run_batches(data, opt, app, final_aggregator)
+
+    print("所有批次处理完成，写出最终的SQL文件...")
+    final_aggregator.flush()
+    print(f"共 {len(final_aggregator.sqls.get(final_aggregator.final_node_type, {}))} 条预测，结果目录: {result_directorys}")
+
+    metrics = MetricsRecorder()
+    for endpoint, stats in HttpPool.all_stats().items():
+        metrics.set_gauge(f"http_pool {endpoint}", stats)
+    metrics.set_gauge("llm_resilience", Resilience().snapshot())
+    metrics.set_gauge("llm_budget", CostAccountant().snapshot())
+    metrics.set_gauge("prompt_cache", PromptCache().snapshot())
+    if opt.llm_cache in ('rw', 'ro'):
+        metrics.set_gauge("llm_cache", ResponseCache().snapshot())
+    if AsyncLLMClient._instance is not None:
+        metrics.set_gauge("async_llm", AsyncLLMClient().snapshot())
+    metrics_file = opt.metrics_file or str(Path(opt.output_file).with_name(f"{Path(opt.output_file).stem}_metrics.json"))
+    metrics.write(metrics_file)
+    print(metrics.format_summary())
+    print(f"运行指标保存至{metrics_file}")
+    if opt.trace == 'run':
+        trace_file = opt.trace_file or str(Path(opt.output_file).with_name(f"{Path(opt.output_file).stem}_trace.json"))
+        Tracer().write(trace_file)
+        print(f"trace 保存至{trace_file}")
 
     print("处理完成！")
     print(f'文件成功保存至{opt.output_file}')
@@ -127,11 +251,63 @@ if __name__ == "__main__":
     parser.add_argument("--temperature", type=float, default=0.0, help="温度越高越随机")
     parser.add_argument("--n", type=int, default=1, help="arctic的生成个数")
     parser.add_argument("--tensor_parallel_size", type=int, default=1, help="gpu的个数")
-    # 获取可用的GPU数量
-    tensor_parallel_size = torch.cuda.device_count()
-    print(f"Available GPUs: {tensor_parallel_size}")
-
+    parser.add_argument("--scheduler", type=str, choices=['batch', 'queue'], default='batch', help="batch: 固定切分批次; queue: 共享有界队列动态分配任务")
+    parser.add_argument("--num_workers", type=int, default=5, help="并行的worker(线程)数量")
+    parser.add_argument("--queue_size", type=int, default=None, help="queue调度时的队列容量，默认2倍worker数")
+    parser.add_argument("--task_order", type=str, choices=['question_id', 'db_affinity'], default='question_id', help="question_id: 按问题编号顺序; db_affinity: 同一数据库的问题固定给同一个worker连续处理")
+    parser.add_argument("--executor", type=str, choices=['langgraph', 'linear'], default='langgraph', help="langgraph: 编译StateGraph; linear: 内置的顺序执行器，开销更小")
+    parser.add_argument("--history_mode", type=str, choices=['json', 'journal'], default='json', help="json: 每个节点后重写问题的历史文件; journal: 后台线程追加写入 -history.jsonl，结束时压缩")
+    parser.add_argument("--flush_every", type=int, default=10, help="每完成多少个任务追加一次预测检查点(.jsonl)，完整的 JSON 文件在批次和运行结束时写出")
+    parser.add_argument("--shard_index", "--shard-index", type=int, default=0, help="多机运行时本机处理的分片编号")
+    parser.add_argument("--shard_count", "--shard-count", type=int, default=1, help="多机运行时的分片总数")
+    parser.add_argument("--shard_by", "--shard-by", type=str, choices=['db', 'question'], default='db', help="db: 同一数据库的问题分到同一分片; question: 按question_id轮流分配")
+    parser.add_argument("--resume", type=str, default=None, help="之前运行的结果目录，跳过其中已完成的问题和节点")
+    parser.add_argument("--trace", type=str, choices=['off', 'question', 'run'], default='off', help="记录节点/LLM/工具/SQL的嵌套span，输出Chrome trace格式(Perfetto可打开)。question: 每个问题写到结果目录的traces/下; run: 整个运行写一个文件")
+    parser.add_argument("--trace_file", type=str, default=None, help="--trace run 时的输出位置，默认 output_file 同目录下的 <名称>_trace.json")
+    parser.add_argument("--llm_cassette", type=str, choices=['off', 'record', 'replay'], default='off', help="record: 把LLM请求和响应记录到cassette_dir; replay: 从cassette_dir回放，不访问网络")
+    parser.add_argument("--cassette_dir", type=str, default="cassettes", help="LLM cassette 的存放目录")
+    parser.add_argument("--replay_latency", type=str, choices=['none', 'recorded', 'synthetic'], default='none', help="回放时的延迟: none 不等待; recorded 按录制时的耗时等待; synthetic 按 synthetic_latency 等待")
+    parser.add_argument("--synthetic_latency", type=float, default=1.0, help="synthetic 回放延迟的均值(秒)，每个请求在0.5到1.5倍之间")
+    parser.add_argument("--arctic_backend", type=str, choices=['vllm', 'fake'], default='vllm', help="vllm: 加载Arctic模型; fake: 基准测试用的假后端，不需要GPU")
+    parser.add_argument("--fake_arctic_answers", type=str, default=None, help="fake 后端的预置答案文件(benchmark.synthetic_dataset 生成的 answers.json)")
+    parser.add_argument("--fake_arctic_latency", type=float, default=0.0, help="fake 后端每次推理的耗时(秒)")
+    parser.add_argument("--http_pool_size", type=int, default=32, help="每个LLM endpoint保持的最大连接数，全部占用时请求排队等待")
+    parser.add_argument("--http_connect_timeout", type=float, default=10.0, help="建立连接的超时(秒)")
+    parser.add_argument("--http_read_timeout", type=float, default=300.0, help="等待响应数据的超时(秒)")
+    parser.add_argument("--no_http_keep_alive", action='store_true', help="每个请求后关闭连接(用于对比keep-alive的效果)")
+    parser.add_argument("--llm_rate_limits", type=str, default='{"default": {"max_concurrency": 8}}', help="异步LLM客户端(节点配置\"async\": true 时使用)每个模型的限制, JSON: {模型: {max_concurrency, min_concurrency, rpm, tpm}}, 未列出的模型使用 default")
+    parser.add_argument("--max_run_cost", type=float, default=None, help="整个运行的LLM费用上限(美元)，达到后按 budget_policy 降级")
+    parser.add_argument("--max_run_tokens", type=int, default=None, help="整个运行的LLM token上限(输入+输出)")
+    parser.add_argument("--max_question_cost", type=float, default=None, help="单个问题的LLM费用上限(美元)")
+    parser.add_argument("--max_question_tokens", type=int, default=None, help="单个问题的LLM token上限(输入+输出)")
+    parser.add_argument("--budget_policy", type=str, default=None, help='达到上限后的降级策略, JSON: {"skip_nodes": [...], "max_n": 1, "max_iterations": 2, "compaction": {"keep_recent": 1}, "hard_stop": false}，默认跳过两个精修节点、把n降到1、ReAct 最多2步并压缩历史')
+    parser.add_argument("--llm_max_attempts", type=int, default=5, help="每个LLM请求最多尝试的次数(含第一次)")
+    parser.add_argument("--llm_backoff_base", type=float, default=1.0, help="第一次重试的退避上限(秒)，之后每次翻倍，在0到上限之间随机")
+    parser.add_argument("--llm_backoff_max", type=float, default=30.0, help="退避时间的上限(秒)")
+    parser.add_argument("--llm_max_retry_after", type=float, default=120.0, help="服务端要求的Retry-After超过该值(秒)时直接放弃")
+    parser.add_argument("--llm_retry_budget", type=float, default=0.2, help="整个运行的重试预算: 每个请求允许的重试次数比例")
+    parser.add_argument("--llm_min_retry_budget", type=int, default=20, help="不受比例限制的最少重试次数")
+    parser.add_argument("--llm_breaker_threshold", type=int, default=5, help="endpoint连续失败多少次后熔断，熔断期间请求直接失败")
+    parser.add_argument("--llm_breaker_reset", type=float, default=30.0, help="熔断多少秒后放行一个探测请求")
+    parser.add_argument("--llm_cache", type=str, choices=['off', 'rw', 'ro', 'bypass'], default='off', help="磁盘LLM响应缓存: rw 读写; ro 只读; bypass 本次运行不读也不写缓存文件; off 不使用")
+    parser.add_argument("--llm_cache_path", type=str, default="llm_cache.sqlite", help="LLM响应缓存的SQLite文件，可跨运行共用")
+    parser.add_argument("--llm_cache_max_mb", type=float, default=1024.0, help="缓存大小上限(MB)，超过后淘汰最久未访问的响应")
+    parser.add_argument("--llm_cache_deterministic_only", action='store_true', help="只缓存temperature为0的请求")
+    parser.add_argument("--prompt_layout", type=str, choices=['legacy', 'prefix'], default='legacy', help="legacy: 原来的prompt; prefix: 指令和数据库schema放在前面、问题放在最后，同一数据库的请求共享前缀，命中服务端和vLLM的prefix caching")
+    parser.add_argument("--report_prompt_cache", action='store_true', help="legacy布局下也估计每个请求能命中的前缀缓存并和服务端报告的对比(prefix布局总是开启)")
+    parser.add_argument("--no_prompt_cache_control", action='store_true', help="prefix布局下不给claude模型的共享前缀加cache_control标记")
+    parser.add_argument("--no_vllm_prefix_caching", action='store_true', help="关闭Arctic(vLLM)的prefix caching")
+    parser.add_argument("--result_root", type=str, default=RunManager.RESULT_ROOT_PATH, help="每个问题的结果目录的根目录，相对路径以 main.py 的工作目录为准")
+    parser.add_argument("--metrics_file", type=str, default=None, help="运行指标(耗时、token、费用、SQL执行)的输出位置，默认 output_file 同目录下的 <名称>_metrics.json")
+    parser.add_argument("--metrics_events_file", type=str, default=None, help="把每条原始指标事件追加写入此 JSON lines 文件；默认只保留汇总统计")
     opt = parser.parse_args()
+    # 获取可用的GPU数量，fake 后端不需要 torch
+    if opt.arctic_backend == 'vllm':
+        import torch
+        tensor_parallel_size = torch.cuda.device_count()
+    else:
+        tensor_parallel_size = 0
+    print(f"Available GPUs: {tensor_parallel_size}")
     opt.tensor_parallel_size = tensor_parallel_size
     opt.run_start_time = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
 
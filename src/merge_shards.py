@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from pipeline.workflow_builder import resolve_dependencies, topological_order
+
+
+def final_node_of(args: Dict[str, Any]) -> str:
+    """The last node of a run's pipeline, whose predictions are final."""
+    nodes = args["pipeline_nodes"].split("+")
+    return topological_order(nodes, resolve_dependencies(nodes, json.loads(args.get("pipeline_setup") or "{}")))[-1]
+
+
+def find_run_directories(path: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """The result directories under path (each has the run's -args.json), with their arguments."""
+    found = []
+    for root, _, files in os.walk(path):
+        if "-args.json" in files:
+            with open(os.path.join(root, "-args.json"), "r", encoding="utf-8") as f:
+                found.append((root, json.load(f)))
+    return sorted(found)
+
+
+def latest_runs(directories: List[Tuple[str, Dict[str, Any]]]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]:
+    """
+    Keeps, per shard, the batch directories of the run with the latest run_start_time.
+
+    A resumed run imports every question its earlier run finished, so when a crashed run and its
+    resumed run sit side by side, the later one holds all predictions of the shard.
+
+    Returns:
+        The kept directories, and the directories of the older runs that were skipped.
+    """
+    latest: Dict[Tuple[int, int], str] = {}
+    for _, args in directories:
+        shard = (args.get("shard_index", 0), args.get("shard_count", 1))
+        latest[shard] = max(latest.get(shard, ""), str(args["run_start_time"]))
+    kept, skipped = [], []
+    for directory, args in directories:
+        shard = (args.get("shard_index", 0), args.get("shard_count", 1))
+        (kept if str(args["run_start_time"]) == latest[shard] else skipped).append((directory, args))
+    return kept, [directory for directory, _ in skipped]
+
+
+def read_predictions(file: str) -> Optional[Dict[str, Any]]:
+    """
+    The predictions of a JSON file, or of its .jsonl checkpoint when the run stopped before
+    writing the JSON file (see PredictionAggregator); None if neither exists.
+    """
+    if os.path.isfile(file):
+        with open(file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    checkpoint = os.path.splitext(file)[0] + ".jsonl"
+    if not os.path.isfile(checkpoint):
+        return None
+    predictions = {}
+    with open(checkpoint, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break  # 崩溃时写了一半的最后一行
+            predictions[str(entry["question_id"])] = entry["sqls"]
+    print(f"[合并分片] {file} 不存在，读取检查点 {checkpoint}")
+    return predictions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="把分片运行的各分片预测合并成一个 final_prediction.json"
+    )
+    parser.add_argument(
+        "--inputs",
+        nargs="+",
+        required=True,
+        help="分片的预测文件(final_prediction.json 或 -sql_selection.json)，或递归查找的结果目录",
+    )
+    parser.add_argument("--output-file", required=True, help="合并后的 final_prediction.json 路径")
+    parser.add_argument(
+        "--input-json",
+        default=None,
+        help="传给 main.py 的数据集，每个 question_id 必须恰好预测一次；默认使用结果目录 -args.json 中的 input_file",
+    )
+    parser.add_argument(
+        "--no-check-missing",
+        action="store_true",
+        help="找不到数据集时也写出结果，不检查缺失的 question_id",
+    )
+    args = parser.parse_args()
+
+    files, run_args = [], []
+    for path in args.inputs:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        directories, skipped = latest_runs(find_run_directories(path))
+        for directory in skipped:
+            print(f"[合并分片] 跳过同一分片较早的运行: {directory}")
+        for directory, directory_args in directories:
+            files.append(os.path.join(directory, f"-{final_node_of(directory_args)}.json"))
+            run_args.append(directory_args)
+    if not files:
+        print(f"[合并分片] 没有找到预测文件: {args.inputs}")
+        return 1
+
+    merged: Dict[str, Any] = {}
+    sources: Dict[str, str] = {}
+    duplicates = []
+    for file in files:
+        predictions = read_predictions(file)
+        if predictions is None:
+            print(f"[合并分片] {file} 没有预测")
+            continue
+        for question_id, sql in predictions.items():
+            if question_id in merged:
+                duplicates.append((question_id, sources[question_id], file))
+                continue
+            merged[question_id] = sql
+            sources[question_id] = file
+        print(f"[合并分片] {file}: {len(predictions)} 条预测")
+
+    problems = False
+    shard_counts = {a.get("shard_count", 1) for a in run_args}
+    if len(shard_counts) > 1:
+        print(f"[合并分片] 各结果目录的分片总数不一致: {sorted(shard_counts)}")
+        problems = True
+    elif shard_counts:
+        shard_count = shard_counts.pop()
+        missing_shards = sorted(set(range(shard_count)) - {a.get("shard_index", 0) for a in run_args})
+        if missing_shards:
+            print(f"[合并分片] 缺少分片 {missing_shards} (共 {shard_count} 个分片)")
+            problems = True
+
+    input_json = args.input_json
+    if input_json is None:
+        input_files = {a["input_file"] for a in run_args if a.get("input_file")}
+        if len(input_files) == 1 and os.path.isfile(next(iter(input_files))):
+            input_json = input_files.pop()
+    missing = []
+    if input_json:
+        with open(input_json, "r", encoding="utf-8") as f:
+            expected = {str(item["question_id"]) for item in json.load(f)}
+        missing = sorted(expected - merged.keys(), key=int)
+        unexpected = sorted(merged.keys() - expected, key=int)
+        if unexpected:
+            print(f"[合并分片] {len(unexpected)} 条预测不在 {input_json} 中: {unexpected[:20]}")
+    elif not args.no_check_missing:
+        print("[合并分片] 无法确定数据集，不能检查缺失的 question_id；请指定 --input-json 或 --no-check-missing")
+        problems = True
+
+    for question_id, first, second in duplicates:
+        print(f"[合并分片] question_id {question_id} 同时出现在 {first} 和 {second}")
+    if missing:
+        print(f"[合并分片] {len(missing)} 个 question_id 没有预测: {missing[:20]}")
+    if duplicates or missing or problems:
+        print("[合并分片] 不写出结果文件")
+        return 1
+
+    with open(args.output_file, "w", encoding="utf-8") as f:
+        json.dump({k: merged[k] for k in sorted(merged, key=int)}, f, indent=2, ensure_ascii=False)
+    print(f"[合并分片] 从 {len(files)} 个文件合并了 {len(merged)} 条预测到 {args.output_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
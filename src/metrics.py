@@ -0,0 +1,251 @@
+import json
+import math
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Tuple
+
+# 每种事件在汇总表中统计的数值字段
+SUMMARY_FIELDS = {
+    "question": ["wall_time", "queue_wait"],
+    "node": ["wall_time"],
+    "llm": ["wall_time", "retries", "prompt_tokens", "completion_tokens", "cost", "cache_hit", "time_to_first_token", "stopped_early",
+            "expected_cached_tokens", "cached_tokens"],
+    "sql": ["wall_time"],
+    "arctic": ["lock_wait", "inference_time", "expected_cached_tokens", "cached_tokens"],
+    "react": ["steps", "full_tokens", "sent_tokens", "dropped_steps"],
+}
+
+# 按标签分组统计的事件，例如每个节点各自的耗时分布
+SUMMARY_GROUPS = {"node": "node"}
+
+PERCENTILES = [50, 90, 99]
+
+# 每个统计量保留的样本数，超过后用蓄水池抽样估计分位数
+RESERVOIR_SIZE = 4096
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Linear-interpolated percentile of the values, p in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class StreamingStats:
+    """
+    Count, total and max of a stream of values, with percentiles estimated from a uniform
+    reservoir sample of RESERVOIR_SIZE values (exact while fewer values were added).
+    """
+
+    def __init__(self, seed: int = 0):
+        self.count = 0
+        self.total = 0.0
+        self.max = -math.inf
+        self.reservoir: List[float] = []
+        self._random = random.Random(seed)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(value)
+        else:
+            index = self._random.randrange(self.count)
+            if index < RESERVOIR_SIZE:
+                self.reservoir[index] = value
+
+    def stats(self) -> Dict[str, float]:
+        stats = {"count": self.count, "total": self.total, "mean": self.total / self.count}
+        stats.update({f"p{p}": percentile(self.reservoir, p) for p in PERCENTILES})
+        stats["max"] = self.max
+        return stats
+
+
+class MetricsRecorder:
+    """
+    A singleton collecting timing, token and cost events from every worker thread of a run.
+
+    Events are labelled with the current scope (question_id, db_id, node), which lives in a
+    ContextVar: RunManager opens the question scope and node_decorator the node scope, so LLM
+    calls and SQL executions made anywhere below a node are attributed to it, including the
+    ones made in threads started with a copied context.
+
+    Events are not kept: each one updates the summary statistics (StreamingStats) and the
+    per-question totals as it is recorded, so memory stays bounded by the number of questions.
+    The raw events can be streamed to a JSON lines file with configure(events_file=...).
+    """
+    _instance = None
+    _lock = Lock()
+    _scope: ContextVar = ContextVar("metrics_scope", default={})
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(MetricsRecorder, cls).__new__(cls)
+                instance._events_lock = Lock()
+                instance._events_file = None
+                instance.configure()
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, events_file: str = None) -> None:
+        """
+        Resets the collected metrics.
+
+        Args:
+            events_file (str, optional): Append every raw event to this file as a JSON line.
+        """
+        with self._events_lock:
+            if self._events_file is not None:
+                self._events_file.close()
+            self.stats: Dict[Tuple[str, str], StreamingStats] = {}
+            self.questions: Dict[str, Dict[str, Dict[str, float]]] = {}
+            self.gauges: Dict[str, Dict[str, Any]] = {}
+            self.events_path = events_file
+            self._events_file = None
+            if events_file:
+                Path(events_file).parent.mkdir(parents=True, exist_ok=True)
+                self._events_file = open(events_file, 'w', encoding='utf-8')
+
+    @contextmanager
+    def scope(self, **labels: Any) -> Iterator[None]:
+        """Adds labels to every event recorded inside the block."""
+        token = self._scope.set({**self._scope.get(), **labels})
+        try:
+            yield
+        finally:
+            self._scope.reset(token)
+
+    def record(self, kind: str, **values: Any) -> None:
+        """
+        Records one event.
+
+        Args:
+            kind (str): The event kind, e.g. "node", "llm", "sql", "arctic".
+            **values: The measured values (seconds, tokens, dollars, counts).
+        """
+        event = {"kind": kind, **self._scope.get(), **values}
+        groups = [kind]
+        if kind in SUMMARY_GROUPS and event.get(SUMMARY_GROUPS[kind]) is not None:
+            groups.append(f"{kind}:{event[SUMMARY_GROUPS[kind]]}")
+        with self._events_lock:
+            for field in SUMMARY_FIELDS.get(kind, []):
+                if event.get(field) is None:
+                    continue
+                for group in groups:
+                    key = (group, field)
+                    if key not in self.stats:
+                        self.stats[key] = StreamingStats(seed=len(self.stats))
+                    self.stats[key].add(event[field])
+            self._add_question_totals(event)
+            if self._events_file is not None:
+                self._events_file.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+    def _add_question_totals(self, event: Dict[str, Any]) -> None:
+        if "question_id" not in event:
+            return
+        node = "_question" if event["kind"] == "question" else event.get("node", "_other")
+        totals = self.questions.setdefault(str(event["question_id"]), {}).setdefault(node, {})
+
+        def add(name, value):
+            totals[name] = totals.get(name, 0) + (value or 0)
+
+        if event["kind"] in ("question", "node"):
+            add("wall_time", event["wall_time"])
+            if event.get("queue_wait") is not None:
+                add("queue_wait", event["queue_wait"])
+        elif event["kind"] == "llm":
+            add("llm_calls", 1)
+            add("llm_time", event["wall_time"])
+            for field in ("retries", "prompt_tokens", "completion_tokens", "cost", "cache_hit", "cached_tokens"):
+                add(field, event.get(field))
+        elif event["kind"] == "sql":
+            add("sql_executions", 1)
+            add("sql_time", event["wall_time"])
+        elif event["kind"] == "arctic":
+            add("arctic_lock_wait", event["lock_wait"])
+            add("arctic_inference_time", event["inference_time"])
+
+    def set_gauge(self, name: str, values: Dict[str, Any]) -> None:
+        """Stores a point-in-time snapshot, e.g. connection pool counters, replacing the previous one."""
+        with self._events_lock:
+            self.gauges[name] = dict(values)
+
+    @contextmanager
+    def timer(self, kind: str, **values: Any) -> Iterator[Dict[str, Any]]:
+        """Records an event with the wall time of the block; the yielded dict can take more values."""
+        start_time = time.perf_counter()
+        try:
+            yield values
+        finally:
+            self.record(kind, wall_time=time.perf_counter() - start_time, **values)
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Returns count, total, mean, percentiles and max of every summary field, per event kind,
+        and per label for the kinds in SUMMARY_GROUPS (e.g. "node:sql_generation").
+
+        Returns:
+            Dict: {kind: {field: {"count", "total", "mean", "p50", "p90", "p99", "max"}}}
+        """
+        with self._events_lock:
+            stats = {key: value.stats() for key, value in self.stats.items()}
+        summary = {}
+        for kind, fields in SUMMARY_FIELDS.items():
+            groups = [kind] + sorted({group for group, _ in stats if group.startswith(f"{kind}:")})
+            for group in groups:
+                group_stats = {field: stats[(group, field)] for field in fields if (group, field) in stats}
+                if group_stats:
+                    summary[group] = group_stats
+        return summary
+
+    def per_question(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Totals per question and node: wall time, queue wait, LLM calls, retries, tokens, cost, cache hits,
+        prefix-cached tokens, SQL executions and their time, and Arctic lock wait and inference time.
+
+        Returns:
+            Dict: {question_id: {node: {metric: value}}}, with the pipeline total under "_question".
+        """
+        with self._events_lock:
+            return {question_id: {node: dict(totals) for node, totals in nodes.items()}
+                    for question_id, nodes in self.questions.items()}
+
+    def write(self, path: str) -> None:
+        """Writes the summary, the per-question totals and the path of the raw events file, if any, as JSON."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._events_lock:
+            gauges = dict(self.gauges)
+            if self._events_file is not None:
+                self._events_file.flush()
+        report = {"summary": self.summary(), "gauges": gauges, "questions": self.per_question(),
+                  "events_file": self.events_path}
+        with path.open('w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+
+    def format_summary(self) -> str:
+        """Formats the summary as a fixed-width table."""
+        header = ["metric", "count", "total", "mean"] + [f"p{p}" for p in PERCENTILES] + ["max"]
+        rows = [header]
+        for kind, fields in self.summary().items():
+            for field, stats in fields.items():
+                rows.append([f"{kind}.{field}", str(stats["count"])] +
+                            [f"{stats[key]:.4f}" for key in header[2:]])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = ["  ".join(cell.ljust(widths[0]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row))
+                 for row in rows]
+        lines.insert(1, "-" * len(lines[0]))
+        with self._events_lock:
+            gauges = dict(self.gauges)
+        for name, values in gauges.items():
+            lines.append(f"{name}: " + ", ".join(f"{key}={value}" for key, value in values.items()))
+        return "\n".join(lines)
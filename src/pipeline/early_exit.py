@@ -0,0 +1,126 @@
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from util import execute_sql
+
+# rule 名称 -> 判定函数，新的规则用 register_rule 注册
+EARLY_EXIT_RULES: Dict[str, Callable] = {}
+
+
+def register_rule(name: str) -> Callable:
+    """
+    Registers an early-exit rule.
+
+    A rule receives the candidate SQLs, their grouped execution results (largest group first,
+    as lists of candidate indices) and the rule's setup, and returns True to short-circuit.
+    """
+    def decorator(func: Callable) -> Callable:
+        EARLY_EXIT_RULES[name] = func
+        return func
+    return decorator
+
+
+@register_rule("unanimous_execution")
+def unanimous_execution(sqls: List[str], groups: List[List[int]], statuses: List[str], rule_setup: Dict[str, Any]) -> bool:
+    """Every candidate executed successfully and returned the same result."""
+    return len(groups) == 1 and statuses[groups[0][0]] == "Execute Success"
+
+
+@register_rule("confidence")
+def confidence(sqls: List[str], groups: List[List[int]], statuses: List[str], rule_setup: Dict[str, Any]) -> bool:
+    """The largest group of successful, identical results holds at least `threshold` of the candidates."""
+    top = groups[0]
+    return statuses[top[0]] == "Execute Success" and len(top) / len(sqls) >= rule_setup.get("threshold", 1.0)
+
+
+def execution_key(execution: Any) -> str:
+    """Drops the SQL text from an execution response so equal results of different SQLs compare equal."""
+    if 'The execution' in execution[1]:
+        return execution[1].split('The execution')[1]
+    return execution[1]  # 当执行不成功时
+
+
+def collect_candidates(execution_history: List[Dict[str, Any]], sources: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """Returns the source steps, or the latest step with a list of sqls when no sources are given."""
+    if sources:
+        steps = []
+        for source in sources:
+            for step in reversed(execution_history):
+                if step["node_type"] == source:
+                    steps.append(step)
+                    break
+        return steps
+    for step in reversed(execution_history):
+        if isinstance(step.get("sqls"), list) and step.get("status") == "success":
+            return [step]
+    return []
+
+
+def check_early_exit(node_name: str, rule_setup: Dict[str, Any], execution_history: List[Dict[str, Any]],
+                     sqlite_dir: Any, execute_history: set) -> Optional[Dict[str, Any]]:
+    """
+    Evaluates the early-exit rule a node declares in its setup, e.g.
+
+        "sql_style_refinement": {"early_exit": {"rule": "unanimous_execution", "source": ["sql_generation"]}}
+        "sql_selection": {"early_exit": {"rule": "confidence", "threshold": 0.8}}
+
+    Candidates come from the "source" nodes (default: the latest node with sqls). Steps that
+    already carry "executions" are not executed again.
+
+    Returns:
+        Optional[Dict[str, Any]]: The short-circuit decision, or None if the rule does not fire.
+    """
+    rule_name = rule_setup.get("rule")
+    if rule_name not in EARLY_EXIT_RULES:
+        raise ValueError(f"Unknown early_exit rule '{rule_name}' for node '{node_name}'")
+
+    sqls, executions = [], []
+    for step in collect_candidates(execution_history, rule_setup.get("source")):
+        step_sqls = step.get("sqls") or []
+        step_executions = step.get("executions")
+        if not step_executions or len(step_executions) != len(step_sqls):
+            step_executions = [execute_sql(sql, sqlite_dir, execute_history) for sql in step_sqls]
+        sqls.extend(step_sqls)
+        executions.extend(step_executions)
+    if not sqls:
+        return None
+
+    statuses = [execution[0] if execution else "Execute Failed" for execution in executions]
+    index_map = defaultdict(list)
+    for i, execution in enumerate(executions):
+        index_map[execution_key(execution) if execution else ""].append(i)
+    groups = sorted(index_map.values(), key=len, reverse=True)
+
+    if not EARLY_EXIT_RULES[rule_name](sqls, groups, statuses, rule_setup):
+        return None
+    return {
+        "decided_by": node_name,
+        "rule": rule_name,
+        "agreement": len(groups[0]) / len(sqls),
+        "sql": sqls[groups[0][0]],
+        "sqls": [sqls[i] for i in groups[0]],
+    }
+
+
+def short_circuit_result(node_name: str, decision: Dict[str, Any], is_final: bool) -> Dict[str, Any]:
+    """
+    Builds the history entry of a node bypassed by a short-circuit.
+
+    Intermediate nodes are recorded as "skipped" and pass the agreeing SQLs on; the final node
+    records the agreed SQL as its answer. Both keep the decision under "short_circuit", so a
+    resumed run continues from it instead of evaluating the rule again.
+    """
+    if is_final:
+        return {
+            "candidate_sqls": decision["sqls"],
+            "sqls": [decision["sql"]],
+            "status": "success",
+            "short_circuit": decision,
+        }
+    return {
+        "sqls": decision["sqls"],
+        "rules": [""] * len(decision["sqls"]),
+        "status": "skipped",
+        "skip_reason": f"{decision['rule']} at {decision['decided_by']}",
+        "short_circuit": decision,
+    }
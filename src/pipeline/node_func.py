@@ -8,12 +8,15 @@ from typing import Any, Dict
 from pathlib import Path
 import json
 from evaluate import major_voting
-from pipeline.utils import node_decorator
-from pipeline.pipeline_manager import PipelineManager
-from database_manager import DatabaseManager
+from pipeline.early_exit import execution_key
+from pipeline.utils import node_decorator, run_in_parallel
+from task_context import TaskContext
 from arctic_manager import ArcticManager
 from llm import model_chose
+from prompt_cache import PromptCache
+from resilience import LLMRequestError
 from prompt import *
+from prompt import SCHEMA_LINKING_SYSTEM_PROMPT
 from util import extract_sql_from_text, extract_rule_from_text, execute_sql, get_last_node_result, get_filter_schema_from_sqls
 from util import extract_filtered_ddl, format_table_column_name, process_redundant_columns
 import sqlglot
@@ -21,154 +24,274 @@ import sqlglot
 
 MAX_RETRIES= 3
 
+# 返回的 choices 少于 n 的模型在这个时间(秒)之内逐个请求采样，过期后重新尝试 n>1，
+# 以免一次偶发的少返回或换了服务端之后一直不再分组
+SINGLE_SAMPLE_TTL = 600
+_single_sample_until: Dict[str, float] = {}
+
+
+def single_sample_only(model: str) -> bool:
+    """Whether the model recently returned fewer choices than asked for, see SINGLE_SAMPLE_TTL."""
+    return _single_sample_until.get(model, 0.0) > time.monotonic()
+
+def schema_linking_sample(chat_model, content_input, temperature, sqlite_dir, execute_history):
+    """
+    Draws one schema-linking candidate, feeding execution errors back to the LLM for up to MAX_RETRIES attempts.
+
+    Returns:
+        Tuple[str, Any, int]: The SQL and its execution response, or ("", "") if every attempt failed,
+        and the number of LLM calls made.
+    """
+    messages = [
+            {
+                "role": "system",
+                "content": SCHEMA_LINKING_SYSTEM_PROMPT,
+            },
+            {
+                "role": "user", 
+                "content": content_input
+            }
+        ]
+
+    for att in range(MAX_RETRIES):
+        try:
+            llm_response = chat_model.get_ans(messages, temperature=temperature)      #添加温度参数
+            print(f"现在温度是：{temperature}\n")
+            # 提取SQL语句
+            sqls = extract_sql_from_text(llm_response)
+
+            # 生成错误的列需要纠正
+            execute_response = execute_sql(sqls[-1].strip(), sqlite_dir, execute_history)
+            if execute_response[0] == 'Execute Failed':
+                messages.append({
+                    "role": "user", 
+                    "content": f"The previous SQL execution failed with the following error:\n{execute_response[1]}\nPlease correct the SQL and try again."
+                })
+                raise Exception(str(execute_response))
+
+            return sqls[-1].strip(), execute_response, att + 1
+
+        except Exception as e:
+            print(f"第{att + 1}次尝试失败，错误信息：{str(e)}")
+            
+            # LLM 请求本身已经在 Resilience 里退避重试过，这里失败就不再重试；SQL 执行报错直接带着报错重试
+            if att == MAX_RETRIES - 1 or isinstance(e, LLMRequestError):
+                print(f"经过{att + 1}次尝试后仍然失败，返回空列表")
+                break
+    return "", "", att + 1
+
+
+def ask_llm(chat_model, request, single=True):
+    """Sends one request through chat_model.get_ans, returning the exception instead of raising it."""
+    try:
+        return chat_model.get_ans(single=single, **request)
+    except Exception as e:
+        return e
+
+
+def schema_linking_samples_grouped(chat_model, content_input, temperatures, sqlite_dir, execute_history, use_async=False,
+                                   max_concurrency=None):
+    """
+    Draws one schema-linking candidate per temperature like schema_linking_sample, in rounds:
+
+    The first round asks for all candidates of a temperature in one request with n>1. If the
+    provider returns fewer choices than asked for (no `n` support), the missing candidates are
+    requested one by one in the same round, and calls to that model are not grouped for the next
+    SINGLE_SAMPLE_TTL seconds. Later rounds only resend the candidates whose SQL failed, each with
+    its own execution-error feedback. A request that raises (LLMRequestError after Resilience's
+    retries) is final for its candidates, as in schema_linking_sample.
+
+    Args:
+        use_async (bool, optional): Send each round as one batch through chat_model.get_ans_batch
+            instead of one thread per request.
+        max_concurrency (int, optional): The thread limit when use_async is off.
+
+    Returns:
+        Tuple[List[Tuple[str, Any, int]], int]: (sql, execution response, attempts) per temperature, as
+        schema_linking_sample, and the number of LLM requests sent (a grouped request counts once).
+    """
+    conversations = [[
+        {"role": "system", "content": SCHEMA_LINKING_SYSTEM_PROMPT},
+        {"role": "user", "content": content_input},
+    ] for _ in temperatures]
+
+    def send(requests):
+        # requests: [(该请求对应的候选编号, 请求参数)]，返回每个候选的回答或异常
+        payloads = [request for _, request in requests]
+        if use_async:
+            answers = chat_model.get_ans_batch(payloads, single=False)
+        else:
+            answers = run_in_parallel(ask_llm, [(chat_model, payload, False) for payload in payloads], max_workers=max_concurrency)
+        texts, unanswered = {}, []
+        for (ks, _), answer in zip(requests, answers):
+            if isinstance(answer, Exception):
+                print(f"候选{ks}请求失败，错误信息：{str(answer)}")
+                texts.update({k: answer for k in ks})
+                continue
+            for k, choice in zip(ks, answer):
+                texts[k] = choice["message"]["content"]
+            unanswered += ks[len(answer):]
+        return texts, unanswered
+
+    samples = [("", "", MAX_RETRIES)] * len(temperatures)
+    llm_calls = 0
+    groups = defaultdict(list)
+    single = single_sample_only(chat_model.model)
+    for k, temperature in enumerate(temperatures):
+        groups[k if single else temperature].append(k)
+    requests = [(ks, {"messages": conversations[ks[0]], "temperature": temperatures[ks[0]], "n": len(ks)})
+                for ks in groups.values()]
+    for att in range(MAX_RETRIES):
+        if not requests:
+            break
+        texts, unanswered = send(requests)
+        llm_calls += len(requests)
+        if unanswered:
+            # 服务不支持 n 时返回的 choices 不够，剩下的逐个请求
+            print(f"返回的候选数量不足，单独请求候选{unanswered}")
+            _single_sample_until[chat_model.model] = time.monotonic() + SINGLE_SAMPLE_TTL
+            fallback, _ = send([([k], {"messages": conversations[k], "temperature": temperatures[k]}) for k in unanswered])
+            llm_calls += len(unanswered)
+            texts.update(fallback)
+
+        sqls, failed = {}, []
+        for k, text in sorted(texts.items()):
+            if isinstance(text, Exception):
+                # 请求本身已经在 Resilience 里退避重试过，这些候选不再重试
+                samples[k] = ("", "", att + 1)
+                continue
+            extracted = extract_sql_from_text(text)
+            if extracted:
+                sqls[k] = extracted[-1].strip()
+            else:
+                print(f"候选{k}第{att + 1}次尝试失败，没有得到SQL")
+                failed.append(k)
+        executions = run_in_parallel(execute_sql, [(sql, sqlite_dir, execute_history) for sql in sqls.values()])
+        for (k, sql), execute_response in zip(sqls.items(), executions):
+            if execute_response[0] == 'Execute Failed':
+                conversations[k].append({
+                    "role": "user",
+                    "content": f"The previous SQL execution failed with the following error:\n{execute_response[1]}\nPlease correct the SQL and try again."
+                })
+                failed.append(k)
+            else:
+                samples[k] = (sql, execute_response, att + 1)
+        # 只有失败的候选进入下一轮，各自带着自己的报错
+        requests = [([k], {"messages": conversations[k], "temperature": temperatures[k]}) for k in sorted(failed)]
+    return samples, llm_calls
+
+
+def schema_linking_candidates(config, chat_model, db_desc, question, sqlite_dir, execute_history):
+    """
+    Draws config['n'] candidates concurrently, at most config['max_concurrency'] at a time.
+    The k-th candidate uses config['temperature'][k % len(config['temperature'])].
+
+    With an "adaptive" setup, e.g. {"min": 3, "max": 8, "agreement": 3, "step": 1}, candidates are
+    drawn in waves instead: "min" first, then "step" more at a time until "agreement" candidates
+    executed successfully with the same result, or "max" candidates were drawn.
+
+    By default every candidate is its own request (schema_linking_sample). With
+    config["group_by_temperature"], candidates sharing a temperature are requested together with
+    n>1 (schema_linking_samples_grouped). With config["async"], the requests are sent as batches
+    through the AsyncLLMClient instead of one thread per request.
+
+    Returns:
+        Dict[str, Any]: "sqls" and "executions", ordered by k, and "sampling" with the number of
+        samples and LLM calls made and the samples saved compared to drawing them all.
+    """
+    if PromptCache().layout == "prefix":
+        content_input = PromptCache().user_content(chat_model.model, *get_filter_ddl_agent_prompt_parts(db_desc, question))
+    else:
+        content_input = get_filter_ddl_agent_prompt(db_desc, question)
+    adaptive = config.get("adaptive")
+    max_samples = adaptive.get("max", config["n"]) if adaptive else config["n"]
+    temperatures = [config["temperature"][k % len(config["temperature"])] for k in range(max_samples)]  # 支持n>len(temperature)时循环使用
+
+    samples, llm_calls = [], 0
+
+    def draw(start, stop):
+        # 返回新的候选，llm_calls 累计实际发出的请求数
+        nonlocal llm_calls
+        if config.get("group_by_temperature", False) or config.get("async"):
+            new_samples, calls = schema_linking_samples_grouped(chat_model, content_input, temperatures[start:stop], sqlite_dir,
+                                                                execute_history, use_async=config.get("async", False),
+                                                                max_concurrency=config.get("max_concurrency"))
+            llm_calls += calls
+            return new_samples
+        new_samples = run_in_parallel(
+            schema_linking_sample,
+            [(chat_model, content_input, temperature, sqlite_dir, execute_history) for temperature in temperatures[start:stop]],
+            max_workers=config.get("max_concurrency"),
+        )
+        llm_calls += sum(calls for _, _, calls in new_samples)
+        return new_samples
+
+    if not adaptive:
+        samples = draw(0, max_samples)
+    else:
+        min_samples = min(adaptive.get("min", 1), max_samples)
+        agreement = adaptive.get("agreement", min_samples)
+        step = max(1, adaptive.get("step", 1))
+        samples = draw(0, min_samples)
+        # 执行结果还没有达到一致时才继续采样
+        while len(samples) < max_samples and execution_agreement(samples) < agreement:
+            samples += draw(len(samples), min(len(samples) + step, max_samples))
+
+    return {
+        "sqls": [sql for sql, _, _ in samples],
+        "executions": [execute_response for _, execute_response, _ in samples],
+        "sampling": {
+            "samples": len(samples),
+            "max_samples": max_samples,
+            "saved_samples": max_samples - len(samples),
+            "llm_calls": llm_calls,
+        },
+    }
+
+
+def execution_agreement(samples):
+    """Returns the size of the largest group of candidates that executed successfully with the same result."""
+    groups = defaultdict(int)
+    for _, execute_response, _ in samples:
+        if execute_response and execute_response[0] == "Execute Success":
+            groups[execution_key(execute_response)] += 1
+    return max(groups.values(), default=0)
+
+
 @node_decorator(check_schema_status=False)
 def schema_linking(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
-    config, node_name=PipelineManager().get_model_para()
+    context = TaskContext.current()
+    config, node_name = context.get_model_para()
     print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
-    paths=DatabaseManager()
     chat_model = model_chose(node_name,config["engine"])  
 
-    db_id = task.db_id
-    question_id = task.question_id
     execute_history = task.execute_history
-    sqlite_dir=paths.db_path
+    sqlite_dir = context.db_path
 
     print(sqlite_dir)
 
-    pred_sqls = []
-    execute_responses = []
-    for k in range(config['n']):  # 一共生成n组结果，每组结果运行重试3次
-        temperature = config["temperature"][k % len(config["temperature"])]
-        content_input = get_filter_ddl_agent_prompt(task.db_desc, task.question)
-        messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a data science expert. Below, you are provided with a database schema and a natural"
-                        " language question. Your task is to understand the schema and generate a valid SQL query to"
-                        " answer the question."
-                    ),
-                },
-                {
-                    "role": "user", 
-                    "content": content_input
-                }
-            ]
-
-        for att in range(MAX_RETRIES):   # TODO 这个错误控制应该不是这么写的
-            try:
-                llm_response = chat_model.get_ans(messages, temperature=temperature)      #添加温度参数
-                print(f"现在温度是：{temperature}\n")
-                # 提取SQL语句
-                sqls = extract_sql_from_text(llm_response)
-
-                # 生成错误的列需要纠正
-                execute_response = execute_sql(sqls[-1].strip(), sqlite_dir, execute_history)
-                if execute_response[0] == 'Execute Failed':
-                    messages.append({
-                        "role": "user", 
-                        "content": f"The previous SQL execution failed with the following error:\n{execute_response[1]}\nPlease correct the SQL and try again."
-                    })
-                    raise Exception(str(execute_response))
-
-                pred_sqls.append(sqls[-1].strip())
-                execute_responses.append(execute_response)
-                break
-
-            except Exception as e:
-                print(f"第{att + 1}次尝试失败，错误信息：{str(e)}")
-                
-                # 如果是最后一次尝试，抛出异常
-                if att == MAX_RETRIES - 1:
-                    print(f"经过{MAX_RETRIES}次尝试后仍然失败，返回空列表")
-                    pred_sqls.append("")
-                    execute_responses.append("")
-                else:                
-                    # 等待一段时间再重试（可选）
-                    print(f"等待1秒后进行第{att + 2}次尝试...")
-                    time.sleep(1)
-
-    response = {
-        "sqls": pred_sqls,
-        "executions": execute_responses
-    }
+    # 一共生成n组结果，每组结果运行重试3次，各组之间并发
+    response = schema_linking_candidates(config, chat_model, task.db_desc, task.question, sqlite_dir, execute_history)
     return response
 
 
 @node_decorator(check_schema_status=False)
 def schema_linking_info(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
-    config, node_name=PipelineManager().get_model_para()
+    context = TaskContext.current()
+    config, node_name = context.get_model_para()
     print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
-    paths=DatabaseManager()
 
-    db_id = task.db_id
     execute_history = task.execute_history
-    question_id = task.question_id
-    sqlite_dir=paths.db_path
+    sqlite_dir = context.db_path
     chat_model = model_chose(node_name,config["engine"])  
 
-    pred_sqls = []
-    execute_responses = []
-    for k in range(config['n']):  # 一共生成n组结果，每组结果运行重试3次
-        temperature = config["temperature"][k % len(config["temperature"])]  # 支持n>len(temperature)时循环使用
-        content_input = get_filter_ddl_agent_prompt(task.db_desc_info, task.question)  # 这里不同，加上了ours信息
-        messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a data science expert. Below, you are provided with a database schema and a natural"
-                        " language question. Your task is to understand the schema and generate a valid SQL query to"
-                        " answer the question."
-                    ),
-                },
-                {
-                    "role": "user", 
-                    "content": content_input
-                }
-            ]
-        for att in range(MAX_RETRIES):   # TODO 这个错误控制应该不是这么写的
-            try:
-                llm_response = chat_model.get_ans(messages, temperature=temperature)
-                print(f"现在温度是：{temperature}\n")
-                # 提取SQL语句
-                sqls = extract_sql_from_text(llm_response)
-
-                # 生成错误的列需要纠正
-                execute_response = execute_sql(sqls[-1].strip(), sqlite_dir, execute_history)
-                if execute_response[0] == 'Execute Failed':
-                    messages.append({
-                        "role": "user", 
-                        "content": f"The previous SQL execution failed with the following error:\n{execute_response[1]}\nPlease correct the SQL and try again."
-                    })
-                    raise Exception(str(execute_response))
-
-                pred_sqls.append(sqls[-1].strip())
-                execute_responses.append(execute_response)
-                break
-
-            except Exception as e:
-                print(f"第{att + 1}次尝试失败，错误信息：{str(e)}")
-                
-                # 如果是最后一次尝试，抛出异常
-                if att == MAX_RETRIES - 1:
-                    print(f"经过{MAX_RETRIES}次尝试后仍然失败，返回空列表")
-                    pred_sqls.append("")
-                    execute_responses.append("")
-                else:                
-                    # 等待一段时间再重试（可选）
-                    print(f"等待1秒后进行第{att + 2}次尝试...")
-                    time.sleep(1)
-    
-    response = {
-        "sqls": pred_sqls,
-        "executions": execute_responses
-    }
+    # 这里不同，加上了ours信息
+    response = schema_linking_candidates(config, chat_model, task.db_desc_info, task.question, sqlite_dir, execute_history)
     return response
 
 
-def sql_generation_tool(draft_sql, task, chat_model):
-    paths=DatabaseManager()
-    sqlite_dir=paths.db_path
+def sql_generation_tool(draft_sql, task, chat_model, compaction=None, max_iterations=6):
+    sqlite_dir = TaskContext.current().db_path
     try:
         expression = sqlglot.parse_one(draft_sql, dialect='sqlite')
         columns = expression.find_all(sqlglot.exp.Column)
@@ -224,14 +347,14 @@ def sql_generation_tool(draft_sql, task, chat_model):
 
 
     # 第二次调用LLM，加knowledge确认
-    content_input = get_generate_sql_agent_prompt(filtered_ddl, task.question, draft_sql, task.example)
+    if PromptCache().layout == "prefix":
+        content_input = PromptCache().user_content(
+            chat_model.model, *get_generate_sql_agent_prompt_parts(filtered_ddl, task.question, draft_sql, task.example))
+    else:
+        content_input = get_generate_sql_agent_prompt(filtered_ddl, task.question, draft_sql, task.example)
     messages = [{
                     "role": "system",
-                    "content": (
-                        "You are a data science expert. Below, you are provided with a database schema and a natural"
-                        " language question. Your task is to understand the schema and generate a valid SQL query to"
-                        " answer the question."
-                    ),
+                    "content": SCHEMA_LINKING_SYSTEM_PROMPT,
                 },
                 {
                     "role": "user", 
@@ -239,7 +362,8 @@ def sql_generation_tool(draft_sql, task, chat_model):
                 }
 
     ]
-    llm_response = chat_model.get_ans_with_tool(messages, task.fd_list, sqlite_dir, task.execute_history, max_iterations=6)
+    llm_response = chat_model.get_ans_with_tool(messages, task.fd_list, sqlite_dir, task.execute_history, max_iterations=max_iterations,
+                                                compaction=compaction)
     pred_sql = extract_sql_from_text(llm_response)[-1]
     rules = extract_rule_from_text(llm_response)[-1]
 
@@ -251,9 +375,9 @@ def sql_generation_tool(draft_sql, task, chat_model):
 def sql_generation(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
     print('question_id: ', task.question_id, ' enter sql_generation -----')
 
-    config,node_name = PipelineManager().get_model_para()
+    context = TaskContext.current()
+    config, node_name = context.get_model_para()
     print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
-    paths=DatabaseManager()
     chat_model = model_chose(node_name, config["engine"])
 
     schema_linking_execution = get_last_node_result(execution_history, "schema_linking")["executions"]
@@ -292,22 +416,20 @@ def sql_generation(task: Any, execution_history: Dict[str, Any]) -> Dict[str, An
         for sql in all_sqls:
             for att in range(MAX_RETRIES):   # TODO 这个错误控制应该不是这么写的
                 try:
-                    generation_sql, rule = sql_generation_tool(sql, task, chat_model)
+                    generation_sql, rule = sql_generation_tool(sql, task, chat_model, config.get("compaction"),
+                                                                          config.get("max_iterations", 6))
                     pred_sqls.append(generation_sql)
                     rules.append(rule)
                     break
                 except Exception as e:
                     print(f"第{att + 1}次尝试失败，错误信息：{str(e)}")
                     
-                    # 如果是最后一次尝试，抛出异常
-                    if att == MAX_RETRIES - 1:
-                        print(f"经过{MAX_RETRIES}次尝试后仍然失败，返回空列表")
+                    # LLM 请求本身已经在 Resilience 里退避重试过，这里失败就不再重试
+                    if att == MAX_RETRIES - 1 or isinstance(e, LLMRequestError):
+                        print(f"经过{att + 1}次尝试后仍然失败，返回空列表")
                         pred_sqls.append("")
                         rules.append("")
-                    else:                
-                        # 等待一段时间再重试（可选）
-                        print(f"等待1秒后进行第{att + 2}次尝试...")
-                        time.sleep(1) 
+                        break
 
     print(pred_sqls)
 
@@ -325,14 +447,14 @@ def sql_generation(task: Any, execution_history: Dict[str, Any]) -> Dict[str, An
 def sql_style_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
     print('question_id: ', task.question_id, 'enter sql_style_refinement -----')
     
-    config,node_name = PipelineManager().get_model_para()
+    context = TaskContext.current()
+    config, node_name = context.get_model_para()
     print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
-    paths = DatabaseManager()
     chat_model = model_chose(node_name, config["engine"])
     
     question_id = task.question_id
     execute_history = task.execute_history
-    sqlite_dir = paths.db_path
+    sqlite_dir = context.db_path
     
     sql_generation_sqls = get_last_node_result(execution_history, "sql_generation")["sqls"]
     rules = get_last_node_result(execution_history, "sql_generation")["rules"]
@@ -357,7 +479,7 @@ def sql_style_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[s
 
     pred_sqls = []
     for idx, (sql, rule) in enumerate(zip(sql_generation_sqls, rules)): 
-        if 'dev' in sqlite_dir:
+        if 'dev' in str(sqlite_dir):
             content_input = get_style_sql_agent_dev_prompt(task.question, sql, rule)
         else:
             content_input = get_style_sql_agent_test_prompt(task.question, sql, rule)
@@ -373,7 +495,8 @@ def sql_style_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[s
                 ]
         for att in range(MAX_RETRIES):   
             try:
-                llm_response = chat_model.get_ans(messages)
+                # 节点配置 "stream": {"stop_after_sql": true} 时拿到SQL代码块就停止接收
+                llm_response = chat_model.get_ans(messages, stream=config.get("stream"))
                 generation_sql = extract_sql_from_text(llm_response)[-1]
 
                 execute_response = execute_sql(generation_sql.strip(), sqlite_dir, execute_history)
@@ -388,14 +511,11 @@ def sql_style_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[s
             except Exception as e:
                 print(f"第{att + 1}次尝试失败，错误信息：{str(e)}")
                 
-                # 如果是最后一次尝试，抛出异常
-                if att == MAX_RETRIES - 1:
-                    print(f"经过{MAX_RETRIES}次尝试后仍然失败，返回空列表")
+                # LLM 请求本身已经在 Resilience 里退避重试过，这里失败就不再重试；SQL 执行报错直接带着报错重试
+                if att == MAX_RETRIES - 1 or isinstance(e, LLMRequestError):
+                    print(f"经过{att + 1}次尝试后仍然失败，返回空列表")
                     pred_sqls.append("")
-                else:                
-                    # 等待一段时间再重试（可选）
-                    print(f"等待1秒后进行第{att + 2}次尝试...")
-                    time.sleep(1)   
+                    break
 
     response = {
         "sqls": pred_sqls
@@ -408,14 +528,14 @@ def sql_style_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[s
 def sql_output_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
     print('question_id: ', task.question_id, 'enter sql_output_refinement -----')
 
-    config,node_name = PipelineManager().get_model_para()
+    context = TaskContext.current()
+    config, node_name = context.get_model_para()
     print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
     chat_model = model_chose(node_name, config["engine"])
-    paths=DatabaseManager()
 
     question_id = task.question_id
     execute_history = task.execute_history
-    sqlite_dir = paths.db_path
+    sqlite_dir = context.db_path
 
     style_sqls = get_last_node_result(execution_history, "sql_style_refinement")["sqls"]
     
@@ -452,7 +572,7 @@ def sql_output_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[
                 ]
         for att in range(MAX_RETRIES):
             try:
-                llm_response = chat_model.get_ans(messages)
+                llm_response = chat_model.get_ans(messages, stream=config.get("stream"))
                 pred_sql = extract_sql_from_text(llm_response)[-1]
                 # 生成错误需要纠正
                 execute_response = execute_sql(pred_sql.strip(), sqlite_dir, execute_history)
@@ -468,14 +588,11 @@ def sql_output_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[
             except Exception as e:
                 print(f"第{att + 1}次尝试失败，错误信息：{str(e)}")
                 
-                # 如果是最后一次尝试，抛出异常
-                if att == MAX_RETRIES - 1:
-                    print(f"经过{MAX_RETRIES}次尝试后仍然失败，返回空列表")
+                # LLM 请求本身已经在 Resilience 里退避重试过，这里失败就不再重试；SQL 执行报错直接带着报错重试
+                if att == MAX_RETRIES - 1 or isinstance(e, LLMRequestError):
+                    print(f"经过{att + 1}次尝试后仍然失败，返回空列表")
                     pred_sqls.append("")
-                else:                
-                    # 等待一段时间再重试（可选）
-                    print(f"等待1秒后进行第{att + 2}次尝试...")
-                    time.sleep(1)
+                    break
 
     response = {
         "sqls": pred_sqls
@@ -484,14 +601,8 @@ def sql_output_refinement(task: Any, execution_history: Dict[str, Any]) -> Dict[
 
 
 
-@node_decorator(check_schema_status=False)
-def sql_selection(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
-    print('question_id: ', task.question_id, 'enter sql_selection -----')
-
-    config,node_name = PipelineManager().get_model_para()
-    print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
-    paths = DatabaseManager()
-
+def arctic_candidates(task: Any, execution_history: Dict[str, Any]) -> list:
+    """Runs Arctic inference on the schema filtered by the schema-linking SQLs."""
     arctic_model = ArcticManager()
     schema_sqls = get_last_node_result(execution_history, "schema_linking")["sqls"]
     schema_info_sqls = get_last_node_result(execution_history, "schema_linking_info")["sqls"]
@@ -502,10 +613,41 @@ def sql_selection(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any
                 question=task.question,
                 return_all=True  # 返回所有候选SQL
             )
+    return arctic_sqls
+
+
+# 只依赖schema linking的结果，可以在DAG中与sql_generation等节点并行
+@node_decorator(check_schema_status=False)
+def arctic_generation(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
+    print('question_id: ', task.question_id, 'enter arctic_generation -----')
+
+    arctic_sqls = arctic_candidates(task, execution_history)
+    print('+++++'*6)
+    print(arctic_sqls)
+
+    response = {
+        "candidate_sqls": arctic_sqls
+    }
+    return response
+
+
+@node_decorator(check_schema_status=False)
+def sql_selection(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any]:
+    print('question_id: ', task.question_id, 'enter sql_selection -----')
+
+    context = TaskContext.current()
+    config, node_name = context.get_model_para()
+    print(f"{node_name=}, {type(execution_history)=}, {type(task)=}")
+
+    arctic_result = get_last_node_result(execution_history, "arctic_generation")
+    if arctic_result is not None and arctic_result["status"] == "success":
+        arctic_sqls = arctic_result["candidate_sqls"]  # 已在arctic_generation节点中生成
+    else:
+        arctic_sqls = arctic_candidates(task, execution_history)
     print('+++++'*6)
     print(arctic_sqls)
     
-    sqlite_dir=paths.db_path
+    sqlite_dir = context.db_path
 
     style_refinement_sqls = get_last_node_result(execution_history, "sql_output_refinement")["sqls"]
     candidate_sqls = arctic_sqls + style_refinement_sqls
@@ -517,5 +659,4 @@ def sql_selection(task: Any, execution_history: Dict[str, Any]) -> Dict[str, Any
         "candidate_sqls": candidate_sqls,
         "sqls": mj_pred_sqls[0] 
     }
-    return response 
-    
+    return response
@@ -1,11 +1,23 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from typing import Dict, List, Any, Callable
+from typing import Dict, List, Any, Callable, Sequence
 from logger import Logger
+from metrics import MetricsRecorder
+from tracing import Tracer
+from task_context import TaskContext
+from pipeline.early_exit import check_early_exit, short_circuit_result
+from budget import CostAccountant, budget_skip_result
 
 def node_decorator(check_schema_status: bool = False) -> Callable:
     """
     A decorator to add logging and error handling to pipeline node functions.
 
+    The wrapped node does not modify the state it is given: it returns {"keys": update} with
+    its own execution_history entry, its node_timings entry and, if an early-exit rule fired,
+    the short_circuit decision, which merge_keys joins into the state.
+
     Args:
         check_schema_status (bool, optional): Whether to check the schema status. Defaults to False.
 
@@ -15,19 +27,54 @@ def node_decorator(check_schema_status: bool = False) -> Callable:
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         def wrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+            start_time = time.perf_counter()
+            metrics = MetricsRecorder()
+            update: Dict[str, Any] = {}
+            try:
+                # 节点内的 LLM 调用和 SQL 执行都记在这个节点名下
+                with metrics.scope(node=func.__name__), Tracer().span(func.__name__, "node"):
+                    update = run_node(state)
+            finally:
+                # 记录节点耗时，用于从任务总耗时中分离出执行器本身的开销
+                elapsed = time.perf_counter() - start_time
+                update["node_timings"] = {func.__name__: elapsed}
+                steps = state["keys"]["execution_history"] + update.get("execution_history", [])
+                status = next((step.get("status") for step in reversed(steps) if step["node_type"] == func.__name__), None)
+                metrics.record("node", node=func.__name__, wall_time=elapsed, status=status)
+            # 只返回本节点新增的内容，由 GraphState 的 merge_keys 合并，并行分支不会同时修改同一个 state
+            return {"keys": update}
+
+        def run_node(state: Dict[str, Any]) -> Dict[str, Any]:
             node_name = func.__name__
             Logger().log(f"---{node_name.upper()}---")
             result = {"node_type": node_name}
+            update = {}
 
             try:
                 task = state["keys"]["task"]
                 execution_history = state["keys"]["execution_history"]
                 for x in execution_history:
                     if x["node_type"]==node_name:
-                        return state
-                output = func(task,execution_history)
-                result.update(output)
-                result["status"] = "success"
+                        return update
+                # 某个节点的 early_exit 规则成立后，后续节点直接跳过，最终节点采用一致的SQL
+                short_circuit = state["keys"].get("short_circuit")
+                if short_circuit is None:
+                    short_circuit = evaluate_early_exit(node_name, task, execution_history)
+                    if short_circuit is not None:
+                        update["short_circuit"] = short_circuit
+                # 超出预算后按降级策略跳过精修节点，沿用上一个节点的候选
+                budget_cap = None if short_circuit is not None else CostAccountant().skip_node(
+                    node_name, str(task.question_id), node_name == state["keys"].get("final_node"))
+                if short_circuit is not None:
+                    Logger().log(f"Node '{node_name}' short-circuited by {short_circuit['rule']} at {short_circuit['decided_by']}")
+                    result.update(short_circuit_result(node_name, short_circuit, node_name == state["keys"].get("final_node")))
+                elif budget_cap is not None:
+                    Logger().log(f"Node '{node_name}' skipped: LLM budget {budget_cap} reached")
+                    result.update(budget_skip_result(execution_history, budget_cap))
+                else:
+                    output = func(task,execution_history)
+                    result.update(output)
+                    result["status"] = "success"
             except Exception as e:
                 Logger().log(f"Node '{node_name}': {task.db_id}_{task.question_id}\n{type(e)}: {e}\n", "error")
                 # Logger().log(f"Vote content: {vote}, Type: {type(vote)}", "error")  # 打印 vote 内容
@@ -36,15 +83,50 @@ def node_decorator(check_schema_status: bool = False) -> Callable:
                     "error": f"{type(e)}: <{e}>",
                 })
             
-            execution_history.append(result)
-            # if execution_history[-1]["node_type"]=="align_correct":
-            #     print(execution_history)
-            Logger().dump_history_to_file(execution_history)
+            update["execution_history"] = [result]
+            Logger().record_step(execution_history, result)
             
-            return state
+            return update
         return wrapper
     return decorator
 
+def evaluate_early_exit(node_name: str, task: Any, execution_history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Evaluates the "early_exit" rule in the node's setup, if it declares one.
+
+    Returns:
+        Dict[str, Any]: The short-circuit decision, or None.
+    """
+    context = TaskContext.current()
+    rule_setup = context.node_config(node_name).get("early_exit")
+    if not rule_setup:
+        return None
+    return check_early_exit(node_name, rule_setup, execution_history, context.db_path, task.execute_history)
+
+def run_in_parallel(func: Callable, args_list: Sequence[Sequence[Any]], max_workers: int = None) -> List[Any]:
+    """
+    Calls a function on every argument tuple concurrently and returns the results in input order.
+
+    Each call runs in a copy of the caller's context, so the task's Logger stays visible
+    inside the worker threads.
+
+    Args:
+        func (Callable): The function to call.
+        args_list (Sequence[Sequence[Any]]): One argument tuple per call.
+        max_workers (int, optional): The concurrency limit. Defaults to one thread per call.
+
+    Returns:
+        List[Any]: The results, ordered like args_list.
+    """
+    if not args_list:
+        return []
+    max_workers = max(1, min(max_workers or len(args_list), len(args_list)))
+    if max_workers == 1:
+        return [func(*args) for args in args_list]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, *args) for args in args_list]
+        return [future.result() for future in futures]
+
 def get_last_node_result(execution_history: List[Dict[str, Any]], node_type: str) -> Dict[str, Any]:
     """
     Retrieves the last result for a specific node type from the execution history.
@@ -1,10 +1,27 @@
-from typing import Dict, List, TypedDict, Callable
-from langgraph.graph import END, StateGraph
+from typing import Annotated, Any, Dict, List, TypedDict, Callable
+from langgraph.graph import END, START, StateGraph
 from pipeline.node_func import schema_linking, schema_linking_info, sql_generation, sql_style_refinement, \
-    sql_output_refinement, sql_selection
+    sql_output_refinement, arctic_generation, sql_selection
 import logging
 
 
+def merge_keys(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Joins a node's update into the state; it is the reducer of GraphState.keys.
+
+    Nodes return only what they add (see node_decorator): their execution_history entries, which
+    are appended, their node_timings, which are merged, and any other key, which replaces the old
+    value. Parallel branches therefore never modify the same objects; every update builds a new
+    state instead.
+    """
+    if not left:
+        return right
+    merged = {**left, **{key: value for key, value in right.items() if key not in ("execution_history", "node_timings")}}
+    merged["execution_history"] = list(left.get("execution_history", [])) + list(right.get("execution_history", []))
+    merged["node_timings"] = {**left.get("node_timings", {}), **right.get("node_timings", {})}
+    return merged
+
+
 class GraphState(TypedDict):
     """
     Represents the state of our graph.
@@ -12,26 +29,98 @@ class GraphState(TypedDict):
     Attributes:
         keys: A dictionary where each key is a string.
     """
-    keys: Dict[str, any]
+    keys: Annotated[Dict[str, any], merge_keys]
+
+
+def resolve_dependencies(nodes: List[str], pipeline_setup: Dict[str, Any] = None) -> Dict[str, List[str]]:
+    """
+    Resolves the dependencies of each node from the pipeline setup.
+
+    A node may declare "depends_on": [...] in its setup. Nodes without the key depend on the
+    node listed before them, so a setup without any "depends_on" is the usual linear chain.
+
+    Args:
+        nodes (List[str]): The pipeline nodes in the order given by pipeline_nodes.
+        pipeline_setup (Dict[str, Any], optional): The per-node setup dictionary.
+
+    Returns:
+        Dict[str, List[str]]: The dependencies of every node.
+
+    Raises:
+        ValueError: If a dependency is not part of the pipeline or the graph has a cycle.
+    """
+    pipeline_setup = pipeline_setup or {}
+    dependencies = {}
+    for i, node in enumerate(nodes):
+        node_setup = pipeline_setup.get(node, {})
+        if "depends_on" in node_setup:
+            deps = list(node_setup["depends_on"])
+        else:
+            deps = [nodes[i - 1]] if i > 0 else []
+        for dep in deps:
+            if dep not in nodes:
+                raise ValueError(f"Node '{node}' depends on '{dep}', which is not in the pipeline")
+        dependencies[node] = deps
+    topological_order(nodes, dependencies)
+    return dependencies
+
+
+def topological_order(nodes: List[str], dependencies: Dict[str, List[str]]) -> List[str]:
+    """
+    Orders the nodes so that every node comes after its dependencies, keeping the given order otherwise.
+
+    Raises:
+        ValueError: If the dependencies contain a cycle.
+    """
+    ordered = []
+    remaining = list(nodes)
+    while remaining:
+        ready = [node for node in remaining if all(dep in ordered for dep in dependencies[node])]
+        if not ready:
+            raise ValueError(f"Pipeline dependencies contain a cycle among: {remaining}")
+        ordered.append(ready[0])
+        remaining.remove(ready[0])
+    return ordered
 
 
 class WorkflowBuilder:
     def __init__(self):
         self.workflow = StateGraph(GraphState)
-    
-    def build(self, pipeline_nodes:str) -> None:
+
+    def build(self, pipeline_nodes:str, pipeline_setup: Dict[str, Any] = None) -> None:
         """
         Builds the workflow based on the provided pipeline nodes.
 
+        Without "depends_on" in the setup the nodes form a linear chain. Otherwise nodes whose
+        dependencies are satisfied run concurrently, and a node starts only after the results of
+        all of its dependencies have been merged into execution_history, e.g.
+
+            "sql_generation": {"depends_on": ["schema_linking", "schema_linking_info"]},
+            "arctic_generation": {"depends_on": ["schema_linking", "schema_linking_info"]},
+            "sql_selection": {"depends_on": ["sql_output_refinement", "arctic_generation"]}
+
         Args:
             pipeline_nodes (str): A string of pipeline node names separated by '+'.
+            pipeline_setup (Dict[str, Any], optional): The per-node setup dictionary.
         """
         nodes = pipeline_nodes.split('+')
+        dependencies = resolve_dependencies(nodes, pipeline_setup)
+        nodes = topological_order(nodes, dependencies)
         logging.info(f"Building workflow with nodes: {nodes}")
         self._add_nodes(nodes)
-        self.workflow.set_entry_point(nodes[0])
-        self._add_edges([(nodes[i], nodes[i+1]) for i in range(len(nodes) - 1)]) 
-        self._add_edges([(nodes[-1], END)])
+
+        edges = []
+        for node in nodes:
+            deps = dependencies[node]
+            if not deps:
+                edges.append((START, node))
+            elif len(deps) == 1:
+                edges.append((deps[0], node))
+            else:
+                edges.append((deps, node))  # 等待所有依赖完成后再汇合
+        dependents = {dep for deps in dependencies.values() for dep in deps}
+        edges.extend((node, END) for node in nodes if node not in dependents)
+        self._add_edges(edges)
         logging.info("Workflow built successfully")
 
     def _add_nodes(self, nodes: List) -> None:
@@ -52,24 +141,66 @@ class WorkflowBuilder:
         """
         for src, dst in edges:
             self.workflow.add_edge(src, dst)
-            logging.info(f"Added edge from {src} to {dst}") 
+            logging.info(f"Added edge from {src} to {dst}")
 
 
 
 
 
-def build_pipeline(pipeline_nodes: str) -> Callable:
+class LinearExecutor:
+    """
+    Runs the pipeline nodes one after another in the calling thread.
+
+    It skips LangGraph's channel bookkeeping and per-step state copies, which only pay off
+    for graphs with branches; a DAG setup runs its nodes in topological order.
+    """
+
+    def __init__(self, nodes: List[str]):
+        self.nodes: Dict[str, Callable] = {}
+        for node_name in nodes:
+            if node_name in globals() and callable(globals()[node_name]):  # 找到全局定义的函数
+                self.nodes[node_name] = globals()[node_name]
+                logging.info(f"Added node: {node_name}")
+            else:
+                logging.error(f"Node function '{node_name}' not found in global scope")
+
+    def invoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Runs every node on the state and returns the final state."""
+        for node in self.nodes.values():
+            state = {"keys": merge_keys(state["keys"], node(state)["keys"])}
+        return state
+
+    def stream(self, state: Dict[str, Any]):
+        """Runs every node on the state, yielding {node_name: state} after each one."""
+        for node_name, node in self.nodes.items():
+            state = {"keys": merge_keys(state["keys"], node(state)["keys"])}
+            yield {node_name: state}
+
+
+def build_pipeline(pipeline_nodes: str, pipeline_setup: Dict[str, Any] = None, executor: str = "langgraph") -> Callable:
     """
     Builds and compiles the pipeline based on the provided nodes.
 
+    The result holds no per-task state, so one pipeline is built per run and shared by all workers.
+
     Args:
         pipeline_nodes (str): A string of pipeline node names separated by '+'.
+        pipeline_setup (Dict[str, Any], optional): The per-node setup dictionary, which may declare dependencies.
+        executor (str, optional): "langgraph" compiles a StateGraph; "linear" returns a LinearExecutor.
 
     Returns:
         Callable: The compiled workflow application.
     """
+    if executor == "linear":
+        nodes = pipeline_nodes.split('+')
+        app = LinearExecutor(topological_order(nodes, resolve_dependencies(nodes, pipeline_setup)))
+        logging.info("Linear pipeline built successfully")
+        return app
+    if executor != "langgraph":
+        raise ValueError(f"Unknown pipeline executor: {executor}")
+
     builder = WorkflowBuilder()
-    builder.build(pipeline_nodes)
+    builder.build(pipeline_nodes, pipeline_setup)
     app = builder.workflow.compile()
     logging.info("Pipeline built and compiled successfully")
-    return app
\ No newline at end of file
+    return app
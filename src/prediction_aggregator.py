@@ -0,0 +1,108 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List
+
+
+class PredictionAggregator:
+    """
+    Collects the "sqls" of every node in memory as tasks finish and writes them out.
+
+    Node predictions go to "-{node_type}.json" in the result directory; if final_output_file is
+    given, the predictions of final_node_type are also written there. The JSON files are written
+    in full only by flush(), at the end of a batch or run. In between, every flush_every tasks the
+    new predictions are appended as {"question_id": ..., "sqls": ...} lines to a checkpoint file
+    next to each JSON file (same name with a .jsonl suffix), so a checkpoint costs only the new
+    predictions. flush() removes the checkpoints it has written into the JSON files.
+    """
+
+    def __init__(self, result_directory: str = None, final_output_file: str = None,
+                 final_node_type: str = None, flush_every: int = 10):
+        """
+        Initializes the PredictionAggregator.
+
+        Args:
+            result_directory (str, optional): Where to write the per-node files.
+            final_output_file (str, optional): Where to write the final predictions.
+            final_node_type (str, optional): The node whose predictions are final, the last node of
+                the pipeline. Required with final_output_file.
+            flush_every (int, optional): Append a checkpoint after this many new tasks.
+        """
+        if final_output_file and not final_node_type:
+            raise ValueError("final_node_type is required to write final_output_file")
+        self.result_directory = Path(result_directory) if result_directory else None
+        self.final_output_file = Path(final_output_file) if final_output_file else None
+        self.final_node_type = final_node_type
+        self.flush_every = max(1, flush_every)
+        self.sqls: Dict[str, Dict[int, Any]] = {}
+        # 上次检查点之后新增的预测: [(node_type, question_id)]
+        self._new: List[tuple] = []
+        self._pending = 0
+        # 本次运行已经写过的检查点文件，第一次写时截断上次运行留下的内容
+        self._checkpoints = set()
+        self._lock = Lock()
+
+    def add(self, question_id: int, execution_history: List[Dict[str, Any]]) -> None:
+        """
+        Records the predictions of one finished task, appending a checkpoint every flush_every tasks.
+
+        Args:
+            question_id (int): The question ID.
+            execution_history (List[Dict[str, Any]]): The task's final execution history.
+        """
+        with self._lock:
+            for step in execution_history:
+                if "sqls" in step:
+                    self.sqls.setdefault(step["node_type"], {})[question_id] = step["sqls"]
+                    self._new.append((step["node_type"], question_id))
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._checkpoint()
+
+    def flush(self) -> None:
+        """Writes all JSON files in full now and removes the checkpoints."""
+        with self._lock:
+            for path, predictions in self._targets(self.sqls):
+                self._write(path, predictions)
+                checkpoint = path.with_suffix(".jsonl")
+                if checkpoint in self._checkpoints:
+                    checkpoint.unlink(missing_ok=True)
+                    self._checkpoints.discard(checkpoint)
+            self._new = []
+            self._pending = 0
+
+    def _targets(self, sqls: Dict[str, Dict[int, Any]]):
+        # 每个节点的文件，以及最终节点对应的 final_output_file
+        if self.result_directory is not None:
+            for node_type, predictions in sqls.items():
+                yield self.result_directory / f"-{node_type}.json", predictions
+        if self.final_output_file is not None:
+            yield self.final_output_file, sqls.get(self.final_node_type, {})
+
+    def _checkpoint(self) -> None:
+        new: Dict[str, Dict[int, Any]] = {}
+        for node_type, question_id in self._new:
+            new.setdefault(node_type, {})[question_id] = self.sqls[node_type][question_id]
+        for path, predictions in self._targets(new):
+            if predictions:
+                self._append(path.with_suffix(".jsonl"), predictions)
+        self._new = []
+        self._pending = 0
+
+    def _append(self, path: Path, predictions: Dict[int, Any]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        mode = 'a' if path in self._checkpoints else 'w'
+        self._checkpoints.add(path)
+        with path.open(mode, encoding='utf-8') as f:
+            for question_id in sorted(predictions):
+                f.write(json.dumps({"question_id": question_id, "sqls": predictions[question_id]}, ensure_ascii=False) + "\n")
+            f.flush()
+
+    @staticmethod
+    def _write(path: Path, predictions: Dict[int, Any]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump({str(k): predictions[k] for k in sorted(predictions)}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
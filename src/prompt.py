@@ -1,21 +1,20 @@
 
 # 1. Question Analysis: Follow all rules mentioned in the question (such as format conversions, pattern matching, and value transformations, usually indicated by "refer to") when analysis the question.
 
-def get_filter_ddl_agent_prompt(db_desc, question):
-    FILTER_DDL_AGNET_PROMPT = f"""Follow the STEP to answer the question.
+# schema linking 和 SQL 生成共用的 system prompt，prefix 布局下它是所有请求共享前缀的开头
+SCHEMA_LINKING_SYSTEM_PROMPT = (
+    "You are a data science expert. Below, you are provided with a database schema and a natural"
+    " language question. Your task is to understand the schema and generate a valid SQL query to"
+    " answer the question."
+)
+
+FILTER_DDL_STEP = """Follow the STEP to answer the question.
 # STEP:
 1. Question Analysis: When analyzing the question, you must strictly follow all the rules mentioned in the question (such as format conversions and value transformations, which are usually indicated by keywords like “refer to”). These rules represent expert knowledge and must be applied unless they clearly conflict with the database schema or question.
 
-2. SQL Generation: Before generating the final SQL query, please think through the steps of how to write the query.
-
-# Database Engine:
-SQLite
-
-# Database Schema:
-{db_desc}
-This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints.
+2. SQL Generation: Before generating the final SQL query, please think through the steps of how to write the query."""
 
-# Instructions:
+FILTER_DDL_INSTRUCTIONS = """# Instructions:
 - **Keep the '`' symbols of column name and table name if they are in the Database Schema.** This is very important as it will directly lead to SQL execution failure. 
 - Make sure you only output the information that is asked in the question. If the question asks for a specific column, make sure to only include that column in the SELECT clause, nothing more.
 - The generated query should return all of the information asked in the question without any missing or extra information.
@@ -38,21 +37,50 @@ Example format:
 ```sql
 Correct SQL query here
 ```
-</answer>
+</answer>"""
+
+
+def get_filter_ddl_schema(db_desc):
+    return f"""# Database Engine:
+SQLite
+
+# Database Schema:
+{db_desc}
+This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints."""
+
+
+def get_filter_ddl_agent_prompt(db_desc, question):
+    FILTER_DDL_AGNET_PROMPT = f"""{FILTER_DDL_STEP}
+
+{get_filter_ddl_schema(db_desc)}
+
+{FILTER_DDL_INSTRUCTIONS}
 
 Question:
 {question}
 """
     return FILTER_DDL_AGNET_PROMPT
 
+
+def get_filter_ddl_agent_prompt_parts(db_desc, question):
+    """
+    The schema-linking prompt in the "prefix" layout (see PromptCache): the instructions, which
+    every question shares, and the schema, which the questions of a database share, come before
+    the question.
+
+    Returns:
+        Tuple[List[str], str]: The shared parts, in order, and the per-question part.
+    """
+    return [f"{FILTER_DDL_STEP}\n\n{FILTER_DDL_INSTRUCTIONS}", get_filter_ddl_schema(db_desc)], f"Question:\n{question}\n"
+
+
 # 这是bird的，spider2的结构不同
 # # Database Schema:
 # {item["db_table_column_desc"]}
 # This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints.
 
 
-def get_generate_sql_agent_prompt(filtered_ddl, question, sql, examples):
-    GENERATE_SQL_AGENT_PROMPT = f"""# Goal: Follow the STEP, refine the given draft SQL or rewrite a executable SQL so it fully satisfies the user’s requirement. Strictly check all constraints before outputting the final query.
+GENERATE_SQL_STEP = """# Goal: Follow the STEP, refine the given draft SQL or rewrite a executable SQL so it fully satisfies the user’s requirement. Strictly check all constraints before outputting the final query.
 
 # STEP:
 STEP 1. From the Draft SQL, first explain literally what this SQL query is intended to do.
@@ -84,25 +112,9 @@ STEP 5. Before return the final answer, always check these points explicitly:
   
   (2) To Eliminate JOIN-Induced Duplicates (Structural Necessity): To prevent records from the primary table from being repeated (exploded) due to multiple matches in a multi-table JOIN (e.g., in one-to-many relationships).
 
-  (3) For Accurate Aggregation of Unique Values: To ensure aggregate functions (like COUNT) perform calculations based only on the non-duplicate values within a column.
-
-
-# Database Engine:
-SQLite
-
-# Database Schema:
-{filtered_ddl}
-This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints.
-**Every field included here is critical, as it has been extracted and filtered as a partial DDL from the Draft SQL produced in the preceding stage.**
+  (3) For Accurate Aggregation of Unique Values: To ensure aggregate functions (like COUNT) perform calculations based only on the non-duplicate values within a column."""
 
-
-# Examples for SQL writing:
-SQL supports multiple equivalent syntaxes. Generating the SQL formatting according to the style reflected in the following examples.
-I think you should prioritize **clean, join-first, flat** SQL structures. Avoid unnecessary nested subqueries.
-{examples}
-
-
-# Notice:
+GENERATE_SQL_ACTIONS = """# Notice:
 - Since you have limited knowledge of the actual stored value, when you are refining or rewrite, you can generate some exploratory SQL queries (not the final SQL given to the user) to examine your answer.
 - You can only use the actions provided in the **Action space** to solve the task.
 
@@ -136,9 +148,27 @@ Correct Single SQL query here
 ```
 </answer>
 
-**VERY IMPORTANT: After writing ActionInput, STOP generating. Wait for the system to provide the Observation. DO NOT generate the Observation yourself.**
+**VERY IMPORTANT: After writing ActionInput, STOP generating. Wait for the system to provide the Observation. DO NOT generate the Observation yourself.**"""
+
+
+def get_generate_sql_schema(filtered_ddl, examples):
+    return f"""# Database Engine:
+SQLite
+
+# Database Schema:
+{filtered_ddl}
+This schema describes the database's structure, including tables, columns, primary keys, foreign keys, and any relevant relationships or constraints.
+**Every field included here is critical, as it has been extracted and filtered as a partial DDL from the Draft SQL produced in the preceding stage.**
 
-Get started!
+
+# Examples for SQL writing:
+SQL supports multiple equivalent syntaxes. Generating the SQL formatting according to the style reflected in the following examples.
+I think you should prioritize **clean, join-first, flat** SQL structures. Avoid unnecessary nested subqueries.
+{examples}"""
+
+
+def get_generate_sql_question(question, sql):
+    return f"""Get started!
 Question: 
 {question}
 
@@ -148,9 +178,33 @@ Draft SQL:
 ```
 
 """
+
+
+def get_generate_sql_agent_prompt(filtered_ddl, question, sql, examples):
+    GENERATE_SQL_AGENT_PROMPT = f"""{GENERATE_SQL_STEP}
+
+
+{get_generate_sql_schema(filtered_ddl, examples)}
+
+
+{GENERATE_SQL_ACTIONS}
+
+{get_generate_sql_question(question, sql)}"""
     return GENERATE_SQL_AGENT_PROMPT
 
 
+def get_generate_sql_agent_prompt_parts(filtered_ddl, question, sql, examples):
+    """
+    The SQL-generation prompt in the "prefix" layout (see PromptCache). The schema is filtered per
+    question, so only the steps and the action space are shared; they come first.
+
+    Returns:
+        Tuple[List[str], str]: The shared parts, in order, and the per-question part.
+    """
+    return ([f"{GENERATE_SQL_STEP}\n\n\n{GENERATE_SQL_ACTIONS}"],
+            f"{get_generate_sql_schema(filtered_ddl, examples)}\n\n\n{get_generate_sql_question(question, sql)}")
+
+
 
 def get_style_sql_agent_test_prompt(question, sql, rules):
     REFINE_SQL_AGENT = f"""# Goal: Your task is to perform a preference check on the given SQL statement. You must strictly follow both the given rules and check rules bellow, and convert the given SQL into a compliant, executable SQL statement.
@@ -0,0 +1,161 @@
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+# 支持用 cache_control 标记缓存断点的模型(Anthropic)；OpenAI、Gemini 和 vLLM 自动缓存相同的前缀
+CACHE_CONTROL_MODELS = ("claude",)
+
+# OpenAI 只缓存至少 1024 个 token 的前缀，之后按 128 个 token 递增；vLLM 按 16 个 token 的 block 缓存
+MIN_CACHED_PREFIX_TOKENS = 1024
+CACHED_PREFIX_BLOCK = 128
+
+# 每个模型保留的最近 prompt 数，用来估计请求能命中的最长前缀
+RECENT_PROMPTS = 32
+
+
+def content_text(content: Any) -> str:
+    """The text of a message content: a string, or a list of content parts."""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return "" if content is None else str(content)
+
+
+def prompt_text(messages: List[Dict[str, Any]]) -> str:
+    """The messages flattened in request order, as the provider sees the prefix."""
+    return "\n".join(f"{m.get('role', '')}: {content_text(m.get('content'))}" for m in messages)
+
+
+def cached_prompt_tokens(usage: Dict[str, Any]) -> Optional[int]:
+    """
+    The prompt tokens served from the provider's prefix cache: OpenAI's
+    prompt_tokens_details.cached_tokens or Anthropic's cache_read_input_tokens, None if the
+    provider reports neither.
+    """
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    return cached if cached is not None else usage.get("cache_read_input_tokens")
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    # 二分查找，每次比较切片，避免逐字符的 Python 循环
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PromptCache:
+    """
+    A singleton deciding how prompts are laid out for provider-side prefix caching, and comparing
+    the cached prompt tokens a layout should get with the ones providers report.
+
+    Layouts:
+        "legacy": the original prompts, the question in the middle or right after the schema.
+        "prefix": the static instructions first, then the database schema, then the per-question
+            text, so requests on the same database share the longest possible prefix. For models
+            that need explicit breakpoints (CACHE_CONTROL_MODELS), the shared part is sent as a
+            content part tagged with cache_control when cache_control is on.
+
+    The expected cached tokens of a request are its longest common prefix with the model's recent
+    prompts (about 4 characters per token), rounded down to the provider's cache granularity. It is
+    an upper bound: concurrent requests with the same prefix may all miss the provider's cache.
+    Comparing prompts costs time under a global lock, so callers only call expect() and observe()
+    when tracking is on: with the "prefix" layout, or with report enabled.
+    """
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(PromptCache, cls).__new__(cls)
+                instance.configure()
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, layout: str = "legacy", cache_control: bool = True, report: bool = False) -> None:
+        """
+        Sets the prompt layout.
+
+        Args:
+            layout (str, optional): "legacy" or "prefix", see the class docstring.
+            cache_control (bool, optional): Tag the shared prefix for models in CACHE_CONTROL_MODELS.
+            report (bool, optional): Compare expected and reported cached tokens with the legacy layout too.
+        """
+        if layout not in ("legacy", "prefix"):
+            raise ValueError(f"Unknown prompt layout: {layout}")
+        self.layout = layout
+        self.cache_control = cache_control
+        self.tracking = layout == "prefix" or report
+        self.recent: Dict[str, List[str]] = {}
+        self.totals: Dict[str, Dict[str, int]] = {}
+        self._state_lock = Lock()
+
+    def user_content(self, model: str, shared_parts: Sequence[str], question_part: str) -> Union[str, List[Dict[str, Any]]]:
+        """
+        Builds the user message of the "prefix" layout: the parts shared across questions, then the
+        per-question part.
+
+        Returns:
+            The content string, or content parts with a cache breakpoint after the shared parts.
+        """
+        shared = "\n\n".join(shared_parts)
+        if self.cache_control and model.lower().startswith(CACHE_CONTROL_MODELS):
+            return [{"type": "text", "text": shared, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": question_part}]
+        return f"{shared}\n\n{question_part}"
+
+    def expect(self, model: str, text: str, min_tokens: int = MIN_CACHED_PREFIX_TOKENS,
+               block: int = CACHED_PREFIX_BLOCK) -> int:
+        """
+        Estimates the prompt tokens of a request the provider can serve from its prefix cache, and
+        remembers the prompt for the following requests.
+
+        Args:
+            model (str): The model, prompts are only shared within a model.
+            text (str): The prompt, e.g. prompt_text(messages).
+            min_tokens (int, optional): The shortest prefix the provider caches.
+            block (int, optional): The provider's cache granularity in tokens.
+
+        Returns:
+            int: The expected cached tokens.
+        """
+        with self._state_lock:
+            recent = self.recent.setdefault(model, [])
+            shared_chars = max((common_prefix_length(text, previous) for previous in recent), default=0)
+            if text in recent:
+                recent.remove(text)
+            recent.append(text)
+            del recent[:-RECENT_PROMPTS]
+        tokens = shared_chars // 4 // block * block
+        return tokens if tokens >= max(min_tokens, 1) else 0
+
+    def observe(self, model: str, prompt_tokens: int, expected_cached: int, cached: Optional[int]) -> None:
+        """Adds one response: its prompt tokens, the expected cached tokens and the reported ones (None if not reported)."""
+        with self._state_lock:
+            totals = self.totals.setdefault(model, {"requests": 0, "prompt_tokens": 0, "expected_cached_tokens": 0,
+                                                    "reported_requests": 0, "reported_prompt_tokens": 0, "cached_tokens": 0})
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["expected_cached_tokens"] += min(expected_cached, prompt_tokens)
+            if cached is not None:
+                totals["reported_requests"] += 1
+                totals["reported_prompt_tokens"] += prompt_tokens
+                totals["cached_tokens"] += cached
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The layout and, per model, the expected and observed cached-token ratios, for the run metrics."""
+        values: Dict[str, Any] = {"layout": self.layout}
+        with self._state_lock:
+            totals = {model: dict(model_totals) for model, model_totals in self.totals.items()}
+        for model, model_totals in totals.items():
+            expected = model_totals["expected_cached_tokens"] / model_totals["prompt_tokens"] if model_totals["prompt_tokens"] else 0.0
+            if model_totals["reported_requests"]:
+                observed = f"{model_totals['cached_tokens'] / max(model_totals['reported_prompt_tokens'], 1):.4f}"
+            else:
+                observed = "not reported"
+            values[model] = (f"{model_totals['requests']} requests, expected cached ratio {expected:.4f}, "
+                             f"observed {observed} ({model_totals['reported_requests']} reported)")
+        return values
@@ -0,0 +1,252 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from tracing import Tracer
+
+
+class LLMRequestError(Exception):
+    """Raised when an LLM request failed for good: attempts, retry budget or endpoint exhausted."""
+
+
+class CircuitOpenError(LLMRequestError):
+    """Raised without sending when the endpoint's circuit breaker is open."""
+
+
+class RetryBudgetExhausted(LLMRequestError):
+    """Raised instead of retrying when the run has used up its retry budget."""
+
+
+class LLMHTTPError(Exception):
+    """An error response of the LLM endpoint, with its status code and Retry-After in seconds."""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def endpoint_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def classify(error: Exception) -> Tuple[bool, bool]:
+    """
+    Returns (retryable, outage): whether the request may succeed if retried, and whether the error
+    says the endpoint is down and should count against its circuit breaker. Rate limiting is
+    retryable but not an outage; other 4xx errors are neither.
+    """
+    if isinstance(error, LLMHTTPError):
+        if error.status in (408, 429):
+            return True, False
+        if error.status >= 500:
+            return True, True
+        return error.status < 400, False  # 2xx 但响应体不对，例如代理返回的错误页
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return True, True
+    if type(error).__module__.startswith("httpx") and type(error).__name__ in (
+            "ConnectError", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout", "RemoteProtocolError", "ReadError"):
+        return True, True
+    if isinstance(error, ValueError):  # 响应不是合法的 JSON
+        return True, False
+    return False, False
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker. After failure_threshold consecutive outage errors the circuit
+    opens and requests fail fast for reset_timeout seconds; then a single probe request is let
+    through (half-open), which closes the circuit on success or reopens it on failure.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.opened = 0
+        self._lock = Lock()
+
+    def before_request(self, endpoint: str) -> None:
+        """Raises CircuitOpenError while the circuit is open or a half-open probe is in flight."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return  # 这个请求就是探测请求
+            if self.state != "closed":
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit breaker of {endpoint} is {self.state}, failing fast")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class Resilience:
+    """
+    A singleton retry policy shared by every LLM call of the run, synchronous and async:
+
+    - jittered exponential backoff ("full jitter": uniform in [0, min(max_delay, base_delay * 2^attempt)]),
+      never shorter than the server's Retry-After;
+    - a retry budget for the whole run: at most min_retry_budget + retry_budget_ratio * requests
+      retries, so a degraded endpoint cannot multiply the load by max_attempts;
+    - a circuit breaker per endpoint (scheme://host:port) that fails fast during outages
+      instead of letting every worker thread wait through its own backoff.
+    """
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(Resilience, cls).__new__(cls)
+                instance.configure()
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                  max_retry_after: float = 120.0, retry_budget_ratio: float = 0.2, min_retry_budget: int = 20,
+                  failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        """
+        Sets the retry policy.
+
+        Args:
+            max_attempts (int, optional): Attempts per request, including the first.
+            base_delay (float, optional): Backoff of the first retry, doubled per attempt.
+            max_delay (float, optional): The backoff cap in seconds.
+            max_retry_after (float, optional): Longest Retry-After honoured; longer ones give up.
+            retry_budget_ratio (float, optional): Retries allowed per request sent in the run.
+            min_retry_budget (int, optional): Retries allowed regardless of the ratio.
+            failure_threshold (int, optional): Consecutive outage errors that open a circuit.
+            reset_timeout (float, optional): Seconds a circuit stays open before a probe.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retry_budget_ratio = retry_budget_ratio
+        self.min_retry_budget = min_retry_budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.requests = 0
+        self.retries = 0
+        self.budget_rejections = 0
+        self._state_lock = Lock()
+        self._rng = random.Random()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        endpoint = endpoint_of(url)
+        with self._state_lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[endpoint]
+
+    def backoff(self, attempt: int) -> float:
+        with self._state_lock:
+            return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def before_attempt(self, url: str, attempt: int) -> None:
+        """Counts the request and raises CircuitOpenError if the endpoint is failing fast."""
+        if attempt == 0:
+            with self._state_lock:
+                self.requests += 1
+        self.breaker(url).before_request(endpoint_of(url))
+
+    def after_success(self, url: str) -> None:
+        self.breaker(url).record_success()
+
+    def after_failure(self, url: str, error: Exception, attempt: int) -> float:
+        """
+        Decides whether a failed attempt is retried.
+
+        Returns:
+            float: The seconds to wait before the next attempt.
+
+        Raises:
+            Exception: The error itself if it is not retryable, LLMRequestError if the attempts or
+                the Retry-After limit are exhausted, RetryBudgetExhausted if the run's budget is.
+        """
+        if isinstance(error, CircuitOpenError):
+            raise error
+        retryable, outage = classify(error)
+        breaker = self.breaker(url)
+        if outage:
+            breaker.record_failure()
+        else:
+            breaker.record_success()  # 限流或错误的请求也说明 endpoint 还在响应
+        if not retryable:
+            raise error
+        if attempt + 1 >= self.max_attempts:
+            raise LLMRequestError(f"LLM request to {url} failed after {attempt + 1} attempts: {error}") from error
+        retry_after = getattr(error, "retry_after", None) or 0.0
+        if retry_after > self.max_retry_after:
+            raise LLMRequestError(f"LLM endpoint {url} asked to retry after {retry_after:.0f}s: {error}") from error
+        with self._state_lock:
+            if self.retries >= self.min_retry_budget + self.retry_budget_ratio * self.requests:
+                self.budget_rejections += 1
+                raise RetryBudgetExhausted(f"Retry budget of the run exhausted ({self.retries} retries): {error}") from error
+            self.retries += 1
+        return max(retry_after, self.backoff(attempt))
+
+    def call(self, url: str, send: Callable[[], Any]) -> Tuple[Any, int]:
+        """
+        Calls send() under the retry policy, sleeping between attempts.
+
+        Returns:
+            Tuple[Any, int]: The result of send() and the number of retries it took.
+        """
+        attempt = 0
+        while True:
+            self.before_attempt(url, attempt)
+            try:
+                result = send()
+            except Exception as e:
+                delay = self.after_failure(url, e, attempt)
+                print(f"LLM 请求第{attempt + 1}次失败({e})，{delay:.1f}秒后重试")
+                Tracer().sleep(delay, reason="backoff")
+                attempt += 1
+                continue
+            self.after_success(url)
+            return result, attempt
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Retry budget usage and the state of every circuit breaker, for the run metrics."""
+        with self._state_lock:
+            values = {"requests": self.requests, "retries": self.retries, "budget_rejections": self.budget_rejections}
+            breakers = dict(self.breakers)
+        for endpoint, breaker in breakers.items():
+            values[f"breaker {endpoint}"] = f"{breaker.state}, opened {breaker.opened}x, rejected {breaker.rejected}"
+        return values
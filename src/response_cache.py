@@ -0,0 +1,144 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+from cassette import request_key
+
+
+class ResponseCache:
+    """
+    A singleton on-disk cache of LLM responses, stored in one SQLite file and shared across runs.
+
+    Responses are keyed by the cassette's request_key (model, messages, temperature, top_p, n and
+    the other parameters) plus an occurrence number within the question, so the k-th identical
+    sampling request of a question gets the k-th cached sample rather than k copies of the first.
+    When the file grows past max_size_mb, the least recently used entries are evicted.
+
+    Modes:
+        "off": the cache is not used.
+        "rw": hits are served from the cache and misses are stored.
+        "ro": hits are served, nothing is written (e.g. a shared cache file).
+        "bypass": the cache file is neither read nor written, every request goes to the network.
+    """
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(ResponseCache, cls).__new__(cls)
+                instance.mode = "off"
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, mode: str, path: str = "llm_cache.sqlite", max_size_mb: float = 1024.0,
+                  deterministic_only: bool = False) -> None:
+        """
+        Configures the cache.
+
+        Args:
+            mode (str): "off", "rw", "ro" or "bypass".
+            path (str, optional): The SQLite file.
+            max_size_mb (float, optional): The total response size kept before evicting.
+            deterministic_only (bool, optional): Only cache temperature-0 requests.
+        """
+        if mode not in ("off", "rw", "ro", "bypass"):
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        self.mode = mode
+        self.path = Path(path)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.deterministic_only = deterministic_only
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._occurrences: Dict[Tuple[str, str], int] = {}
+        self._state_lock = Lock()
+        if mode in ("off", "bypass"):
+            return
+        if mode == "ro" and not self.path.exists():
+            raise ValueError(f"Response cache does not exist: {self.path}")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT, occurrence INTEGER, model TEXT, response TEXT, size INTEGER,"
+            " created REAL, last_access REAL, PRIMARY KEY (key, occurrence))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        print(f"LLM 响应缓存 {self.path}: 模式 {mode}, 已有 {self.size / 1024 / 1024:.1f} MB")
+
+    def _cacheable(self, params: Dict[str, Any]) -> bool:
+        # 未指定 temperature 时服务端默认 1.0，不算确定性请求
+        return self.mode in ("rw", "ro") and (not self.deterministic_only or params.get("temperature") == 0)
+
+    def _occurrence(self, scope: str, key: str) -> int:
+        with self._state_lock:
+            occurrence = self._occurrences.get((scope, key), 0)
+            self._occurrences[(scope, key)] = occurrence + 1
+            return occurrence
+
+    def lookup(self, scope: str, model: str, messages: Any, **params: Any) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[str, int]]]:
+        """
+        Looks a request up.
+
+        Args:
+            scope (str): The occurrence scope, usually the question id.
+            model (str): The model name.
+            messages (Any): The chat messages.
+            **params: The sampling parameters.
+
+        Returns:
+            Tuple: The cached response JSON, or None on a miss, and the entry id to pass to store()
+            after a miss, or None if the request is not cached.
+        """
+        if not self._cacheable(params):
+            return None, None
+        key = request_key(model, messages, **params)
+        entry_id = (key, self._occurrence(scope, key))
+        with self._state_lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND occurrence = ?", entry_id).fetchone()
+            if row is not None and self.mode == "rw":
+                self._conn.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ? AND occurrence = ?", (time.time(), *entry_id))
+            self.stats["hits" if row is not None else "misses"] += 1
+        return (json.loads(row[0]), None) if row is not None else (None, entry_id)
+
+    def store(self, entry_id: Optional[Tuple[str, int]], model: str, response: Dict[str, Any]) -> None:
+        """Stores the response of a missed request, then evicts least recently used entries above max_size_mb."""
+        if entry_id is None or self.mode != "rw" or "choices" not in response:
+            return
+        payload = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._state_lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ? AND occurrence = ?", entry_id).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*entry_id, model, payload, len(payload), now, now))
+            self.size += len(payload) - (old[0] if old else 0)
+            self.stats["stores"] += 1
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        # 按最近访问时间淘汰，直到低于上限的 90%，避免每次写入都触发淘汰
+        target = self.max_size * 0.9
+        rows = self._conn.execute("SELECT key, occurrence, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, occurrence, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((key, occurrence))
+            self.size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ? AND occurrence = ?", evicted)
+        self.stats["evictions"] += len(evicted)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Hit/miss/store/eviction counters and the cache size, for the run metrics."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats, "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "size_mb": round(self.size / 1024 / 1024, 2)}
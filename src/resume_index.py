@@ -0,0 +1,127 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from history_journal import HistoryJournal, read_journal
+from pipeline.workflow_builder import resolve_dependencies, topological_order
+
+
+def resumed_short_circuit(history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The early-exit decision recorded in a resumed history (see short_circuit_result), or None."""
+    for step in reversed(history):
+        if step.get("short_circuit"):
+            return step["short_circuit"]
+    return None
+
+
+class ResumeIndex:
+    """
+    Indexes the per-question histories ({question_id}_{db_id}.json) of a previous run so a new
+    run only schedules the questions and nodes that did not finish.
+
+    A node counts as finished if it succeeded and all of its dependencies are finished, so a
+    node computed on top of a failed node is rerun together with it.
+    """
+
+    def __init__(self, resume_directory: str, pipeline_nodes: str, pipeline_setup: Dict[str, Any] = None):
+        """
+        Initializes the ResumeIndex and scans the directory.
+
+        Args:
+            resume_directory (str): A previous run folder, or any parent of several run folders.
+            pipeline_nodes (str): A string of pipeline node names separated by '+'.
+            pipeline_setup (Dict[str, Any], optional): The per-node setup dictionary.
+        """
+        self.resume_directory = Path(resume_directory)
+        if not self.resume_directory.is_dir():
+            raise ValueError(f"Resume directory does not exist: {resume_directory}")
+        nodes = pipeline_nodes.split('+')
+        self.dependencies = resolve_dependencies(nodes, pipeline_setup)
+        self.nodes = topological_order(nodes, self.dependencies)
+        self.histories: Dict[Tuple[int, str], List[Dict[str, Any]]] = {}
+        self._scan()
+
+    def _add(self, question_id: int, db_id: str, history: List[Dict[str, Any]]) -> None:
+        history = self.finished_steps(history)
+        key = (question_id, db_id)
+        if len(history) > len(self.histories.get(key, [])):
+            self.histories[key] = history
+
+    def _scan(self) -> None:
+        """
+        Loads every history file and journal, keeping the most complete history when a question appears twice.
+        Journals matter after a crash, when they were never compacted into history files.
+        """
+        for root, dirs, files in os.walk(self.resume_directory):
+            dirs[:] = [d for d in dirs if d not in ("logs", "traces")]
+            if HistoryJournal.JOURNAL_FILE_NAME in files:
+                for (question_id, db_id), history in read_journal(Path(root) / HistoryJournal.JOURNAL_FILE_NAME).items():
+                    self._add(question_id, db_id, history)
+            for file in files:
+                # 只处理任务结果文件，跳过汇总文件（以 - 开头的文件）
+                if not (file.endswith(".json") and "_" in file and not file.startswith("-")):
+                    continue
+                _index = file.find("_")
+                try:
+                    question_id = int(file[:_index])
+                except ValueError:
+                    continue
+                db_id = file[_index + 1:-5]
+                try:
+                    with open(os.path.join(root, file), 'r') as f:
+                        history = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    print(f"跳过无法读取的历史文件 {file}: {e}")
+                    continue
+                self._add(question_id, db_id, history)
+
+    def finished_steps(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Keeps the steps of the finished nodes, in pipeline order.
+
+        Args:
+            history (List[Dict[str, Any]]): An execution history loaded from disk.
+
+        Returns:
+            List[Dict[str, Any]]: The steps that can be reused.
+        """
+        succeeded = {}
+        for step in history:
+            # skipped: 被 early_exit 短路的节点，同样视为已完成；因预算跳过的节点续跑时重新执行
+            budget_skipped = str(step.get("skip_reason", "")).startswith("budget")
+            if step.get("status") in ("success", "skipped") and not budget_skipped and step.get("node_type") in self.dependencies:
+                succeeded[step["node_type"]] = step
+        finished = []
+        for node in self.nodes:
+            if node in succeeded and all(dep in finished for dep in self.dependencies[node]):
+                finished.append(node)
+        return [succeeded[node] for node in finished]
+
+    def is_finished(self, history: List[Dict[str, Any]]) -> bool:
+        return len(history) == len(self.nodes)
+
+    def split(self, dataset: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[Tuple[int, str], List[Dict[str, Any]]]]:
+        """
+        Splits the dataset into samples that still need work and questions that are already done.
+
+        Pending samples that finished some nodes get a "resumed_history" with those steps.
+
+        Args:
+            dataset (List[Dict[str, Any]]): The samples of the new run.
+
+        Returns:
+            Tuple: The pending samples, and the complete histories keyed by (question_id, db_id).
+        """
+        pending = []
+        finished = {}
+        for data in dataset:
+            key = (data["question_id"], data["db_id"])
+            history = self.histories.get(key, [])
+            if history and self.is_finished(history):
+                finished[key] = history
+            elif history:
+                pending.append({**data, "resumed_history": history})
+            else:
+                pending.append(data)
+        return pending, finished
@@ -1,21 +1,40 @@
 import json
-import os
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Tuple
 from database_manager import DatabaseManager
 from pipeline.pipeline_manager import PipelineManager
-from pipeline.workflow_builder import build_pipeline
+from pipeline.workflow_builder import build_pipeline, resolve_dependencies, topological_order
 from task import Task
+from task_context import TaskContext
 from logger import Logger
+from metrics import MetricsRecorder
+from tracing import Tracer
+from budget import CostAccountant
+from history_journal import HistoryJournal
+from prediction_aggregator import PredictionAggregator
+from resume_index import resumed_short_circuit
 
  
 class RunManager:
     RESULT_ROOT_PATH = "results"
 
-    def __init__(self, args:Any, batch_id: int = None) -> None:
+    def __init__(self, args:Any, batch_id: int = None, app: Any = None, final_aggregator: PredictionAggregator = None) -> None:
         self.args = args
         self.batch_id = batch_id
         self.result_directory = self.get_result_directory()
+        self.pipeline_setup = json.loads(args.pipeline_setup)
+        # journal 模式下节点结果追加写入 -history.jsonl，由后台线程落盘
+        self.journal = HistoryJournal(self.result_directory) if args.history_mode == 'journal' else None
+        PipelineManager(self.pipeline_setup)  # 全局只读的节点配置
+        nodes = args.pipeline_nodes.split('+')
+        self.final_node = topological_order(nodes, resolve_dependencies(nodes, self.pipeline_setup))[-1]
+        # 每个节点的预测在内存中汇总，定期追加检查点，final_aggregator 由所有 worker 共享
+        self.aggregator = PredictionAggregator(self.result_directory, final_node_type=self.final_node, flush_every=args.flush_every)
+        self.final_aggregator = final_aggregator
+        # 工作流每次运行只编译一次，由所有 worker 共享
+        self.app = app if app is not None else build_pipeline(
+            args.pipeline_nodes, self.pipeline_setup, args.executor)
 
         print('********'*10)
         print(f'初始化批次 {batch_id} 保存的地址')
@@ -24,6 +43,9 @@ class RunManager:
         self.tasks: List[Task] = []
         self.total_number_of_tasks = 0
         self.processed_tasks = 0
+        self.progress_counter = None  # 流式调度时多个 RunManager 共享的进度
+        self.executor_overheads: List[float] = []
+        self.sampling_savings: Dict[int, Dict[str, int]] = {}  # question_id -> 自适应采样节省的 LLM 调用
     
     def initialize_tasks(self, dataset:List[Dict[str, Any]]):
         "为每个sample初始化一个task"
@@ -36,6 +58,8 @@ class RunManager:
             # if data['question_id'] < 101:
             #     continue
             task = Task(data)  # 为每条数据分配一个data
+            # 整个批次在这里排队，排队时间是任务开始前在本批次中等待的时间
+            task.enqueued_at = time.perf_counter()
             self.tasks.append(task)
         self.total_number_of_tasks = len(self.tasks)
         print(f"Total number of tasks: {self.total_number_of_tasks}")
@@ -44,6 +68,64 @@ class RunManager:
         for task in self.tasks:
             ans = self.worker(task)
             self.task_done(ans)
+        self.report_executor_overhead()
+        self.report_sampling_savings()
+
+    def run_task_stream(self, task_stream: Iterable[Dict[str, Any]], progress_counter: Dict[str, Any] = None):
+        """
+        Processes samples one by one as they arrive from a shared scheduler queue.
+
+        Args:
+            task_stream (Iterable[Dict[str, Any]]): The samples assigned to this worker.
+            progress_counter (Dict[str, Any], optional): Progress shared by all workers,
+                with 'processed', 'total' and 'lock' keys.
+        """
+        self.progress_counter = progress_counter
+        if progress_counter is not None:
+            self.total_number_of_tasks = progress_counter['total']
+        for data in task_stream:
+            task = Task(data)
+            self.tasks.append(task)
+            ans = self.worker(task)
+            self.task_done(ans)
+        self.report_executor_overhead()
+        self.report_sampling_savings()
+
+    def report_executor_overhead(self):
+        """Prints the average per-task time spent outside the node functions."""
+        if not self.executor_overheads:
+            return
+        average = sum(self.executor_overheads) / len(self.executor_overheads)
+        print(f"执行器({self.args.executor})平均每个任务的额外开销: {average * 1000:.3f}ms，共 {len(self.executor_overheads)} 个任务")
+
+    def record_sampling(self, question_id: int, execution_history: List[Dict[str, Any]]):
+        """Collects and prints the per-node sample and LLM call counts of a finished task."""
+        saved = {}
+        for step in execution_history:
+            sampling = step.get("sampling")
+            if sampling and step.get("status") == "success":
+                saved[step["node_type"]] = sampling
+        if not saved:
+            return
+        self.sampling_savings[question_id] = saved
+        summary = ", ".join(f"{node} {s['samples']}/{s['max_samples']} 个样本 {s['llm_calls']} 次调用" for node, s in saved.items())
+        print(f"question id:{question_id} 采样: {summary}，少采 {sum(s['saved_samples'] for s in saved.values())} 个样本")
+
+    def report_sampling_savings(self):
+        """Prints the LLM requests sent and the samples saved by adaptive sampling, per node and per question."""
+        if not self.sampling_savings:
+            return
+        totals: Dict[str, Dict[str, int]] = {}
+        for saved in self.sampling_savings.values():
+            for node, sampling in saved.items():
+                total = totals.setdefault(node, {"llm_calls": 0, "saved_samples": 0})
+                total["llm_calls"] += sampling["llm_calls"]
+                total["saved_samples"] += sampling["saved_samples"]
+        questions = len(self.sampling_savings)
+        for node, total in totals.items():
+            # llm_calls 是实际发出的请求数，n>1 的分组请求只算一次，所以少采的样本数不等于少发的请求数
+            print(f"{node}: 平均每个问题 {total['llm_calls'] / questions:.2f} 次 LLM 请求，"
+                  f"少采 {total['saved_samples'] / questions:.2f} 个样本，共 {questions} 个问题")
 
 
     def get_result_directory(self) -> str:
@@ -59,7 +141,8 @@ class RunManager:
         run_folder_name = str(self.args.run_start_time)
         if self.batch_id is not None:
             run_folder_name = f"{run_folder_name}_batch_{self.batch_id}"
-        run_folder_path = Path(self.RESULT_ROOT_PATH) / data_mode / pipeline_nodes / dataset_name / run_folder_name
+        result_root = getattr(self.args, 'result_root', None) or self.RESULT_ROOT_PATH
+        run_folder_path = Path(result_root) / data_mode / pipeline_nodes / dataset_name / run_folder_name
         
         run_folder_path.mkdir(parents=True, exist_ok=True)
         
@@ -76,37 +159,67 @@ class RunManager:
     
     def worker(self, task: Task) -> Tuple[Any, str, int]:
 
-        logger = Logger(db_id=task.db_id, question_id=task.question_id, result_directory=self.result_directory) # 这里保存的json，依靠装饰器
+        logger = Logger(db_id=task.db_id, question_id=task.question_id, result_directory=self.result_directory, journal=self.journal) # 这里保存的json，依靠装饰器
         logger._set_log_level(self.args.log_level)
         logger.log(f"Processing task: {task.db_id} {task.question_id}", "info")
 
-        # 重用预加载的 Manager 实例
-        pipeline_manager = PipelineManager(json.loads(self.args.pipeline_setup))  # 初始化，单例
-        database_manager = DatabaseManager(db_mode=self.args.mode, db_root_path=self.args.db_root_path, db_id=task.db_id) # 根据db_id重新初始化
+        # 每个任务有自己的上下文（数据库路径、节点配置、logger），并发任务之间互不覆盖
+        database_manager = DatabaseManager(db_mode=self.args.mode, db_root_path=self.args.db_root_path, db_id=task.db_id)
+        context = TaskContext(task, database_manager, self.pipeline_setup, logger)
         # arctic_manager 已经在 main 中预加载
-        initial_state = {"keys": {"task": task, "execution_history": []}} 
-
-        print(f'处理 question id:{task.question_id}. 建立工作流 ...')
-        self.app = build_pipeline(self.args.pipeline_nodes)
-        print("Pipeline built successfully.")
-
-        if hasattr(self.app, 'nodes'):
-            # 获取最后一个节点的键
-            if self.app.nodes:  # 确保字典不为空
-                last_node_key = list(self.app.nodes.keys())[-1]  # 获取最后一个键
-                print('checkpoint final: ',last_node_key)  # 如果你需要查看最后一个节点，可以保留这一行
-            else:
-                last_node_key = None  # 如果没有节点，设置为 None
-        else:
-            last_node_key = None  # 如果没有 nodes 属性，设置为 None
-
-        for state in self.app.stream(initial_state):  # 在这里执行工作流
-            continue
-
-        return state[last_node_key], task.db_id, task.question_id
+        # 续跑时预先放入已完成节点的结果，node_decorator 会跳过这些节点
+        initial_state = {"keys": {"task": task, "execution_history": list(task.resumed_history), "final_node": self.final_node}} 
+        # 之前的运行已经短路时沿用当时的决定，不再重新评估 early_exit 规则
+        short_circuit = resumed_short_circuit(task.resumed_history)
+        if short_circuit is not None:
+            initial_state["keys"]["short_circuit"] = short_circuit
+        if self.journal is not None:
+            for step in task.resumed_history:
+                self.journal.append(task.question_id, task.db_id, step)
+
+        print(f'处理 question id:{task.question_id}. 运行工作流 ...')
+        start_time = time.perf_counter()
+        queue_wait = start_time - task.enqueued_at if task.enqueued_at is not None else None
+        metrics = MetricsRecorder()
+        tracer = Tracer()
+        with context.activate(), metrics.scope(question_id=task.question_id, db_id=task.db_id), \
+                tracer.span(f"question {task.question_id}", "question", question_id=task.question_id, db_id=task.db_id):
+            state = self.app.invoke(initial_state)  # 在这里执行工作流
+            pipeline_time = time.perf_counter() - start_time
+            metrics.record("question", wall_time=pipeline_time, queue_wait=queue_wait)
+        tracer.finish_question(task.question_id, task.db_id, self.result_directory)
+
+        # 并行分支的节点耗时会重叠，此时开销按 0 计
+        node_time = sum(state["keys"].get("node_timings", {}).values())
+        overhead = max(pipeline_time - node_time, 0.0)
+        self.executor_overheads.append(overhead)
+        print(f'question id:{task.question_id} 工作流耗时 {pipeline_time:.3f}s，执行器开销 {overhead * 1000:.3f}ms')
+
+        return state, task.db_id, task.question_id
     
 
 
+    def import_histories(self, histories: Dict[Tuple[int, str], List[Dict[str, Any]]]):
+        """
+        Writes finished histories from a resumed run into this run's result directory.
+
+        Args:
+            histories (Dict[Tuple[int, str], List[Dict[str, Any]]]): Histories keyed by (question_id, db_id).
+        """
+        for (question_id, db_id), history in histories.items():
+            file_path = Path(self.result_directory) / f"{question_id}_{db_id}.json"
+            with file_path.open("w") as file:
+                json.dump(history, file, indent=4, ensure_ascii=False)
+            self.record_predictions(question_id, history)
+            self.processed_tasks += 1
+        print(f"从续跑目录导入 {len(histories)} 个已完成的问题")
+
+    def record_predictions(self, question_id: int, execution_history: List[Dict[str, Any]]):
+        """Adds a finished task's predictions to the node files and the final prediction file."""
+        self.aggregator.add(question_id, execution_history)
+        if self.final_aggregator is not None:
+            self.final_aggregator.add(question_id, execution_history)
+
     def task_done(self, log: Tuple[Any, str, int]):
         """
         Callback function when a task is done.
@@ -120,38 +233,30 @@ class RunManager:
         if state is None:
             return
 
+        self.record_predictions(question_id, state["keys"]["execution_history"])
+        self.record_sampling(question_id, state["keys"]["execution_history"])
         self.processed_tasks += 1
+        processed_tasks = self.processed_tasks
+        if self.progress_counter is not None:
+            with self.progress_counter['lock']:
+                self.progress_counter['processed'] += 1
+                processed_tasks = self.progress_counter['processed']
         
-        processed_ratio = self.processed_tasks / self.total_number_of_tasks
+        processed_ratio = processed_tasks / self.total_number_of_tasks
         progress_length = int(processed_ratio * 100)
         print('\x1b[1A' + '\x1b[2K' + '\x1b[1A')  # Clear previous line
-        print(f"[{'=' * progress_length}>{' ' * (100 - progress_length)}] {self.processed_tasks}/{self.total_number_of_tasks}")
+        print(f"[{'=' * progress_length}>{' ' * (100 - progress_length)}] {processed_tasks}/{self.total_number_of_tasks}  {CostAccountant().progress()}")
 
     
     def generate_sql_files(self):  
-        """Generates SQL files from the execution history."""
-        sqls = {}
-        
+        """Writes the per-node SQL files from the predictions aggregated during the run."""
+        if self.journal is not None:
+            self.journal.close()
+            print(f"从 journal 压缩出 {self.journal.compact()} 个问题的历史文件")
+
+        self.aggregator.flush()
         print('*'*20)
         print(self.result_directory)
-        for file in os.listdir(self.result_directory):
-            print(file)
-            # 只处理任务结果文件，跳过汇总文件（以 - 开头的文件）
-            if file.endswith(".json") and "_" in file and not file.startswith("-"):
-                _index = file.find("_")
-                question_id = int(file[:_index])
-                db_id = file[_index + 1:-5]
-                with open(os.path.join(self.result_directory, file), 'r') as f:
-                    exec_history = json.load(f)
-                    for step in exec_history:
-                        if "sqls" in step:
-                            node_type = step["node_type"]
-                            if node_type not in sqls:
-                                sqls[node_type] = {}
-                            sqls[node_type][question_id] = step["sqls"]
-        print(sqls)    
-        for key, value in sqls.items():
-            with open(os.path.join(self.result_directory, f"-{key}.json"), 'w') as f:
-                json.dump(value, f, indent=2, ensure_ascii=False)
+        for node_type, predictions in self.aggregator.sqls.items():
+            print(f"-{node_type}.json: {len(predictions)} 条")
         return self.result_directory
-        
\ No newline at end of file
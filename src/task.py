@@ -13,6 +13,8 @@ class Task:
         evidence (str): Supporting evidence for the question.
         SQL (Optional[str]): The SQL query associated with the task, if any.
         difficulty (Optional[str]): The difficulty level of the task, if specified.
+        resumed_history (List[Dict[str, Any]]): Finished node results carried over from a resumed run.
+        enqueued_at (Optional[float]): When the task was queued for a worker (time.perf_counter), if known.
     """
     question_id: int = field(init=False)
     db_id: str = field(init=False)
@@ -38,4 +40,6 @@ class Task:
         self.consistency_redundant_columns = task_data.get("consistency_redundant_columns")
         self.inconsistency_redundant_columns = task_data.get("inconsistency_redundant_columns")
         self.example = task_data.get("example")
-        self.execute_history = set()
\ No newline at end of file
+        self.execute_history = set()
+        self.resumed_history = task_data.get("resumed_history", [])  # 断点续跑时已完成节点的结果
+        self.enqueued_at = task_data.get("enqueued_at")  # 进入调度队列的时间(time.perf_counter)，用来统计排队时间
\ No newline at end of file
@@ -0,0 +1,75 @@
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Tuple
+
+from budget import CostAccountant
+
+
+class TaskContext:
+    """
+    The execution context of one task: the task itself, its database paths, the node
+    configuration and the task's logger.
+
+    The active context lives in a ContextVar, so concurrent tasks never see each other's
+    database, and threads started with a copied context (parallel samples, LangGraph
+    branches) see the context of the task that started them.
+    """
+    _current: ContextVar = ContextVar("task_context", default=None)
+
+    def __init__(self, task: Any, database_manager: Any, pipeline_setup: Dict[str, Any], logger: Any):
+        """
+        Initializes the TaskContext.
+
+        Args:
+            task (Any): The task being processed.
+            database_manager (DatabaseManager): The database paths of the task's db_id.
+            pipeline_setup (Dict[str, Any]): The per-node setup dictionary.
+            logger (Logger): The task's logger.
+        """
+        self.task = task
+        self.database_manager = database_manager
+        self.pipeline_setup = pipeline_setup
+        self.logger = logger
+
+    @property
+    def db_path(self):
+        """The path of the task's SQLite file."""
+        return self.database_manager.db_path
+
+    def node_config(self, node_name: str) -> Dict[str, Any]:
+        """Returns the setup of a node, or an empty dict if it has none."""
+        return self.pipeline_setup.get(node_name, {})
+
+    def get_model_para(self) -> Tuple[Dict[str, Any], str]:
+        """
+        Retrieves the setup of the calling node function, degraded by the budget policy (n,
+        ReAct iterations and compaction) once the task or the run has reached an LLM budget cap.
+
+        Returns:
+            Tuple[Dict[str, Any], str]: The node setup and the node name.
+        """
+        node_name = inspect.currentframe().f_back.f_code.co_name
+        return CostAccountant().degrade_config(self.node_config(node_name), str(self.task.question_id)), node_name
+
+    @contextmanager
+    def activate(self) -> Iterator["TaskContext"]:
+        """Makes this the current context for the duration of the block."""
+        token = self._current.set(self)
+        try:
+            yield self
+        finally:
+            self._current.reset(token)
+
+    @classmethod
+    def current(cls) -> "TaskContext":
+        """
+        Returns the context of the task running in the current thread.
+
+        Raises:
+            ValueError: If no task context is active.
+        """
+        context = cls._current.get()
+        if context is None:
+            raise ValueError("No TaskContext is active.")
+        return context
@@ -0,0 +1,198 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List
+
+
+class TaskScheduler:
+    """
+    Hands samples to a pool of workers one at a time through a shared bounded queue.
+
+    A producer thread fills the queue and blocks when it is full (backpressure), so
+    every worker keeps pulling work until the dataset is exhausted instead of
+    finishing a pre-cut batch and idling.
+    """
+    _SENTINEL = object()
+
+    def __init__(self, dataset: List[Dict[str, Any]], num_workers: int, queue_size: int = None):
+        """
+        Initializes the scheduler.
+
+        Args:
+            dataset (List[Dict[str, Any]]): The samples to schedule, in dispatch order.
+            num_workers (int): The number of workers consuming the queue.
+            queue_size (int, optional): Maximum number of queued samples. Defaults to 2 * num_workers.
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.dataset = dataset
+        self.num_workers = num_workers
+        self.queue_size = queue_size if queue_size else 2 * num_workers
+        self.total_number_of_tasks = len(dataset)
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stopped = threading.Event()
+        self._producer = None
+
+    def start(self) -> None:
+        """Starts the producer thread."""
+        self._producer = threading.Thread(target=self._produce, name="TaskScheduler-producer", daemon=True)
+        self._producer.start()
+
+    def stop(self) -> None:
+        """Stops dispatching; workers drain what they already hold and exit."""
+        self._stopped.set()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stopped.is_set():
+            if isinstance(item, dict):
+                # 每次尝试入队时更新，排队时间不包含生产者因队列已满而等待的时间
+                item["enqueued_at"] = time.perf_counter()
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self) -> None:
+        for data in self.dataset:
+            if not self._put(dict(data)):
+                break
+        # 每个 worker 一个结束标记
+        for _ in range(self.num_workers):
+            if not self._put(self._SENTINEL):
+                break
+
+    def stream(self, worker_id: int) -> Iterator[Dict[str, Any]]:
+        """
+        Yields samples for one worker until the queue is exhausted.
+
+        Args:
+            worker_id (int): The identifier of the consuming worker.
+
+        Yields:
+            Dict[str, Any]: The next sample to process.
+        """
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            if item is self._SENTINEL:
+                return
+            yield item
+
+
+class DbAffinityScheduler:
+    """
+    Hands samples to workers grouped by database, so consecutive tasks of a worker reuse the
+    same database (DatabaseManager, SQLite page cache, schema text).
+
+    Database groups are pinned to workers up front, largest first to the least-loaded worker.
+    A worker that runs out of work steals from the worker with the most remaining tasks: the
+    last pending database group if it has several, otherwise the back half of its current one.
+    """
+
+    def __init__(self, dataset: List[Dict[str, Any]], num_workers: int):
+        """
+        Initializes the scheduler.
+
+        Args:
+            dataset (List[Dict[str, Any]]): The samples to schedule.
+            num_workers (int): The number of workers.
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.num_workers = num_workers
+        self.queue_size = len(dataset)
+        self.total_number_of_tasks = len(dataset)
+        self._queues = [deque(shard_tasks(dataset, i, num_workers, "db")) for i in range(num_workers)]
+        for worker_queue in self._queues:
+            # shard_tasks 按 question_id 排序，这里再按数据库聚在一起
+            ordered = sorted(worker_queue, key=lambda x: (x["db_id"], x["question_id"]))
+            worker_queue.clear()
+            worker_queue.extend(ordered)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._start_time = time.perf_counter()
+
+    def start(self) -> None:
+        """Marks every task as queued; there is no producer thread."""
+        self._start_time = time.perf_counter()
+
+    def stop(self) -> None:
+        """Stops dispatching; workers exit after their current task."""
+        self._stopped.set()
+
+    def _steal(self, worker_id: int) -> bool:
+        victim = max(range(self.num_workers), key=lambda i: len(self._queues[i]))
+        victim_queue = self._queues[victim]
+        if victim == worker_id or len(victim_queue) < 2:
+            return False
+        last_db = victim_queue[-1]["db_id"]
+        tail_size = 0
+        for data in reversed(victim_queue):
+            if data["db_id"] != last_db:
+                break
+            tail_size += 1
+        steal_size = tail_size if tail_size < len(victim_queue) else len(victim_queue) // 2
+        stolen = [victim_queue.pop() for _ in range(steal_size)]
+        self._queues[worker_id].extend(reversed(stolen))
+        return True
+
+    def stream(self, worker_id: int) -> Iterator[Dict[str, Any]]:
+        """
+        Yields samples for one worker until no worker has work left to steal.
+
+        Args:
+            worker_id (int): The identifier of the consuming worker.
+
+        Yields:
+            Dict[str, Any]: The next sample to process.
+        """
+        while not self._stopped.is_set():
+            with self._lock:
+                if not self._queues[worker_id] and not self._steal(worker_id):
+                    return
+                data = self._queues[worker_id].popleft()
+            yield {**data, "enqueued_at": self._start_time}
+
+
+def shard_tasks(dataset: List[Dict[str, Any]], shard_index: int, shard_count: int, shard_by: str = "db") -> List[Dict[str, Any]]:
+    """
+    Deterministically selects the samples of one shard, so several machines can split a dataset.
+
+    With shard_by="db" all questions of a database land on the same shard: databases are
+    assigned largest first to the shard with the fewest questions so far (ties go to the lower
+    db_id / shard index). With shard_by="question" samples are dealt round-robin in question_id order.
+
+    Args:
+        dataset (List[Dict[str, Any]]): All samples.
+        shard_index (int): The shard to return, in [0, shard_count).
+        shard_count (int): The number of shards.
+        shard_by (str, optional): "db" or "question".
+
+    Returns:
+        List[Dict[str, Any]]: The samples of the shard, in question_id order.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index must be in [0, {shard_count}), got {shard_index}")
+    ordered = sorted(dataset, key=lambda x: x["question_id"])
+    if shard_by == "question":
+        return ordered[shard_index::shard_count]
+    if shard_by != "db":
+        raise ValueError(f"Unknown shard_by: {shard_by}")
+
+    db_sizes: Dict[str, int] = {}
+    for data in ordered:
+        db_sizes[data["db_id"]] = db_sizes.get(data["db_id"], 0) + 1
+    loads = [0] * shard_count
+    db_shard = {}
+    for db_id in sorted(db_sizes, key=lambda db: (-db_sizes[db], db)):
+        target = min(range(shard_count), key=lambda i: (loads[i], i))
+        db_shard[db_id] = target
+        loads[target] += db_sizes[db_id]
+    return [data for data in ordered if db_shard[data["db_id"]] == shard_index]
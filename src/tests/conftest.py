@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 测试直接导入 src 下的模块，和 main.py 的运行方式一致
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,59 @@
+import pytest
+
+from cassette import Cassette, CassetteMiss, request_key
+
+MESSAGES = [{"role": "system", "content": "sys"}, {"role": "user", "content": "question"}]
+
+
+def response(text):
+    return {"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+
+
+def test_request_key_ignores_none_params_and_key_order():
+    assert request_key("m", MESSAGES, temperature=0.0, top_p=None) == request_key("m", MESSAGES, temperature=0.0)
+    assert request_key("m", [{"content": "c", "role": "user"}]) == request_key("m", [{"role": "user", "content": "c"}])
+
+
+@pytest.mark.parametrize("other", [
+    {"model": "other"},
+    {"temperature": 0.7},
+    {"n": 2},
+    {"messages": MESSAGES + [{"role": "user", "content": "again"}]},
+])
+def test_request_key_changes_with_request(other):
+    base = {"model": "m", "messages": MESSAGES, "temperature": 0.0, "n": 1}
+    assert request_key(**base) != request_key(**{**base, **other})
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    cassette = Cassette()
+    yield cassette, tmp_path
+    cassette.configure("off")
+
+
+def test_cassette_replays_occurrences_per_scope(cassette):
+    cassette, directory = cassette
+    cassette.configure("record", str(directory))
+    answers = iter(["q1 first", "q1 second", "q2 first"])
+    for scope in ("1", "1", "2"):
+        cassette.send(lambda: response(next(answers)), scope, "m", MESSAGES, temperature=0.7)
+
+    cassette.configure("replay", str(directory))
+    # 同一问题内相同的请求按出现次序回放，不同问题各自从第 0 次开始计数
+    assert cassette.send(None, "2", "m", MESSAGES, temperature=0.7) == response("q2 first")
+    assert cassette.send(None, "1", "m", MESSAGES, temperature=0.7) == response("q1 first")
+    assert cassette.send(None, "1", "m", MESSAGES, temperature=0.7) == response("q1 second")
+    with pytest.raises(CassetteMiss):
+        cassette.send(None, "1", "m", MESSAGES, temperature=0.7)
+    with pytest.raises(CassetteMiss):
+        cassette.send(None, "2", "m", MESSAGES, temperature=0.0)
+
+
+def test_cassette_records_only_successful_responses(cassette):
+    cassette, directory = cassette
+    cassette.configure("record", str(directory))
+    cassette.send(lambda: {"error": "rate limited"}, "1", "m", MESSAGES)
+    cassette.send(lambda: response("ok"), "1", "m", MESSAGES)
+    cassette.configure("replay", str(directory))
+    assert cassette.send(None, "1", "m", MESSAGES) == response("ok")
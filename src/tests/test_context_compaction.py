@@ -0,0 +1,86 @@
+from context_compaction import ReactTranscript, action_of, count_message_tokens, observation_digest
+
+HEAD = [{"role": "system", "content": "You write SQL."}, {"role": "user", "content": "schema " * 200 + "question"}]
+ROWS = ("Execute Success", "The execution returned 3 rows, the first rows is: " + "(1, 'a') " * 100)
+
+
+def response(i):
+    return "Thought: " + "think " * 100 + f"\nAction: execute_sql\nActionInput: SELECT {i}"
+
+
+def transcript(steps, compaction):
+    t = ReactTranscript(list(HEAD), "gpt-4o", compaction)
+    for i in range(steps):
+        t.add_step(response(i), ROWS, "continue")
+    return t
+
+
+def roles(messages):
+    return [m["role"] for m in messages]
+
+
+def test_observation_digest():
+    assert observation_digest(ROWS).startswith("Execute Success: 3 rows, first rows")
+    assert len(observation_digest(ROWS, max_chars=20)) < 80
+    assert observation_digest(("Execute Failed", "no such column: x")) == "Execute Failed: no such column: x"
+    assert observation_digest(("Execute Empty", "The execution returned `Empty`")) == "Execute Empty: returned Empty"
+    assert observation_digest("plain text") == "plain text"
+
+
+def test_action_of_keeps_last_action():
+    assert action_of(response(7)) == "Action: execute_sql\nActionInput: SELECT 7"
+    assert action_of("no action here") == "no action here"
+
+
+def test_without_compaction_resends_everything():
+    t = transcript(3, None)
+    messages = t.messages()
+    assert messages[:2] == HEAD
+    assert roles(messages) == ["system", "user"] + ["assistant", "user"] * 3
+    assert str(ROWS) in messages[2]["content"]
+
+
+def test_compaction_keeps_head_and_recent_steps_verbatim():
+    t = transcript(3, {"keep_recent": 1})
+    messages = t.messages("final")
+    assert messages[:2] == HEAD
+    assert str(ROWS) not in messages[2]["content"] and "3 rows" in messages[2]["content"]
+    assert str(ROWS) in messages[-3]["content"]
+    assert messages[-1] == {"role": "user", "content": "final"}
+    assert t.stats["compacted_steps"] == 2
+    assert t.stats["sent_tokens"] < t.stats["full_tokens"]
+
+
+def test_ceiling_drops_oldest_steps_without_consecutive_user_messages():
+    # 比只保留 Action 的压缩结果再少一些，必须丢掉最早的步骤
+    cut = transcript(4, {"keep_recent": 1})
+    cut_messages = cut._build(cut.steps[:3], cut.steps[3:], 2, 0, 200, None)
+    limit = count_message_tokens(cut_messages, "gpt-4o") - 10
+    t = transcript(4, {"keep_recent": 1, "max_prompt_tokens": limit})
+    messages = t.messages()
+    assert count_message_tokens(messages, "gpt-4o") <= limit
+    assert t.stats["dropped_steps"] >= 1
+    assert "earlier tool steps omitted" in messages[1]["content"]
+    assert roles(messages) == ["system", "user"] + ["assistant", "user"] * (4 - t.stats["dropped_steps"])
+    # 初始消息本身不被修改
+    assert HEAD[1]["content"].endswith("question")
+
+
+def test_ceiling_never_cuts_head_or_latest_step():
+    t = transcript(2, {"keep_recent": 1, "max_prompt_tokens": 10})
+    messages = t.messages()
+    assert messages[0] == HEAD[0]
+    assert messages[1]["content"].startswith(HEAD[1]["content"])
+    assert messages[-2]["content"].startswith(response(1))
+    assert t.stats["dropped_steps"] == 1
+
+
+def test_note_is_added_as_content_part_for_cache_control():
+    head = [{"role": "user", "content": [{"type": "text", "text": "schema " * 200, "cache_control": {"type": "ephemeral"}},
+                                         {"type": "text", "text": "question"}]}]
+    t = ReactTranscript(head, "gpt-4o", {"keep_recent": 1, "max_prompt_tokens": 10})
+    for i in range(3):
+        t.add_step(response(i), ROWS, "continue")
+    content = t.messages()[0]["content"]
+    assert content[:2] == head[0]["content"]
+    assert "earlier tool steps omitted" in content[2]["text"]
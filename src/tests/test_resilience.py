@@ -0,0 +1,164 @@
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import resilience
+from resilience import (CircuitBreaker, CircuitOpenError, LLMHTTPError, LLMRequestError, Resilience,
+                        RetryBudgetExhausted, classify, parse_retry_after)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", fake.monotonic)
+    return fake
+
+
+@pytest.fixture
+def policy():
+    policy = Resilience()
+    policy.configure(max_attempts=3, base_delay=0.0, max_delay=0.0, min_retry_budget=10, failure_threshold=2)
+    yield policy
+    policy.configure()
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.before_request("e")
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("e")
+    assert breaker.rejected == 1
+
+
+def test_breaker_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_request("e")
+    assert breaker.state == "half_open"
+    # 探测请求还没返回时，其他请求直接失败
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("e")
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_request("e")
+
+
+def test_breaker_half_open_probe_reopens_on_failure(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 31
+    breaker.before_request("e")
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("e")
+
+
+def test_parse_retry_after_seconds_and_http_date():
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("not a date") is None
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= parse_retry_after(when) <= 60
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=60), usegmt=True)
+    assert parse_retry_after(past) == 0.0
+
+
+@pytest.mark.parametrize("error, expected", [
+    (LLMHTTPError(429, "slow down"), (True, False)),
+    (LLMHTTPError(408, "timeout"), (True, False)),
+    (LLMHTTPError(503, "unavailable"), (True, True)),
+    (LLMHTTPError(400, "bad request"), (False, False)),
+    (LLMHTTPError(200, "html error page"), (True, False)),
+    (requests.ConnectionError("refused"), (True, True)),
+    (requests.Timeout("timed out"), (True, True)),
+    (ValueError("invalid json"), (True, False)),
+    (KeyError("choices"), (False, False)),
+])
+def test_classify(error, expected):
+    assert classify(error) == expected
+
+
+def test_call_retries_until_success(policy):
+    errors = [LLMHTTPError(503, "down")]
+
+    def send():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert policy.call("http://llm:8000/v1", send) == ("ok", 1)
+    assert policy.requests == 1 and policy.retries == 1
+
+
+def test_call_raises_non_retryable_error(policy):
+    def send():
+        raise LLMHTTPError(400, "bad request")
+
+    with pytest.raises(LLMHTTPError):
+        policy.call("http://llm:8000/v1", send)
+    assert policy.retries == 0
+
+
+def test_call_gives_up_after_max_attempts(policy):
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise LLMHTTPError(429, "slow down")
+
+    with pytest.raises(LLMRequestError):
+        policy.call("http://llm:8000/v1", send)
+    assert len(calls) == 3
+    # 限流不算故障，熔断器保持关闭
+    assert policy.breaker("http://llm:8000/v1").state == "closed"
+
+
+def test_call_fails_fast_when_circuit_open(policy):
+    def send():
+        raise LLMHTTPError(500, "down")
+
+    with pytest.raises(CircuitOpenError):
+        policy.call("http://llm:8000/v1", send)
+    assert policy.breaker("http://llm:8000/other").state == "open"
+
+
+def test_call_honours_retry_budget(policy):
+    policy.configure(max_attempts=5, base_delay=0.0, max_delay=0.0, retry_budget_ratio=0.0, min_retry_budget=1)
+
+    def send():
+        raise LLMHTTPError(429, "slow down")
+
+    with pytest.raises(RetryBudgetExhausted):
+        policy.call("http://llm:8000/v1", send)
+    assert policy.retries == 1 and policy.budget_rejections == 1
+
+
+def test_call_rejects_long_retry_after(policy):
+    policy.configure(max_attempts=3, base_delay=0.0, max_delay=0.0, max_retry_after=5)
+    start = time.monotonic()
+
+    def send():
+        raise LLMHTTPError(429, "slow down", retry_after=60)
+
+    with pytest.raises(LLMRequestError):
+        policy.call("http://llm:8000/v1", send)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,67 @@
+import pytest
+
+from response_cache import ResponseCache
+
+MESSAGES = [{"role": "system", "content": "sys"}, {"role": "user", "content": "question"}]
+
+
+def response(text):
+    return {"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache()
+    cache.configure("rw", str(tmp_path / "cache.sqlite"))
+    yield cache, tmp_path
+    cache.configure("off")
+
+
+def test_response_cache_occurrences_per_scope(cache):
+    cache, tmp_path = cache
+    for text in ("first", "second"):
+        cached, entry = cache.lookup("1", "m", MESSAGES, temperature=0.7)
+        assert cached is None
+        cache.store(entry, "m", response(text))
+    # 每个问题各自计数: 另一个问题里的相同请求从第 0 次开始，命中第一个样本
+    assert cache.lookup("2", "m", MESSAGES, temperature=0.7)[0] == response("first")
+
+    # 新的运行重新计数，第 k 次相同请求命中第 k 个缓存的样本
+    cache.configure("rw", str(tmp_path / "cache.sqlite"))
+    assert cache.lookup("1", "m", MESSAGES, temperature=0.7)[0] == response("first")
+    assert cache.lookup("1", "m", MESSAGES, temperature=0.7)[0] == response("second")
+    assert cache.lookup("1", "m", MESSAGES, temperature=0.7)[0] is None
+    assert cache.lookup("1", "m", MESSAGES, temperature=0.0)[0] is None
+    assert cache.stats == {"hits": 2, "misses": 2, "stores": 0, "evictions": 0}
+
+
+def test_response_cache_deterministic_only(cache):
+    cache, tmp_path = cache
+    cache.configure("rw", str(tmp_path / "cache.sqlite"), deterministic_only=True)
+    assert cache.lookup("1", "m", MESSAGES, temperature=0.7) == (None, None)
+    assert cache.lookup("1", "m", MESSAGES) == (None, None)
+    assert cache.lookup("1", "m", MESSAGES, temperature=None) == (None, None)
+    cached, entry = cache.lookup("1", "m", MESSAGES, temperature=0.0)
+    assert cached is None and entry is not None
+
+
+def test_response_cache_read_only_does_not_store(cache):
+    cache, tmp_path = cache
+    cached, entry = cache.lookup("1", "m", MESSAGES)
+    cache.store(entry, "m", response("ok"))
+    cache.configure("ro", str(tmp_path / "cache.sqlite"))
+    cached, entry = cache.lookup("1", "m", MESSAGES)
+    assert cached == response("ok")
+    cached, entry = cache.lookup("1", "m", MESSAGES)
+    cache.store(entry, "m", response("second"))
+    assert cache.stats["stores"] == 0
+
+
+def test_response_cache_bypass_neither_reads_nor_writes(cache):
+    cache, tmp_path = cache
+    cached, entry = cache.lookup("1", "m", MESSAGES)
+    cache.store(entry, "m", response("ok"))
+    cache.configure("bypass", str(tmp_path / "cache.sqlite"))
+    assert cache.lookup("1", "m", MESSAGES) == (None, None)
+    cache.configure("ro", str(tmp_path / "cache.sqlite"))
+    assert cache.lookup("1", "m", MESSAGES)[0] == response("ok")
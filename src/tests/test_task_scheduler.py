@@ -0,0 +1,80 @@
+import pytest
+
+from task_scheduler import DbAffinityScheduler, TaskScheduler, shard_tasks
+
+
+def dataset(db_sizes):
+    data, question_id = [], 0
+    for db_id, size in db_sizes.items():
+        for _ in range(size):
+            data.append({"question_id": question_id, "db_id": db_id})
+            question_id += 1
+    return data
+
+
+def test_task_scheduler_hands_out_every_sample_once():
+    data = dataset({"a": 7})
+    scheduler = TaskScheduler(data, num_workers=2, queue_size=2)
+    scheduler.start()
+    seen = list(scheduler.stream(0))
+    assert [d["question_id"] for d in seen] == list(range(7))
+    # 排队时间记在副本上，数据集本身不被修改
+    assert all("enqueued_at" in d for d in seen)
+    assert all("enqueued_at" not in d for d in data)
+
+
+def test_task_scheduler_needs_a_worker():
+    with pytest.raises(ValueError):
+        TaskScheduler([], num_workers=0)
+
+
+DB_SIZES = {"a": 9, "b": 7, "c": 5, "d": 4, "e": 3, "f": 2, "g": 1}
+
+
+@pytest.mark.parametrize("shard_by", ["db", "question"])
+def test_shards_partition_the_dataset(shard_by):
+    data = dataset(DB_SIZES)
+    shards = [shard_tasks(data, i, 3, shard_by) for i in range(3)]
+    ids = sorted(d["question_id"] for shard in shards for d in shard)
+    assert ids == list(range(len(data)))
+    for shard in shards:
+        assert [d["question_id"] for d in shard] == sorted(d["question_id"] for d in shard)
+
+
+def test_db_shards_keep_databases_together_and_balance_greedily():
+    data = dataset(DB_SIZES)
+    shards = [shard_tasks(data, i, 3, "db") for i in range(3)]
+    dbs = [{d["db_id"] for d in shard} for shard in shards]
+    assert not (dbs[0] & dbs[1] or dbs[0] & dbs[2] or dbs[1] & dbs[2])
+    # 从大到小分给当前最少的分片: a->0, b->1, c->2, d->2, e->1, f->0, g->2
+    assert dbs == [{"a", "f"}, {"b", "e"}, {"c", "d", "g"}]
+    assert [len(shard) for shard in shards] == [11, 10, 10]
+
+
+def test_db_shards_are_deterministic_across_input_order():
+    data = dataset(DB_SIZES)
+    assert shard_tasks(list(reversed(data)), 1, 3, "db") == shard_tasks(data, 1, 3, "db")
+
+
+def test_question_shards_round_robin():
+    data = dataset({"a": 5})
+    assert [d["question_id"] for d in shard_tasks(data, 1, 2, "question")] == [1, 3]
+
+
+def test_invalid_shard_arguments():
+    with pytest.raises(ValueError):
+        shard_tasks([], 2, 2)
+    with pytest.raises(ValueError):
+        shard_tasks([], 0, 2, "table")
+
+
+def test_db_affinity_scheduler_steals_when_idle():
+    data = dataset({"a": 6, "b": 2})
+    scheduler = DbAffinityScheduler(data, num_workers=2)
+    scheduler.start()
+    first = next(scheduler.stream(0))
+    assert first["db_id"] == "a"
+    stolen = list(scheduler.stream(1))
+    rest = list(scheduler.stream(0))
+    assert sorted(d["question_id"] for d in [first] + stolen + rest) == list(range(8))
+    assert any(d["db_id"] == "a" for d in stolen)
@@ -0,0 +1,156 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Tracer:
+    """
+    A singleton recording nested spans (question -> node -> LLM request / tool call -> SQL) as
+    Chrome trace events, which Perfetto and chrome://tracing open directly.
+
+    The open span lives in a ContextVar, so every span knows its parent, also across threads
+    started with a copied context (parallel samples, LangGraph branches). Tracing is off until
+    configure() is called; disabled spans cost one attribute check.
+
+    Modes:
+        "question": one trace file per question, written when the question finishes.
+        "run": one trace file for the whole run, written at the end of main.
+    """
+    _instance = None
+    _lock = Lock()
+    _current: ContextVar = ContextVar("trace_span", default=None)
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(Tracer, cls).__new__(cls)
+                instance.mode = "off"
+                instance.events: Dict[Any, List[Dict[str, Any]]] = {}
+                instance._events_lock = Lock()
+                instance._ids = itertools.count(1)
+                instance._threads: Dict[int, str] = {}
+                cls._instance = instance
+            return cls._instance
+
+    def configure(self, mode: str) -> None:
+        """
+        Enables or disables tracing.
+
+        Args:
+            mode (str): "off", "question" or "run".
+        """
+        if mode not in ("off", "question", "run"):
+            raise ValueError(f"Unknown trace mode: {mode}")
+        self.mode = mode
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Records the block as a span nested under the currently open span.
+
+        Args:
+            name (str): The span name shown in the viewer.
+            category (str): The span category, e.g. "question", "node", "llm", "tool", "sql", "arctic".
+            **args: Extra values shown with the span.
+
+        Yields:
+            Optional[Dict[str, Any]]: The span's args, to add values found inside the block; None if tracing is off.
+        """
+        if not self.enabled:
+            yield None
+            return
+        parent = self._current.get()
+        span_id = next(self._ids)
+        question_id = args.get("question_id", parent["question_id"] if parent else None)
+        token = self._current.set({"span_id": span_id, "question_id": question_id, "args": args})
+        start = time.time()
+        try:
+            yield args
+        finally:
+            duration = time.time() - start
+            self._current.reset(token)
+            self._add(name, category, start, duration, span_id, parent, question_id, args)
+
+    def record_span(self, name: str, category: str, start: float, duration: float, **args: Any) -> None:
+        """
+        Records an already measured interval as a child of the currently open span.
+
+        Args:
+            start (float): The start time, as returned by time.time().
+            duration (float): The duration in seconds.
+        """
+        if not self.enabled:
+            return
+        parent = self._current.get()
+        question_id = parent["question_id"] if parent else None
+        self._add(name, category, start, duration, next(self._ids), parent, question_id, args)
+
+    def _add(self, name, category, start, duration, span_id, parent, question_id, args) -> None:
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": {"span_id": span_id, "parent_id": parent["span_id"] if parent else None, **args},
+        }
+        with self._events_lock:
+            self._threads[thread.ident] = thread.name
+            self.events.setdefault(question_id, []).append(event)
+
+    def annotate(self, **values: Any) -> None:
+        """Adds values to the innermost open span, e.g. token counts known only at the end of a call."""
+        current = self._current.get() if self.enabled else None
+        if current is not None:
+            current["args"].update(values)
+
+    def sleep(self, seconds: float, reason: str = "retry") -> None:
+        """time.sleep recorded as a span, so waits between retries show up in the trace."""
+        with self.span("sleep", "sleep", seconds=seconds, reason=reason):
+            time.sleep(seconds)
+
+    def _trace(self, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in self._threads.items()
+        ]
+        return {"traceEvents": metadata + sorted(events, key=lambda event: event["ts"]), "displayTimeUnit": "ms"}
+
+    @staticmethod
+    def _dump(path: Path, trace: Dict[str, Any]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False, default=str)
+
+    def finish_question(self, question_id: Any, db_id: str, result_directory: str) -> None:
+        """
+        In "question" mode, writes the question's spans to {result_directory}/traces/{question_id}_{db_id}.trace.json.
+        """
+        if self.mode != "question":
+            return
+        with self._events_lock:
+            events = self.events.pop(question_id, [])
+            trace = self._trace(events)
+        self._dump(Path(result_directory) / "traces" / f"{question_id}_{db_id}.trace.json", trace)
+
+    def write(self, path: str) -> None:
+        """In "run" mode, writes the spans of all questions to one trace file."""
+        if self.mode != "run":
+            return
+        with self._events_lock:
+            trace = self._trace([event for events in self.events.values() for event in events])
+        self._dump(Path(path), trace)
@@ -10,6 +10,9 @@ from contextlib import contextmanager
 from func_timeout import FunctionTimedOut, func_timeout
 import sqlglot
 
+from metrics import MetricsRecorder
+from tracing import Tracer
+
 def get_last_node_result(execution_history: List[Dict[str, Any]], node_type: str) -> Dict[str, Any]:
     """
     Retrieves the last result for a specific node type from the execution history.
@@ -48,6 +51,22 @@ def extract_sql_from_text(text: str) -> List[str]:
     
     return cleaned_sqls
 
+def sql_block_complete(text: str, after: str = None) -> bool:
+    """
+    判断流式输出中是否已经有一个完整的 ```sql 代码块
+    Args:
+        text: 目前收到的文本
+        after: 只看这个标记之后的内容，例如 "<answer>"，避免停在思考过程里的SQL
+    Returns:
+        是否可以停止接收
+    """
+    if after:
+        position = text.find(after)
+        if position < 0:
+            return False
+        text = text[position + len(after):]
+    return re.search(r'```sql\s*(.*?)\s*```', text, re.DOTALL | re.IGNORECASE) is not None
+
 def extract_rule_from_text(text: str) -> List[str]:
     """
     从文本中提取SQL语句     
@@ -101,12 +120,21 @@ def extract_json_from_text(text: str) -> List[str]:
 
 def execute_sql(sql, sqlite_dir, execute_history: set):
     """
-    SQL执行器
+    SQL执行器，执行耗时和状态记入 metrics
     Args:
         sql: sql str
     Returns:
         执行状态，执行结果
     """
+    with MetricsRecorder().timer("sql") as values, Tracer().span("execute_sql", "sql", sql=sql) as span:
+        response = _execute_sql(sql, sqlite_dir, execute_history)
+        values["status"] = response[0]
+        if span is not None:
+            span["status"] = response[0]
+    return response
+
+
+def _execute_sql(sql, sqlite_dir, execute_history: set):
     print("=========== enter tool ===========")
     if not sql:
         return "Execute Failed", "SQL statement is empty"